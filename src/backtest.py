@@ -0,0 +1,162 @@
+# backtest.py
+#
+# Walk-forward backtest of the notebook models. The completed fights are cut at
+# event dates into --folds test windows after the first --min-train share of
+# events; each fold fits a fresh model on every fight before its cutoff and
+# scores the fights up to the next cutoff. Reports AUC, log loss and accuracy
+# per fold and over all folds, and each fold's wall time.
+#
+# Folds run in a process pool. The features and labels are written once as
+# .npy files and every worker memory-maps them, so the data isn't pickled into
+# each task; rows are in event date order, so a fold is just two row offsets.
+#
+# The rows are those of data.parquet (clean_up_for_training of the wide table),
+# read from the wide table feature_engineering.py --incremental keeps in
+# feature_state/, since data.parquet doesn't keep the event dates.
+#
+# Usage: python backtest.py [--model hgb|rf] [--folds 10] [--min-train 0.5] [--workers N] [--output folds.csv]
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+from threadpoolctl import threadpool_limits
+
+import feature_engineering as fe
+import feature_state as fs
+import train_model
+
+# The models of model.ipynb and random_forest.ipynb, as class and parameters
+MODELS = {
+  'hgb': (HistGradientBoostingClassifier, train_model.MODEL_PARAMS),
+  'rf': (RandomForestClassifier, {'n_estimators': 300, 'random_state': 43, 'n_jobs': 1}),
+}
+
+# Set in each worker by init_worker
+_arrays = {}
+
+
+# Completed fights in event order, as features, labels (1 for a red win, as
+# LabelEncoder gives in the notebooks) and event dates
+def load_dataset(state_dir=fs.STATE_DIR):
+  path = state_dir / "wide.parquet"
+  if not path.exists():
+    raise RuntimeError(f"no feature state in {state_dir}, run feature_engineering.py --incremental")
+
+  wide = pd.read_parquet(path)
+  df = fe.clean_up_for_training(wide)
+  event_dates = pd.to_datetime(wide.loc[df.index, 'event_date']).to_numpy()
+
+  completed = ((df['event_status'] == 'completed') & df[train_model.TARGET].notna()).to_numpy()
+  X, y = train_model.training_frame(df)
+  return X.to_numpy(dtype='float64'), (y == 'Red').to_numpy(dtype='int8'), event_dates[completed]
+
+# Folds as (cutoff, train_stop, test_stop) row offsets: train on rows before
+# train_stop, test on train_stop up to test_stop
+def walk_forward_folds(event_dates, folds, min_train):
+  dates = np.unique(event_dates)
+  first = int(len(dates) * min_train)
+  if first < 1 or len(dates) - first < folds:
+    raise ValueError(f"{len(dates)} event dates can't give {folds} folds after {min_train:.0%} of them")
+
+  cutoffs = dates[first:][np.linspace(0, len(dates) - first, folds + 1).astype(int)[:-1]]
+  starts = np.searchsorted(event_dates, cutoffs, side='left')
+  stops = np.append(starts[1:], len(event_dates))
+  return list(zip(cutoffs, starts, stops))
+
+def write_arrays(directory, X, y):
+  paths = {}
+  for name, array in (('X', X), ('y', y)):
+    paths[name] = str(Path(directory) / f"{name}.npy")
+    np.save(paths[name], array)
+  return paths
+
+def init_worker(paths, threads):
+  for name, path in paths.items():
+    _arrays[name] = np.load(path, mmap_mode='r')
+  # One pool worker per core, so models shouldn't start threads of their own
+  if threads:
+    threadpool_limits(threads)
+
+# The notebook model, with `params` in place of its own
+def build_model(model_name, params=None):
+  model_class, defaults = MODELS[model_name]
+  return model_class(**{**defaults, **(params or {})})
+
+def run_fold(model_name, cutoff, train_stop, test_stop, params=None):
+  start = time.perf_counter()
+  X, y = _arrays['X'], _arrays['y']
+  model = build_model(model_name, params)
+  model.fit(X[:train_stop], y[:train_stop])
+
+  y_test = y[train_stop:test_stop]
+  proba = model.predict_proba(X[train_stop:test_stop])[:, 1]
+  # AUC is undefined when a window's fights were all won by one corner
+  auc = roc_auc_score(y_test, proba) if len(np.unique(y_test)) == 2 else np.nan
+
+  return {
+    'cutoff': pd.Timestamp(cutoff).date(),
+    'train': int(train_stop),
+    'test': int(test_stop - train_stop),
+    'auc': auc,
+    'log_loss': log_loss(y_test, proba, labels=[0, 1]),
+    'accuracy': accuracy_score(y_test, proba >= 0.5),
+    'seconds': time.perf_counter() - start,
+    'proba': proba,
+  }
+
+def backtest(model_name='hgb', folds=10, min_train=0.5, workers=None, state_dir=fs.STATE_DIR):
+  X, y, event_dates = load_dataset(state_dir)
+  splits = walk_forward_folds(event_dates, folds, min_train)
+  workers = workers or min(len(splits), os.cpu_count() or 1)
+
+  with tempfile.TemporaryDirectory() as tmp:
+    paths = write_arrays(tmp, X, y)
+    threads = 1 if workers > 1 else None
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(paths, threads)) as pool:
+      futures = [pool.submit(run_fold, model_name, *split) for split in splits]
+      results = [future.result() for future in futures]
+
+  # Over all test windows together
+  first, last = splits[0][1], splits[-1][2]
+  proba = np.concatenate([r.pop('proba') for r in results])
+  y_test = y[first:last]
+  overall = {
+    'auc': roc_auc_score(y_test, proba),
+    'log_loss': log_loss(y_test, proba, labels=[0, 1]),
+    'accuracy': accuracy_score(y_test, proba >= 0.5),
+  }
+  return pd.DataFrame(results), overall
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--model", choices=list(MODELS), default='hgb')
+  parser.add_argument("--folds", type=int, default=10)
+  parser.add_argument("--min-train", type=float, default=0.5, help="share of event dates only ever trained on")
+  parser.add_argument("--workers", type=int, help="processes, default one per core")
+  parser.add_argument("--output", help="write the per-fold table to this CSV")
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  folds, overall = backtest(args.model, args.folds, args.min_train, args.workers)
+  wall = time.perf_counter() - start
+
+  with pd.option_context('display.float_format', '{:.4f}'.format, 'display.width', 120):
+    print(folds.to_string(index=False))
+  print(f"All folds: AUC {overall['auc']:.4f}, log loss {overall['log_loss']:.4f}, accuracy {overall['accuracy']:.4f}")
+  print(f"{len(folds)} folds in {wall:.1f} s wall, {folds['seconds'].sum():.1f} s of fold time")
+
+  if args.output:
+    folds.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,131 @@
+# extract.py
+#
+# Compares the typed, column-pruned fight row extraction with the SELECT * +
+# read_sql + merge_tables path feature_engineering.py used before. Both must
+# give the same rows and values. Each path runs in its own process so their
+# allocations don't mix.
+#
+# Usage: python benchmarks/extract.py [--repeat N]
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pandas as pd
+import pyarrow as pa
+
+import feature_engineering as fe
+
+
+# SELECT * from both tables and merge in pandas, as the pipeline did before
+def select_star_path(engine):
+    fighter_fights = pd.read_sql("SELECT * FROM fighter_fights;", con=engine)
+    fights = pd.read_sql("SELECT * FROM fights;", con=engine)
+    fights = fights.drop(['event_status'], axis=1)
+
+    df = pd.merge(fights, fighter_fights, on='fight_id')
+    df = df.sort_values(by=['fight_id', 'event_id'])
+    drop_cols = [
+        "event_id", "updated_at_x", "updated_at_y", "gender", "red_fighter_name",
+        "blue_fighter_name", "red_status", "blue_status", "winner_id", "loser_id",
+        "result_type", "end_round_time", "time_scheduled", "method_raw"
+    ]
+    df = df.drop(drop_cols, axis=1)
+    df.insert(2, 'fighter_id', df.pop("fighter_id"))
+    df.insert(3, 'opponent_id', df.pop("opponent_id"))
+
+    return df
+
+
+def typed_path(engine):
+    return fe.get_fight_rows(engine)
+
+
+PATHS = {"select-star": select_star_path, "typed": typed_path}
+
+
+# Runs in a child process: times one path, then runs it once more to take the
+# peak of Python/numpy allocations plus Arrow's memory pool
+def run_path(name, repeat):
+    engine = fe.connect_to_postgres()
+    # Warm up the connection pool and lazy imports
+    PATHS[name](engine)
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = PATHS[name](engine)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    del df
+    tracemalloc.start()
+    df = PATHS[name](engine)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak += pa.default_memory_pool().max_memory()
+
+    print(json.dumps({
+        "seconds": best,
+        "peak_mb": peak / 2**20,
+        "frame_mb": df.memory_usage(deep=True).sum() / 2**20,
+        "shape": list(df.shape),
+    }))
+
+
+def check_parity(engine):
+    old = select_star_path(engine).reset_index(drop=True)
+    new = typed_path(engine)
+    old = old[[c for c in new.columns]]
+    old = old.sort_values(['fight_id', 'fighter_id']).reset_index(drop=True)
+    new = new.sort_values(['fight_id', 'fighter_id']).reset_index(drop=True)
+
+    mismatches = []
+    for col in new.columns:
+        a = old[col].astype(object).where(old[col].notna(), None)
+        b = new[col].astype(object).where(new[col].notna(), None)
+        if not a.equals(b):
+            mismatches.append(col)
+    return len(old), len(new), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--run", choices=list(PATHS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_path(args.run, args.repeat)
+        return
+
+    old_rows, new_rows, mismatches = check_parity(fe.connect_to_postgres())
+    print(f"{old_rows} rows before, {new_rows} rows now, mismatched columns: {mismatches or 'none'}")
+
+    results = {}
+    for name in PATHS:
+        out = subprocess.run(
+            [sys.executable, __file__, "--run", name, "--repeat", str(args.repeat)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        results[name] = json.loads(out.strip().splitlines()[-1])
+
+    for name, r in results.items():
+        print(f"{name:12s} {r['seconds'] * 1e3:8.1f} ms  peak {r['peak_mb']:6.1f} MB  frame {r['frame_mb']:6.1f} MB  {r['shape']}")
+    old, new = results["select-star"], results["typed"]
+    print(f"Load time: {old['seconds'] / new['seconds']:.1f}x faster, "
+          f"peak memory: {old['peak_mb'] / new['peak_mb']:.1f}x lower, "
+          f"frame: {old['frame_mb'] / new['frame_mb']:.1f}x smaller")
+
+    if mismatches or old_rows != new_rows:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
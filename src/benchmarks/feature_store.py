@@ -0,0 +1,147 @@
+# feature_store.py
+#
+# Checks the point-in-time lookups of feature_store.py, then times them. Every
+# fighter row of the full rebuild (the 'history' stage) must come back from a
+# lookup of its fighter on its fight's date, except where the fighter had
+# another fight that day, which the store counts from the next day on. The
+# states after each fighter's last fight are checked by building a second
+# store from only the fights before a cutoff date: looked up on that date, it
+# must give what the full store does. Height and reach are left out there, as
+# their missing values are filled with medians over all fighters. Dates before
+# a fighter's first state must raise.
+#
+# Timings are best of --repeat for one fight, a 15 fight card and every row,
+# against pd.merge_asof over the same rows.
+#
+# Usage: python benchmarks/feature_store.py [--repeat N]
+
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+
+import feature_engineering as fe
+import feature_store
+from stage_cache import run_pipeline
+
+TOLERANCE = {'rtol': 1e-9, 'atol': 1e-12}
+
+
+def stage_outputs(engine, names):
+    outputs = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name in names:
+            stop = next(i for i, stage in enumerate(feature_store.PIPELINE) if stage['name'] == name)
+            outputs[name] = run_pipeline(engine, feature_store.PIPELINE[:stop + 1], use_cache=False)
+    return outputs
+
+
+def compare(expected, actual, cols=feature_store.STATE_COLS + ['age']):
+    problems = []
+    for col in cols:
+        a, b = expected[col].to_numpy(dtype=float), actual[col].to_numpy(dtype=float)
+        if not np.allclose(a, b, equal_nan=True, **TOLERANCE):
+            problems.append(col)
+    return problems
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def merge_asof_lookup(rows, fighter_ids, dates):
+    queries = pd.DataFrame({'fighter_id': fighter_ids, 'date': pd.to_datetime(pd.Series(dates))})
+    queries = queries.reset_index().sort_values('date')
+    found = pd.merge_asof(queries, rows.sort_values('as_of_date'), left_on='date', right_on='as_of_date',
+                          by='fighter_id', direction='backward')
+    return found.sort_values('index')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = fe.connect_to_postgres()
+    inputs = ['rates', 'absorb_receive', 'encoded', 'history', 'fighters']
+    stages = stage_outputs(engine, inputs)
+    history = stages['history'].sort_values(feature_store.SEQUENCE_ORDER).reset_index(drop=True)
+    history['fights'] = history.groupby('fighter_id', observed=True).cumcount()
+    dates = pd.to_datetime(history['event_date'].astype(str))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        full_dir = Path(tmp) / "full"
+        rows = feature_store.build_store_rows(*[stages[name] for name in inputs])
+        feature_store.save_store(rows, full_dir)
+        store = feature_store.load_store(full_dir)
+
+        # Every pre-fight row, looked up on its own fight's date
+        rates = stages['rates']
+        fights_that_day = rates.groupby(['fighter_id', 'event_date'], observed=True)['fight_id'].transform('size')
+        doubled = rates.loc[fights_that_day > 1, ['fighter_id', 'event_date']].drop_duplicates()
+        single = history.merge(doubled, on=['fighter_id', 'event_date'], how='left', indicator=True)['_merge'] == 'left_only'
+        single = single.to_numpy()
+        found = feature_store.lookup(store, history.loc[single, 'fighter_id'].tolist(), dates[single])
+        problems = compare(history[single].reset_index(drop=True), found)
+        print(f"{single.sum()} fighter rows looked up on their fight dates ({(~single).sum()} with another fight "
+              f"that day skipped): {'mismatched ' + ', '.join(problems) if problems else 'same as the full rebuild'}")
+
+        # A date before any state must be refused, not fall back to the
+        # previous fighter's last row
+        early = pd.Timestamp(feature_store.FIRST_AS_OF) - pd.Timedelta(days=1)
+        refused = 0
+        for fighter_id in store['positions']:
+            try:
+                feature_store.lookup(store, [fighter_id], [early])
+            except ValueError:
+                refused += 1
+        early_ok = refused == len(store['positions'])
+        print(f"{refused} of {len(store['positions'])} fighters refused a lookup before their first state")
+
+        # States after the last fight, from a store of the fights before the cutoff
+        cutoff = np.sort(dates.unique())[len(dates.unique()) * 3 // 4]
+        before = lambda df: df[pd.to_datetime(df['event_date'].astype(str)) < cutoff]
+        cut_dir = Path(tmp) / "cut"
+        cut_rows = feature_store.build_store_rows(
+            *[before(stages[name]) if name != 'fighters' else stages[name] for name in inputs])
+        feature_store.save_store(cut_rows, cut_dir)
+        cut_store = feature_store.load_store(cut_dir)
+
+        fighters = sorted(set(cut_store['positions']) & set(history.loc[dates >= cutoff, 'fighter_id']))
+        cut_cols = [col for col in feature_store.STATE_COLS + ['age'] if col not in ('height', 'reach')]
+        cut_problems = compare(
+            feature_store.lookup(store, fighters, [cutoff] * len(fighters)),
+            feature_store.lookup(cut_store, fighters, [cutoff] * len(fighters)),
+            cut_cols,
+        )
+        print(f"{len(fighters)} fighters' states after their last fight before {pd.Timestamp(cutoff).date()}: "
+              f"{'mismatched ' + ', '.join(cut_problems) if cut_problems else 'same as the full store'}")
+
+    fighter_ids, lookup_dates = history['fighter_id'].tolist(), dates.tolist()
+    for label, size in (("1 fight", 2), ("15 fight card", 30), (f"{len(history)} rows", len(history))):
+        ids, when = fighter_ids[:size], lookup_dates[:size]
+        store_ms = best_of(args.repeat, feature_store.lookup, store, ids, when) * 1e3
+        search_ms = best_of(args.repeat, feature_store.state_rows, store, ids, when) * 1e3
+        asof_ms = best_of(args.repeat, merge_asof_lookup, store['rows'], ids, when) * 1e3
+        print(f"  {label:18s} lookup {store_ms:7.2f} ms (binary search {search_ms:6.2f} ms)  merge_asof {asof_ms:7.2f} ms")
+
+    if problems or cut_problems or not early_ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# fight_extractor.py
+#
+# Compares the single-pass fight stats extractor with the ItemLoader path the
+# spider used before, on fight pages saved in the response store. Both paths
+# must give the same values for every page.
+#
+# Usage: python benchmarks/fight_extractor.py [--store DIR] [--repeat N]
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scrapy"))
+
+from scrapy.http import HtmlResponse, Request
+
+from crawler.constants import TOTAL_FIELDS, SIG_FIELDS
+from crawler.extractors import extract_fight_stats, STAT_FIELDS
+from crawler.items import FighterFightItem
+from crawler.loaders import FighterFightLoader
+from crawler.response_store import ResponseStore
+
+
+# The per-cell XPath and ItemLoader path, as parse_fighter_fights had it
+def loader_path(response):
+    red = FighterFightLoader(item=FighterFightItem(), response=response)
+    blue = FighterFightLoader(item=FighterFightItem(), response=response)
+
+    total_tds = response.xpath("(//table)//td[@class='b-fight-details__table-col']")
+    for field, td in zip(TOTAL_FIELDS, total_tds):
+        if field is None:
+            continue
+        red.add_value(field, td.xpath("normalize-space(./p[1]/text())").get())
+        blue.add_value(field, td.xpath("normalize-space(./p[2]/text())").get())
+
+    sig_tds = response.xpath("(//table)[3]//td[@class='b-fight-details__table-col']")
+    for field, td in zip(SIG_FIELDS, sig_tds):
+        if field is None:
+            continue
+        red.add_value(field, td.xpath("normalize-space(./p[1]/text())").get())
+        blue.add_value(field, td.xpath("normalize-space(./p[2]/text())").get())
+
+    return dict(red.load_item()), dict(blue.load_item())
+
+
+def extractor_path(response):
+    red, blue = extract_fight_stats(response)
+    return (
+        {k: v for k, v in zip(STAT_FIELDS, red) if v is not None},
+        {k: v for k, v in zip(STAT_FIELDS, blue) if v is not None},
+    )
+
+
+# Fresh responses per run, so neither path reuses a parsed selector
+def load_pages(store):
+    pages = []
+    for entry in store.entries("fight-details"):
+        pages.append((entry["response_url"], store.get_body(entry["digest"])))
+    return pages
+
+
+def make_responses(pages):
+    return [HtmlResponse(url=url, body=body, encoding="utf-8", request=Request(url)) for url, body in pages]
+
+
+def time_path(path, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        responses = make_responses(pages)
+        # Parse the documents up front so only the extraction is timed
+        for response in responses:
+            response.selector
+        start = time.perf_counter()
+        for response in responses:
+            path(response)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=str(Path(__file__).resolve().parents[1] / "scrapy" / "responsestore"))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_pages(ResponseStore(args.store))
+    if not pages:
+        sys.exit(f"No fight pages in {args.store}")
+
+    mismatches = 0
+    for response in make_responses(pages):
+        if loader_path(response) != extractor_path(response):
+            mismatches += 1
+            print(f"Mismatch: {response.url}")
+    print(f"{len(pages)} fight pages, {mismatches} mismatches")
+
+    loader = time_path(loader_path, pages, args.repeat)
+    extractor = time_path(extractor_path, pages, args.repeat)
+    print(f"ItemLoader + XPath: {loader / len(pages) * 1e6:8.1f} us/page")
+    print(f"Single pass:        {extractor / len(pages) * 1e6:8.1f} us/page")
+    print(f"Speedup:            {loader / extractor:8.1f}x")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# fighter_history.py
+#
+# Compares the single-pass fighter history kernel with the streak, wins_by and
+# is_debut functions feature_engineering.py used before, on the rows the
+# pipeline builds from the database and on a larger synthetic history. Both
+# must give the same values for every row.
+#
+# Usage: python benchmarks/fighter_history.py [--fighters N] [--fights N] [--repeat N]
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+
+import feature_engineering as fe
+
+
+# The history functions as the pipeline had them
+def calculate_current_win_streak(df):
+    df = fe.add_fighter_color(df)
+    df = df.sort_values(by=['fighter_id', 'event_date'])
+    df['is_win'] = (df['fighter_color'] == df['winner_color']).astype(int)
+    df['streak_group'] = (
+        df['is_win'] != df.groupby('fighter_id')['is_win'].shift()
+    ).groupby(df['fighter_id']).cumsum()
+    df['running_streak'] = df.groupby(['fighter_id', 'is_win', 'streak_group']).cumcount() + 1
+    df['tmp_win_streak'] = np.where(df['is_win'] == 1, df['running_streak'], 0)
+    df['win_streak'] = df.groupby('fighter_id')['tmp_win_streak'].shift(fill_value=0)
+    return df.drop(columns=['is_win', 'streak_group', 'running_streak', 'tmp_win_streak'])
+
+
+def calculate_current_lose_streak(df):
+    df['is_loss'] = (df['fighter_color'] != df['winner_color']).astype(int)
+    df['streak_group'] = (
+        df['is_loss'] != df.groupby('fighter_id')['is_loss'].shift()
+    ).groupby(df['fighter_id']).cumsum()
+    df['running_streak'] = df.groupby(['fighter_id', 'is_loss', 'streak_group']).cumcount() + 1
+    df['tmp_loss_streak'] = np.where(df['is_loss'] == 1, df['running_streak'], 0)
+    df['lose_streak'] = df.groupby('fighter_id')['tmp_loss_streak'].shift(fill_value=0)
+    return df.drop(columns=['is_loss', 'streak_group', 'running_streak', 'tmp_loss_streak'])
+
+
+def calculate_longest_win_streak(df):
+    df = df.sort_values(['fighter_id', 'event_date'])
+    df['is_win'] = df['fighter_color'] == df['winner_color']
+    streak_group = df['is_win'].ne(df.groupby('fighter_id')['is_win'].shift()).groupby(df['fighter_id']).cumsum()
+    win_streak = df.groupby(['fighter_id', streak_group])['is_win'].cumsum().where(df['is_win'], 0)
+    longest_to_date = win_streak.groupby(df['fighter_id']).cummax()
+    df['longest_win_streak'] = longest_to_date.groupby(df['fighter_id']).shift(1, fill_value=0)
+    return df.drop(columns=['is_win'])
+
+
+def calculating_win_by_columns(df):
+    cols = fe.WIN_BY_COLS
+    df = df.sort_values(by=['fighter_id', 'event_date'])
+    win_mask = (df['winner_color'] == df['fighter_color']).astype(int)
+    wins_by = df[cols].mul(win_mask, axis=0).groupby(df['fighter_id']).cumsum()
+    wins_by = wins_by.groupby(df['fighter_id']).shift(1, fill_value=0)
+    wins_by.columns = fe.WIN_BY_FEATURES
+    df = df.join(wins_by)
+    return df.drop(columns=['finish_type_DEC'] + cols)
+
+
+def add_is_debut_feature(df):
+    df = df.sort_values(by=['event_date', 'fight_id'])
+    df['is_debut'] = (df.groupby('fighter_id').cumcount() == 0).astype(int)
+    return df
+
+
+def old_path(df):
+    df = calculate_current_win_streak(df)
+    df = calculate_current_lose_streak(df)
+    df = calculate_longest_win_streak(df)
+    df = calculating_win_by_columns(df)
+    return add_is_debut_feature(df)
+
+
+def new_path(df):
+    df = fe.calculate_fighter_history(df)
+    return df.sort_values(by=['event_date', 'fight_id'])
+
+
+def database_rows():
+    engine = fe.connect_to_postgres()
+    df = fe.get_fight_rows(engine)
+    df = fe.create_absorb_receive_columns(df)
+    df = fe.calculate_weighted_moving_averages(df)
+    return fe.build_fighter_rows(df, fe.get_fighters_table(engine))
+
+
+# Random fights between `fighters` fighters, one row per fighter per fight,
+# sorted the way the pipeline hands them over
+def synthetic_rows(fighters, fights, seed=0):
+    rng = np.random.default_rng(seed)
+    red = rng.integers(0, fighters, fights)
+    blue = (red + rng.integers(1, fighters, fights)) % fighters
+    days = np.sort(rng.integers(0, 365 * 30, fights))
+    winner = rng.choice(np.array(['Red', 'Blue', None], dtype=object), fights, p=[0.48, 0.48, 0.04])
+    method = rng.integers(0, len(fe.WIN_BY_COLS) + 1, fights)
+
+    fight = pd.DataFrame({
+        'fight_id': [f"fi{i:07d}" for i in range(fights)],
+        'event_date': pd.Timestamp('1995-01-01') + pd.to_timedelta(days, unit='D'),
+        'red_fighter_id': [f"f{i:06d}" for i in red],
+        'blue_fighter_id': [f"f{i:06d}" for i in blue],
+        'winner_color': pd.Series(winner, dtype='str'),
+    })
+    for k, col in enumerate(fe.WIN_BY_COLS + ['finish_type_DEC']):
+        fight[col] = method == k
+
+    df = pd.concat([
+        fight.assign(fighter_id=fight['red_fighter_id']),
+        fight.assign(fighter_id=fight['blue_fighter_id']),
+    ], ignore_index=True)
+    return df.sort_values(['fighter_id', 'event_date', 'fight_id'], ignore_index=True)
+
+
+def compare(name, df, repeat):
+    old = old_path(df.copy())
+    new = new_path(df.copy())
+    cols = fe.HISTORY_COLS
+    same = old.index.equals(new.index) and old[cols].equals(new[cols])
+    print(f"{name}: {len(df)} rows, {'same values' if same else 'MISMATCH'}")
+
+    timings = {}
+    for label, path in (("old", old_path), ("kernel", new_path)):
+        best = None
+        for _ in range(repeat):
+            frame = df.copy()
+            start = time.perf_counter()
+            path(frame)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = best
+    print(f"  five functions: {timings['old'] * 1e3:8.1f} ms")
+    print(f"  kernel:         {timings['kernel'] * 1e3:8.1f} ms ({timings['old'] / timings['kernel']:.1f}x)")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fighters", type=int, default=20000)
+    parser.add_argument("--fights", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-db", action="store_true")
+    args = parser.parse_args()
+
+    ok = True
+    if not args.skip_db:
+        ok &= compare("database", database_rows(), args.repeat)
+    ok &= compare("synthetic", synthetic_rows(args.fighters, args.fights), args.repeat)
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# model_registry.py
+#
+# Times loading a registered model (model_registry.py), mapped and read, against
+# joblib.load of the same fitted Pipeline, best of --repeat after a first load
+# has imported sklearn. Each loaded model must give the same probabilities as
+# the others on the completed fights.
+#
+# Usage: python benchmarks/model_registry.py [--version VERSION] [--registry models] [--repeat N]
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import model_registry
+import train_model
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--version", help="model version, default the current one")
+    parser.add_argument("--registry", default=str(model_registry.REGISTRY_DIR))
+    parser.add_argument("--data", default=str(train_model.DATA_PATH))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    version = args.version or model_registry.current_version(args.registry)
+    directory = model_registry.version_dir(version, args.registry)
+    model_registry.load(version, args.registry)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        joblib_path = Path(tmp) / "model.joblib"
+        joblib.dump(model_registry.load(version, args.registry)['model'], joblib_path)
+
+        timings = {
+            "registry, mapped": best_of(args.repeat, model_registry.load_model_file, directory, True),
+            "registry, read": best_of(args.repeat, model_registry.load_model_file, directory, False),
+            "joblib.load": best_of(args.repeat, joblib.load, joblib_path),
+            "joblib.load, mmap_mode='r'": best_of(args.repeat, joblib.load, joblib_path, 'r'),
+        }
+
+    artifact = model_registry.load(version, args.registry)
+    X, _ = train_model.training_frame(pd.read_parquet(args.data))
+    X = model_registry.validate_features(artifact, X)
+    expected = timings["joblib.load"][1].predict_proba(X)
+    problems = [label for label, (_, model) in timings.items() if not np.array_equal(model.predict_proba(X), expected)]
+
+    status = f"differ: {', '.join(problems)}" if problems else "same probabilities"
+    print(f"Model {version}, {len(X)} fights, {status}")
+    for label, (elapsed, _) in timings.items():
+        print(f"  {label:28s} {elapsed * 1e3:7.2f} ms")
+
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
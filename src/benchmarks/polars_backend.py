@@ -0,0 +1,199 @@
+# polars_backend.py
+#
+# Compares the Polars backend (feature_polars.py) with the pandas stages of
+# feature_engineering.py, on the database and on synthetic fights at 1x, 10x
+# and 100x --fights. Both must give data.parquet the same schema and rows, the
+# same values in every non-float column and floats within --rtol/--atol.
+#
+# Usage: python benchmarks/polars_backend.py [--fights N] [--scales 1 10 100] [--repeat N] [--skip-db]
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+import feature_engineering as fe
+import feature_polars
+
+
+WEIGHT_CLASSES = [
+    "Flyweight", "Bantamweight", "Featherweight", "Lightweight", "Welterweight", "Middleweight",
+    "Light Heavyweight", "Heavyweight", "Women's Strawweight", "Women's Flyweight",
+    "Women's Bantamweight", "Women's Featherweight", "Catch Weight",
+]
+FINISHES = ["KO/TKO", "SUB", "DEC", "DEC", "DQ", "Draw", "NC", "OTHER"]
+DECISIONS = ["U-DEC", "U-DEC", "S-DEC", "M-DEC", "OTHER-DEC"]
+STANCES = ["Orthodox"] * 14 + ["Southpaw"] * 5 + ["Switch"] * 2 + ["Open Stance", "Sideways", None]
+
+
+def pandas_path(fight_rows, fighters):
+    outputs = {"fight_rows": fe.fight_rows_to_pandas(fight_rows), "fighters": fighters.copy()}
+    # encode_categorical_columns prints every column
+    with contextlib.redirect_stdout(io.StringIO()):
+        for stage in fe.PIPELINE:
+            if "tables" not in stage:
+                outputs[stage["name"]] = stage["run"](*[outputs[name] for name in stage["inputs"]])
+    return fe.clean_up_for_training(outputs[fe.PIPELINE[-1]["name"]])
+
+
+def polars_path(fight_rows, fighters):
+    df = feature_polars.feature_plan(fight_rows, fighters).collect().to_pandas()
+    return fe.clean_up_for_training(df)
+
+
+# Random fights shaped like the database: upcoming and one-row fights, missing
+# stats, excluded finishes and stances, fighters without a dob or reach
+def synthetic_inputs(fights, seed=0):
+    rng = np.random.default_rng(seed)
+    fighters = max(fights // 4, 16)
+
+    red = rng.integers(0, fighters, fights)
+    blue = (red + rng.integers(1, fighters, fights)) % fighters
+    dates = pd.Timestamp("1994-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 365 * 30, fights)), unit="D")
+    upcoming = np.arange(fights) >= fights - max(fights // 100, 1)
+
+    finish = rng.choice(FINISHES, fights).astype(object)
+    decision = np.where(finish == "DEC", rng.choice(DECISIONS, fights), None)
+    winner = np.where(rng.random(fights) < 0.5, "Red", "Blue").astype(object)
+    winner[np.isin(finish, ["Draw", "NC"])] = None
+    finish[upcoming], decision[upcoming], winner[upcoming] = None, None, None
+    rounds = rng.choice([3.0, 5.0], fights, p=[0.8, 0.2])
+    end_round = np.minimum(rng.integers(1, 6, fights), rounds).astype(np.int16)
+
+    fight = {
+        "fight_id": np.array([f"fi{i:08d}" for i in range(fights)], dtype=object),
+        "event_date": np.array(dates.date, dtype=object),
+        "weight_class": rng.choice(WEIGHT_CLASSES, fights),
+        "is_title_fight": rng.random(fights) < 0.05,
+        "red_fighter_id": np.array([f"f{i:07d}" for i in red], dtype=object),
+        "blue_fighter_id": np.array([f"f{i:07d}" for i in blue], dtype=object),
+        "winner_color": winner,
+        "end_round": end_round,
+        "total_duration": ((end_round - 1) * 300 + rng.integers(5, 301, fights)).astype(np.int16),
+        "rounds_scheduled": rounds,
+        "finish_type": finish,
+        "decision_type": decision,
+        "referee": rng.choice(np.array(["Herb Dean", "Marc Goddard", "Jason Herzog", None], dtype=object), fights),
+    }
+
+    # One row per corner, and a few fights that lost one of them
+    single = rng.random(fights) < 0.005
+    rows = {col: np.concatenate([values, values[~single]]) for col, values in fight.items()}
+    rows["fighter_id"] = np.concatenate([fight["red_fighter_id"], fight["blue_fighter_id"][~single]])
+    rows["opponent_id"] = np.concatenate([fight["blue_fighter_id"], fight["red_fighter_id"][~single]])
+    rows["event_status"] = np.where(np.concatenate([upcoming, upcoming[~single]]), "upcoming", "completed")
+    n = len(rows["fighter_id"])
+    row_upcoming = rows["event_status"] == "upcoming"
+    for col in fe.FIGHT_STAT_COLUMNS:
+        high = 4 if col in ["knockdowns", "sub_attempts", "reversals"] else 121
+        rows[col] = pd.array(rng.integers(0, high, n), dtype="Int16")
+        rows[col][row_upcoming | (rng.random(n) < 0.01)] = pd.NA
+
+    order = np.lexsort((rows["fighter_id"], rows["fight_id"]))
+    arrays = {}
+    for col, _, arrow_type in fe.FIGHT_ROW_COLUMNS:
+        values = rows[col][order]
+        if arrow_type == fe.CATEGORY:
+            arrays[col] = pa.array(values, type=pa.string()).dictionary_encode()
+        else:
+            arrays[col] = pa.array(values, type=arrow_type, from_pandas=True)
+    fight_rows = pa.table(arrays)
+
+    ids = np.array([f"f{i:07d}" for i in range(fighters)], dtype=object)
+    dob = pd.Timestamp("1970-01-01") + pd.to_timedelta(rng.integers(0, 365 * 30, fighters), unit="D")
+    fighters_table = pd.DataFrame({
+        "fighter_id": pd.Series(ids, dtype="str"),
+        "name": pd.Series([f"Fighter {i}" for i in ids], dtype="str"),
+        "height": np.where(rng.random(fighters) < 0.05, np.nan, rng.integers(62, 81, fighters)).astype(float),
+        "reach": np.where(rng.random(fighters) < 0.12, np.nan, rng.integers(60, 85, fighters)).astype(float),
+        "stance": pd.Series(rng.choice(np.array(STANCES, dtype=object), fighters), dtype="str"),
+        "dob": pd.Series(np.where(rng.random(fighters) < 0.03, None, dob.date), dtype=object),
+    })
+
+    return fight_rows, fighters_table
+
+
+# Schema of the data.parquet each frame would be written as
+def parquet_schema(df):
+    return pa.Schema.from_pandas(df, preserve_index=False).remove_metadata()
+
+
+def compare(name, fight_rows, fighters, repeat, rtol, atol):
+    expected = pandas_path(fight_rows, fighters)
+    actual = polars_path(fight_rows, fighters)
+
+    problems = []
+    if not parquet_schema(expected).equals(parquet_schema(actual)):
+        problems.append("schema")
+    elif len(expected) != len(actual):
+        problems.append(f"{len(expected)} rows vs {len(actual)}")
+    else:
+        expected = expected.reset_index(drop=True)
+        worst = 0.0
+        for col in expected.columns:
+            a, b = expected[col], actual[col]
+            if a.dtype.kind == "f":
+                a, b = a.to_numpy(), b.to_numpy()
+                finite = np.isfinite(a) & np.isfinite(b)
+                worst = max(worst, np.abs(a[finite] - b[finite]).max(initial=0.0))
+                if not np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True).all():
+                    problems.append(col)
+            elif not a.equals(b):
+                problems.append(col)
+
+    status = f"mismatched: {', '.join(problems)}" if problems else f"same output, floats differ by at most {worst:.1e}"
+    print(f"{name}: {fight_rows.num_rows} fight rows -> {len(expected)} fights, {status}")
+
+    timings = {}
+    for label, path in (("pandas", pandas_path), ("polars", polars_path)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            path(fight_rows, fighters)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = best
+    print(f"  pandas: {timings['pandas'] * 1e3:9.1f} ms")
+    print(f"  polars: {timings['polars'] * 1e3:9.1f} ms ({timings['pandas'] / timings['polars']:.1f}x)")
+
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fights", type=int, default=2000)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--rtol", type=float, default=1e-9)
+    # Rates like StrDef subtract two moving averages, so equal ones can come
+    # out as 0 on one side and 1e-16 on the other
+    parser.add_argument("--atol", type=float, default=1e-12)
+    parser.add_argument("--skip-db", action="store_true")
+    args = parser.parse_args()
+
+    print(f"Polars threads: {pl.thread_pool_size()}")
+    ok = True
+    if not args.skip_db:
+        engine = fe.connect_to_postgres()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fighters = fe.get_fighters_table(engine)
+        ok &= compare("database", fe.copy_fight_rows(engine), fighters, args.repeat, args.rtol, args.atol)
+    for scale in args.scales:
+        fight_rows, fighters = synthetic_inputs(args.fights * scale)
+        ok &= compare(f"synthetic x{scale}", fight_rows, fighters, args.repeat, args.rtol, args.atol)
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
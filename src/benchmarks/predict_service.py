@@ -0,0 +1,136 @@
+# predict_service.py
+#
+# Checks the prediction service (predict_service.py) against the full
+# rebuild, then times it. For every upcoming fight that is both fighters' next
+# one, the row the service assembles from feature_state/ must equal the row
+# clean_up_for_training gives. Then the service scores one fight and a whole
+# card, best of --repeat, in process and over HTTP.
+#
+# Needs a current feature_state/ (run feature_engineering.py --incremental).
+#
+# Usage: python benchmarks/predict_service.py [--version VERSION] [--registry models] [--repeat N]
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+
+import feature_engineering as fe
+import model_registry
+import predict_service
+from stage_cache import run_pipeline
+
+
+# Upcoming fights of the full rebuild that are both fighters' only fight after
+# their last counted one, as requests and as the training rows
+def upcoming_requests(engine, index):
+    with contextlib.redirect_stdout(io.StringIO()):
+        wide = run_pipeline(engine, fe.PIPELINE, use_cache=False)
+        rows = fe.get_fight_rows(engine)
+
+    last_counted = pd.Series(index['last_event_date'], index=list(index['positions']), name='last_event_date')
+    rows = rows.join(last_counted, on='fighter_id')
+    pending = rows[~(pd.to_datetime(rows['event_date']) <= rows['last_event_date'])]
+    pending = pending.groupby('fighter_id', observed=True).size()
+
+    wide = wide[wide['event_status'] == 'upcoming']
+    wide = wide[
+        wide['R_fighter_id'].map(pending).eq(1) & wide['B_fighter_id'].map(pending).eq(1)
+    ].sort_values(['event_date', 'fight_id'])
+
+    cleaned = wide[predict_service.WEIGHT_CLASS_DUMMIES].idxmax(axis=1).str[len('weight_class_'):]
+    requests = [
+        {
+            'red_fighter_id': fight.R_fighter_id,
+            'blue_fighter_id': fight.B_fighter_id,
+            'weight_class': index['weight_classes'][weight_class],
+            'rounds': fight.rounds_scheduled,
+            'date': str(fight.event_date),
+            'is_title_fight': bool(fight.is_title_fight),
+        }
+        for fight, weight_class in zip(wide.itertuples(), cleaned)
+    ]
+    return requests, fe.clean_up_for_training(wide)
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode(), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--version", help="model version, default the current one")
+    parser.add_argument("--registry", default=str(model_registry.REGISTRY_DIR))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    service = predict_service.load_service(args.version, args.registry)
+    print(f"Loaded model and {len(service['index']['positions'])} fighters in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    requests, expected = upcoming_requests(fe.connect_to_postgres(), service['index'])
+    if not requests:
+        sys.exit("No upcoming fights to check against")
+
+    features = service['artifact']['features']
+    fights = predict_service.parse_fights(service['index'], requests)
+    actual = predict_service.matchup_features(service['index'], fights, features)
+    expected = expected[features].reset_index(drop=True)
+
+    problems = []
+    for col in features:
+        a, b = expected[col].to_numpy(dtype=float), actual[col].to_numpy(dtype=float)
+        if not np.array_equal(a, b, equal_nan=True):
+            problems.append(col)
+    status = f"mismatched: {', '.join(problems)}" if problems else "same features as the full rebuild"
+    print(f"{len(requests)} upcoming fights, {status}")
+
+    model = service['artifact']['model']
+    card = (requests * 15)[:15]
+    timings = {
+        "1 fight, predict_proba only": best_of(args.repeat, model.predict_proba, actual.iloc[:1]),
+        "1 fight": best_of(args.repeat, predict_service.predict, service, requests[:1]),
+        "15 fight card": best_of(args.repeat, predict_service.predict, service, card),
+    }
+
+    predict_service.PredictionHandler.service = service
+    predict_service.PredictionHandler.log_message = lambda *a: None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), predict_service.PredictionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    timings["1 fight over HTTP"] = best_of(args.repeat, post, f"{url}/predict", requests[0])
+    timings["15 fight card over HTTP"] = best_of(args.repeat, post, f"{url}/predict/card", {'fights': card})
+    server.shutdown()
+
+    for label, elapsed in timings.items():
+        print(f"  {label:28s} {elapsed * 1e3:7.2f} ms")
+
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# sql_view.py
+#
+# Compares the sql backend (feature_view.py) with the pandas stages of
+# feature_engineering.py on the database. Both must give data.parquet the same
+# schema and rows, the same values in every non-float column and floats within
+# --rtol/--atol. Then times, best of --repeat, the part the view replaces: the
+# rows each backend copies out of Postgres, Python's time turning them into
+# the rates stage, and the refresh a read pays once the fight tables changed.
+#
+# Usage: python benchmarks/sql_view.py [--repeat N] [--rtol R] [--atol A]
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+
+import feature_engineering as fe
+import feature_view
+from stage_cache import run_pipeline
+from polars_backend import parquet_schema
+
+
+def quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def full_rebuild(engine, stages):
+    return fe.clean_up_for_training(quiet(run_pipeline, engine, stages, False))
+
+
+def pandas_rates(engine):
+    fight_rows = fe.copy_fight_rows(engine)
+    start = time.process_time()
+    df = fe.fight_rows_to_pandas(fight_rows)
+    df = fe.create_absorb_receive_columns(df)
+    df = fe.calculate_weighted_moving_averages(df)
+    df = fe.calculate_rates(df)
+    return fight_rows, time.process_time() - start
+
+
+def view_rates(engine):
+    rates = fe.copy_rows(engine, feature_view.RATES_QUERY, feature_view.RATE_COLUMNS)
+    start = time.process_time()
+    fe.fight_rows_to_pandas(rates)
+    return rates, time.process_time() - start
+
+
+def refresh(engine):
+    conn = engine.raw_connection()
+    try:
+        feature_view.refresh_view(conn)
+    finally:
+        conn.close()
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = (elapsed, result) if best is None or elapsed < best[0] else best
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rtol", type=float, default=1e-9)
+    # Rates like StrDef subtract two moving averages, so equal ones can come
+    # out as 0 on one side and 1e-16 on the other
+    parser.add_argument("--atol", type=float, default=1e-12)
+    args = parser.parse_args()
+
+    engine = fe.connect_to_postgres()
+    quiet(feature_view.update_view, engine)
+
+    expected = full_rebuild(engine, fe.PIPELINE)
+    actual = full_rebuild(engine, feature_view.PIPELINE)
+
+    problems = []
+    if not parquet_schema(expected).equals(parquet_schema(actual)):
+        problems.append("schema")
+    elif len(expected) != len(actual):
+        problems.append(f"{len(expected)} rows vs {len(actual)}")
+    else:
+        worst = 0.0
+        for col in expected.columns:
+            a, b = expected[col], actual[col]
+            if a.dtype.kind == "f":
+                a, b = a.to_numpy(), b.to_numpy()
+                finite = np.isfinite(a) & np.isfinite(b)
+                worst = max(worst, np.abs(a[finite] - b[finite]).max(initial=0.0))
+                if not np.isclose(a, b, rtol=args.rtol, atol=args.atol, equal_nan=True).all():
+                    problems.append(col)
+            elif not a.equals(b):
+                problems.append(col)
+
+    status = f"mismatched: {', '.join(problems)}" if problems else f"same output, floats differ by at most {worst:.1e}"
+    print(f"database: {len(expected)} fights, {status}")
+
+    for label, func in (("pandas", pandas_rates), ("sql", view_rates)):
+        wall, (table, cpu) = best_of(args.repeat, func, engine)
+        print(
+            f"  {label:6s} rates: {wall * 1e3:7.1f} ms wall, {cpu * 1e3:7.1f} ms Python CPU, "
+            f"{table.num_rows} rows x {table.num_columns} columns, {table.nbytes / 2**20:.1f} MB"
+        )
+    wall, _ = best_of(args.repeat, refresh, engine)
+    print(f"  refresh concurrently: {wall * 1e3:7.1f} ms")
+
+    for label, stages in (("pandas", fe.PIPELINE), ("sql", feature_view.PIPELINE)):
+        wall, _ = best_of(args.repeat, full_rebuild, engine, stages)
+        print(f"  {label:6s} full rebuild: {wall * 1e3:7.1f} ms")
+
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
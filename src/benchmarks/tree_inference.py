@@ -0,0 +1,86 @@
+# tree_inference.py
+#
+# Checks the compiled models of tree_inference.py against sklearn's
+# predict_proba, then times both for a single fight, one 15 fight card and
+# 10,000 fights, best of --repeat. Covers the registered HistGradientBoosting
+# model and the notebook's RandomForest, fitted here on the same fights.
+# Batches are completed fights drawn with replacement.
+#
+# Usage: python benchmarks/tree_inference.py [--version VERSION] [--registry models] [--repeat N]
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import model_registry
+import train_model
+import tree_inference
+
+BATCH_SIZES = [1, 15, 10_000]
+
+TOLERANCE = {'rtol': 1e-9, 'atol': 1e-12}
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--version", help="model version, default the current one")
+    parser.add_argument("--registry", default=str(model_registry.REGISTRY_DIR))
+    parser.add_argument("--data", default=str(train_model.DATA_PATH))
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    artifact = model_registry.load(args.version, args.registry)
+    X, y = train_model.training_frame(pd.read_parquet(args.data))
+    X = model_registry.validate_features(artifact, X)
+
+    forest = backtest.build_model('rf')
+    forest.fit(X, (y == 'Red').astype(int))
+    models = {'hgb': artifact['model'], 'rf': forest}
+
+    rows = np.random.default_rng(0).integers(len(X), size=max(BATCH_SIZES))
+    batch = X.iloc[rows].reset_index(drop=True)
+
+    failed = False
+    for name, model in models.items():
+        start = time.perf_counter()
+        compiled = tree_inference.compile_model(model)
+        compile_ms = (time.perf_counter() - start) * 1e3
+
+        expected = model.predict_proba(batch)
+        actual = tree_inference.predict_proba(compiled, batch)
+        same = np.allclose(actual, expected, **TOLERANCE)
+        failed |= not same
+        status = "matches sklearn" if same else "DIFFERS from sklearn"
+        print(f"{name}: {len(compiled['roots'])} trees, {len(compiled['left'])} nodes, compiled in {compile_ms:.0f} ms, "
+              f"{status} (max difference {np.abs(actual - expected).max():.1e})")
+
+        for size in BATCH_SIZES:
+            rows = batch.iloc[:size]
+            sklearn_ms = best_of(args.repeat, model.predict_proba, rows) * 1e3
+            compiled_ms = best_of(args.repeat, tree_inference.predict_proba, compiled, rows) * 1e3
+            print(f"  {size:6d} fights  sklearn {sklearn_ms:8.2f} ms  compiled {compiled_ms:8.2f} ms  "
+                  f"{sklearn_ms / compiled_ms:6.1f}x")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
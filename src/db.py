@@ -0,0 +1,135 @@
+# db.py
+#
+# Connections to the ufc database. The DSN comes from POSTGRES_DSN, or from
+# POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER, POSTGRES_DB and
+# POSTGRES_PASSWORD, falling back to the local database.
+#
+# Each process has one SQLAlchemy engine and so one connection pool. pandas
+# reads go through the engine. psycopg2 code (the Scrapy spider and pipeline,
+# create_tables.py, the COPY readers) borrows raw connections from the same
+# pool with connect() or connection(), and close() hands them back. The pool's
+# counters are in pool_stats().
+
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+from sqlalchemy import create_engine, event
+
+DEFAULTS = {
+    "host": "localhost",
+    "port": "5432",
+    "user": "erickim",
+    "dbname": "ufc",
+}
+
+ENVIRONMENT = {
+    "host": "POSTGRES_HOST",
+    "port": "POSTGRES_PORT",
+    "user": "POSTGRES_USER",
+    "dbname": "POSTGRES_DB",
+    "password": "POSTGRES_PASSWORD",
+}
+
+POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", 5))
+POOL_MAX_OVERFLOW = int(os.getenv("POSTGRES_POOL_MAX_OVERFLOW", 5))
+
+_engine = None
+_engine_pid = None
+_lock = threading.Lock()
+_stats = {}
+
+
+# A libpq DSN, either POSTGRES_DSN as given or built from its parts
+def dsn():
+    if os.getenv("POSTGRES_DSN"):
+        return os.environ["POSTGRES_DSN"]
+
+    parts = dict(DEFAULTS)
+    for key, variable in ENVIRONMENT.items():
+        if os.getenv(variable):
+            parts[key] = os.environ[variable]
+    return make_dsn(**parts)
+
+
+def reset_stats():
+    _stats.update(opened=0, checkouts=0, checkins=0, invalidated=0, peak_checked_out=0)
+
+
+def track_pool(engine):
+    pool = engine.pool
+
+    @event.listens_for(pool, "connect")
+    def on_connect(dbapi_connection, record):
+        _stats["opened"] += 1
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, record, proxy):
+        _stats["checkouts"] += 1
+        _stats["peak_checked_out"] = max(_stats["peak_checked_out"], pool.checkedout())
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, record):
+        _stats["checkins"] += 1
+
+    @event.listens_for(pool, "invalidate")
+    def on_invalidate(dbapi_connection, record, exception):
+        _stats["invalidated"] += 1
+
+
+# The process's engine, created on first use. A forked child builds its own
+# rather than sharing the parent's sockets.
+def get_engine():
+    global _engine, _engine_pid
+    with _lock:
+        if _engine is None or _engine_pid != os.getpid():
+            _engine = create_engine(
+                "postgresql+psycopg2://",
+                creator=lambda: psycopg2.connect(dsn()),
+                pool_size=POOL_SIZE,
+                max_overflow=POOL_MAX_OVERFLOW,
+                pool_pre_ping=True,
+            )
+            _engine_pid = os.getpid()
+            reset_stats()
+            track_pool(_engine)
+        return _engine
+
+
+# A pooled psycopg2 connection. Commit or roll back as usual, close() returns
+# it to the pool.
+def connect():
+    return get_engine().raw_connection()
+
+
+@contextmanager
+def connection():
+    conn = connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# Prepares `sql` on the connection as `name`, once per pooled connection, so
+# `EXECUTE name (...)` skips parsing and planning. Prepared statements outlive
+# the transaction, and a rollback, on the server session.
+def prepare(conn, cursor, name, sql):
+    prepared = conn.info.setdefault("prepared", set())
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {sql}")
+        prepared.add(name)
+
+
+# Counters since the engine was created, plus the pool's current state
+def pool_stats():
+    pool = get_engine().pool
+    return {
+        **_stats,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
@@ -0,0 +1,239 @@
+# feature_polars.py
+#
+# The full rebuild of feature_engineering.py as one lazy Polars query, run with
+# `python feature_engineering.py --backend polars`. Polars plans the whole chain
+# before running it, so columns are only materialised where a stage needs them
+# and each stage's expressions run on all cores.
+#
+# Each function mirrors the pandas stage of the same name and the output has the
+# same columns, dtypes and rows. Floats can differ from pandas in the last bit,
+# Polars' ewm_mean sums in a different order.
+
+import polars as pl
+
+import feature_engineering as fe
+
+SEQUENCE_ORDER = ['fighter_id', 'event_date', 'fight_id']
+
+CATEGORICAL_COLS = ['weight_class', 'finish_type', 'decision_type', 'stance']
+
+
+# Per-group windows (.over) run once per group, which is slow with tens of
+# thousands of fighters and fights. The helpers below express them as
+# whole-column operations on frames sorted by group, from each row's number
+# and the number of its group's first row.
+def with_group_rows(lf, key):
+  first = (pl.col(key) != pl.col(key).shift(1)).fill_null(True)
+  lf = lf.with_row_index('row').with_columns(pl.col('row').cast(pl.Int64))
+  return lf.with_columns(first_row=pl.when(first).then(pl.col('row')).forward_fill())
+
+def is_first_row():
+  return pl.col('row') == pl.col('first_row')
+
+def shift_in_group(expr, fill_value=None):
+  return pl.when(is_first_row()).then(fill_value).otherwise(expr.shift(1))
+
+def forward_fill_in_group(expr):
+  last_valid = pl.when(expr.is_not_null()).then(pl.col('row')).forward_fill()
+  return pl.when(last_valid >= pl.col('first_row')).then(expr.forward_fill())
+
+def cum_sum_in_group(expr):
+  total = expr.cum_sum()
+  return total - pl.when(is_first_row()).then(total - expr).forward_fill()
+
+def cum_max_in_group(expr):
+  offset = is_first_row().cum_sum() * (expr.max() + 1)
+  return (expr + offset).cum_max() - offset
+
+# Row number of the other row of the same fight, or of the row itself when a
+# fight only has one. One window, then every opponent column is a gather.
+def with_opponent_rows(lf):
+  lf = lf.with_row_index('fight_row')
+  return lf.with_columns(opponent_row=pl.col('fight_row').reverse().over('fight_id'))
+
+def opponent(col):
+  return pl.col(col).gather(pl.col('opponent_row'))
+
+def create_absorb_receive_columns(lf):
+  lf = with_opponent_rows(lf)
+  lf = lf.with_columns(opponent(col).alias(name) for name, col in fe.ABSORB_RECEIVE.items())
+  return lf.drop(['fight_row', 'opponent_row'])
+
+# pandas' ewm carries the last mean through missing values, Polars leaves them
+# null, hence the forward fill
+def calculate_weighted_moving_averages(lf):
+  lf = with_group_rows(lf.sort(SEQUENCE_ORDER), 'fighter_id')
+  lf = lf.with_columns(
+    pl.col(col).cast(pl.Float64)
+    .ewm_mean(span=fe.EWM_SPAN, adjust=True, ignore_nulls=False)
+    .over('fighter_id')
+    .alias(f"ewm_{col}")
+    for col in fe.EWM_COLUMNS
+  )
+  avg = [shift_in_group(forward_fill_in_group(pl.col(f"ewm_{col}"))).alias(f"avg_{col}") for col in fe.EWM_COLUMNS]
+  return lf.select(fe.AVERAGED_ID_COLS + avg)
+
+def per_duration(col, seconds):
+  return pl.col(col) / (pl.col('avg_total_duration') / seconds)
+
+def where_positive(numerator, denominator):
+  return pl.when(pl.col(denominator) > 0).then(numerator / pl.col(denominator))
+
+def calculate_rates(lf):
+  specs = ['head', 'body', 'leg', 'distance', 'clinch', 'ground']
+  received_less_absorbed = lambda kind: pl.col(f'avg_{kind}_received') - pl.col(f'avg_{kind}_absorbed')
+
+  lf = lf.with_columns(
+    w_SLpM=per_duration('avg_sig_str_landed', 60),
+    w_SApM=per_duration('avg_sig_str_absorbed', 60),
+    w_StrAcc=where_positive(pl.col('avg_sig_str_landed'), 'avg_sig_str_attempted'),
+    w_StrDef=where_positive(received_less_absorbed('sig_str'), 'avg_sig_str_received'),
+    w_TDavg=per_duration('avg_td_landed', 900),
+    w_TDacc=where_positive(pl.col('avg_td_landed'), 'avg_td_attempted'),
+    w_TDdef=where_positive(received_less_absorbed('td'), 'avg_td_received'),
+    w_SubAvg=per_duration('avg_sub_attempts', 900),
+    w_knockdown_avg=per_duration('avg_knockdowns', 900),
+    w_reversal_avg=per_duration('avg_reversals', 900),
+    w_ctrl_time_pct=pl.col('avg_ctrl_time') / pl.col('avg_total_duration'),
+    w_str_eff=where_positive(pl.col('avg_sig_str_landed'), 'avg_tot_str_landed'),
+  ).with_columns(
+    [(pl.col(f'avg_{c}_str_landed') / pl.col('avg_sig_str_landed')).alias(f'w_{c}_ratio') for c in specs] +
+    [
+      pl.when(pl.col(f'avg_{c}_str_attempted') != 0)
+      .then(pl.col(f'avg_{c}_str_landed') / pl.col(f'avg_{c}_str_attempted'))
+      .alias(f'w_{c}_acc')
+      for c in specs
+    ]
+  )
+
+  return calculate_delta_rates(lf)
+
+def calculate_delta_rates(lf):
+  lf = with_opponent_rows(lf).with_columns(
+    [(pl.col(f'w_{c}') - opponent(f'w_{c}')).alias(f'delta_{c}') for c in fe.DELTA_RATES] +
+    [
+      (
+        (pl.col('w_SLpM') - pl.col('w_SApM')) - (opponent('w_SLpM') - opponent('w_SApM'))
+      ).alias('net_str_eff')
+    ]
+  )
+  return lf.drop([f"avg_{col}" for col in fe.EWM_COLUMNS] + ['fight_row', 'opponent_row'])
+
+def merge_fighters_to_main_df(lf, fighters):
+  fighters = fighters.select(['fighter_id', 'name', 'height', 'reach', 'stance', 'dob'])
+  return lf.join(fighters, on='fighter_id', how='left', maintain_order='left')
+
+# pandas' groupby leaves out rows without a weight class, so they keep their NaNs
+def handle_NaNs(lf):
+  has_weight_class = pl.col('weight_class').is_not_null()
+  lf = lf.with_columns(
+    [
+      pl.col(col).fill_null(pl.when(has_weight_class).then(pl.col(col).median().over('weight_class')))
+      for col in ['height', 'reach']
+    ] + [pl.col('stance').fill_null('Orthodox')]
+  )
+  return lf.filter(~pl.col('dob').is_null().any().over('fight_id'))
+
+def encode_categorical_columns(lf):
+  cleaned = {
+    'weight_class': pl.col('weight_class').cast(pl.String)
+      .str.replace_all("'", "", literal=True).str.replace_all(" ", "_", literal=True),
+    'finish_type': pl.col('finish_type').cast(pl.String).str.replace_all("/", "_", literal=True),
+    'decision_type': pl.col('decision_type').cast(pl.String).str.replace_all("-", "_", literal=True),
+    'stance': pl.col('stance').str.replace_all(" ", "_", literal=True),
+  }
+
+  # Only the dummies later stages use, get_dummies' others are never selected
+  dummies = []
+  for name in fe.EXPECTED_DUMMIES:
+    col = next(col for col in CATEGORICAL_COLS if name.startswith(f"{col}_"))
+    dummies.append((cleaned[col] == name[len(col) + 1:]).fill_null(False).alias(name))
+
+  lf = lf.with_columns(dummies).drop(CATEGORICAL_COLS)
+  return lf.filter(~pl.any_horizontal(fe.EXCLUDED_DUMMIES).any().over('fight_id'))
+
+def add_fighter_color(lf):
+  return lf.with_columns(
+    fighter_color=pl.when(pl.col('fighter_id') == pl.col('red_fighter_id')).then(pl.lit('Red')).otherwise(pl.lit('Blue'))
+  )
+
+# The counters of fe.fighter_history: the totals after each fight, shifted
+# down one row to give the values going into it
+def calculate_fighter_history(lf):
+  is_win = pl.col('is_win')
+  lf = with_group_rows(add_fighter_color(lf).sort(SEQUENCE_ORDER), 'fighter_id').with_columns(
+    is_win=(pl.col('fighter_color') == pl.col('winner_color')).fill_null(False)
+  )
+
+  new_run = is_first_row() | (is_win != is_win.shift(1))
+  run_length = pl.col('row') - pl.when(new_run).then(pl.col('row')).forward_fill() + 1
+  lf = lf.with_columns(
+    win_streak=pl.when(is_win).then(run_length).otherwise(0),
+    lose_streak=pl.when(is_win).then(0).otherwise(run_length),
+  ).with_columns(
+    [cum_max_in_group(pl.col('win_streak')).alias('longest_win_streak')] +
+    [
+      cum_sum_in_group((pl.col(col) & is_win).cast(pl.Int64)).alias(feature)
+      for col, feature in zip(fe.WIN_BY_COLS, fe.WIN_BY_FEATURES)
+    ]
+  )
+
+  lf = lf.with_columns(
+    [shift_in_group(pl.col(col), 0).alias(col) for col in fe.HISTORY_COLS[:-1]] +
+    [is_first_row().cast(pl.Int64).alias('is_debut')]
+  )
+  return lf.drop(['row', 'first_row', 'is_win', 'finish_type_DEC'] + fe.WIN_BY_COLS)
+
+def calculate_age(lf):
+  dob, date = pl.col('dob'), pl.col('event_date')
+  before_anniversary = (
+    (date.dt.month() < dob.dt.month()) |
+    ((date.dt.month() == dob.dt.month()) & (date.dt.day() < dob.dt.day()))
+  )
+  age = date.dt.year().cast(pl.Int64) - dob.dt.year().cast(pl.Int64) - before_anniversary.cast(pl.Int64)
+  return lf.with_columns(age=age).drop('dob')
+
+# The first row of each fight is the one with the lower fighter_id, as after
+# the pandas path's stable sort
+def convert_data_to_wide_format(lf):
+  lf = lf.sort(['event_date', 'fight_id', 'fighter_id'])
+
+  def corner(color, prefix):
+    return lf.filter(pl.col('fighter_color') == color).select(
+      [pl.col('fight_id')] + [pl.col(col).alias(f"{prefix}_{col}") for col in fe.WIDE_FIGHTER_COLS]
+    )
+
+  shared = lf.select(fe.WIDE_SHARED_COLS).unique(subset='fight_id', keep='first', maintain_order=True)
+  return (
+    shared
+    .join(corner('Red', 'R'), on='fight_id', how='inner', maintain_order='left')
+    .join(corner('Blue', 'B'), on='fight_id', how='inner', maintain_order='left')
+  )
+
+def create_fighter_attribute_deltas(lf):
+  return lf.with_columns(
+    [(pl.col(f"R_{col}") - pl.col(f"B_{col}")).alias(f"delta_{col}") for col in ['age', 'height', 'reach']]
+  )
+
+# The wide table as a lazy query over the Arrow fight rows (from
+# fe.copy_fight_rows) and the fighters table
+def feature_plan(fight_rows, fighters):
+  lf = pl.from_arrow(fight_rows).lazy()
+  lf = create_absorb_receive_columns(lf)
+  lf = calculate_weighted_moving_averages(lf)
+  lf = calculate_rates(lf)
+  lf = merge_fighters_to_main_df(lf, pl.from_pandas(fighters).lazy())
+  lf = handle_NaNs(lf)
+  lf = encode_categorical_columns(lf)
+  lf = calculate_fighter_history(lf)
+  lf = calculate_age(lf)
+  lf = convert_data_to_wide_format(lf)
+  lf = create_fighter_attribute_deltas(lf)
+
+  return lf
+
+def build_features(engine):
+  fight_rows = fe.copy_fight_rows(engine)
+  fighters = fe.get_fighters_table(engine)
+
+  return feature_plan(fight_rows, fighters).collect().to_pandas()
@@ -0,0 +1,431 @@
+# feature_state.py
+#
+# Incremental feature engineering. The per-fighter running state behind the
+# history features (moving average accumulators, current and longest streaks,
+# wins_by totals, fight count) is kept in feature_state/ between runs, so a run
+# only recomputes the fighters in new or changed fights and swaps those fights
+# into the stored wide table.
+#
+# Changes the state can't absorb fall back to a full rebuild: an edit to a
+# fight that already counts towards a fighter's history, a fight dated before a
+# fighter's latest counted one, a fighter attribute change that moves their
+# fights in or out of the filters, or a change in column dtypes. Either way the
+# output matches running feature_engineering.py from scratch.
+
+import json
+import shutil
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import feature_engineering as fe
+from schema import TABLES
+
+STATE_DIR = Path(__file__).resolve().parent / "feature_state"
+STATE_VERSION = 2
+STATE_FRAMES = ['rows', 'fighters', 'attributes', 'medians', 'wide']
+
+# Rows updated up to this long before the last run's watermark are read again,
+# in case their transaction committed after that run had read past them
+WATERMARK_OVERLAP = timedelta(days=1)
+
+KEYS = ['fight_id', 'fighter_id']
+SEQUENCE_ORDER = ['fighter_id', 'event_date', 'fight_id']
+
+HISTORY_COLS = fe.HISTORY_COLS
+COUNTER_COLS = fe.COUNTER_COLS
+
+# Fighter attributes copied into every row of the fighter's fights
+ATTRIBUTE_COLS = ['name', 'height', 'reach', 'stance', 'dob']
+
+# Stances whose fights encode_categorical_columns drops
+FILTERED_STANCES = ['Sideways', 'Open Stance']
+
+
+class StaleFeatureState(Exception):
+  pass
+
+
+def db_column_types():
+  types = {}
+  for table in ['fights', 'fighter_fights']:
+    for col, col_type in TABLES[table]['columns']:
+      types.setdefault(col, col_type.split()[0].split('(')[0])
+  return types
+
+# Concatenating rows from different reads turns categories into objects
+def normalize_dtypes(df):
+  dtypes = {col: dtype for col, dtype in fe.FIGHT_ROW_DTYPES.items() if col in df.columns}
+  return df.astype(dtypes)
+
+# One hash per fight row, comparable across reads
+def row_hashes(raw):
+  types = db_column_types()
+  canonical = {}
+  for col in raw.columns:
+    values = raw[col].astype(object)
+    if types.get(col) in ['INTEGER', 'BOOLEAN']:
+      canonical[col] = values.where(raw[col].notna(), np.nan).astype('float64')
+    else:
+      canonical[col] = values.where(raw[col].notna(), None)
+
+  return pd.util.hash_pandas_object(pd.DataFrame(canonical, index=raw.index), index=False)
+
+# A row counts towards its fighter's state once the fighter has a completed
+# fight at or after it. Trailing upcoming fights stay pending.
+def mark_committed(rows):
+  rows = rows.sort_values(SEQUENCE_ORDER)
+  completed = rows['event_status'].eq('completed').astype(int)
+  remaining = completed[::-1].groupby(rows['fighter_id'][::-1]).cumsum()[::-1]
+  rows['committed'] = remaining > 0
+
+  return rows
+
+# One step of pandas' ewm(span=EWM_SPAN).mean() with adjust=True and
+# ignore_na=False, on arrays of accumulators
+def ewm_step(weighted, old_wt, values):
+  com = (fe.EWM_SPAN - 1) / 2.0
+  alpha = 1.0 / (1.0 + com)
+  factor = 1.0 - alpha
+
+  seen = weighted == weighted
+  observed = values == values
+
+  old_wt = np.where(seen, old_wt * factor, old_wt)
+  update = seen & observed & (weighted != values)
+  mixed = (old_wt * weighted + values) / (old_wt + 1.0)
+  weighted = np.where(update, mixed, weighted)
+  old_wt = np.where(seen & observed, old_wt + 1.0, old_wt)
+  weighted = np.where(~seen & observed, values, weighted)
+
+  return weighted, old_wt
+
+# Moving averages for rows sorted by SEQUENCE_ORDER, before each row's own
+# fight. Advances the fighters' accumulators (indexed by `positions`) in place.
+def advance_ewm(weighted, old_wt, positions, values, fighter_ids):
+  averages = np.empty_like(values)
+  ranks = fighter_ids.groupby(fighter_ids).cumcount().to_numpy()
+
+  for rank in range(ranks.max() + 1 if len(ranks) else 0):
+    at = ranks == rank
+    pos = positions[at]
+    averages[at] = weighted[pos]
+    weighted[pos], old_wt[pos] = ewm_step(weighted[pos], old_wt[pos], values[at])
+
+  return averages
+
+def read_watermark(engine):
+  query = """
+    SELECT max(updated_at) AS watermark FROM (
+      SELECT updated_at FROM fights
+      UNION ALL
+      SELECT updated_at FROM fighter_fights
+    ) t;
+  """
+  watermark = pd.read_sql(query, con=engine)['watermark'].iloc[0]
+  return None if pd.isna(watermark) else pd.Timestamp(watermark).isoformat()
+
+def filter_signature(fighters):
+  fighters = fighters.set_index('fighter_id')
+  stance = fighters['stance'].fillna('Orthodox')
+  return pd.DataFrame({
+    'dob_missing': fighters['dob'].isnull(),
+    'filtered_stance': stance.isin(FILTERED_STANCES),
+  })
+
+def get_medians(rows, fighters):
+  df = fe.merge_fighters_to_main_df(rows[['fighter_id', 'weight_class']], fighters)
+  return fe.get_weight_class_medians(df)
+
+def build_rows(absorbed, ewm_cols):
+  rows = absorbed[fe.AVERAGED_ID_COLS].join(absorbed[ewm_cols].add_prefix('in_'))
+  return rows
+
+# The wide table for every fight in `rows`, from stored averages and history
+def assemble_wide(rows, fighters, medians, ewm_cols):
+  averaged_cols = fe.AVERAGED_ID_COLS + [f"avg_{c}" for c in ewm_cols]
+  df = fe.build_fighter_rows(rows[averaged_cols].copy(), fighters, medians)
+  if df.empty:
+    return None
+
+  df = fe.add_fighter_color(df)
+  df = df.merge(rows[KEYS + HISTORY_COLS], on=KEYS, how='left')
+  df = df.astype({c: 'int64' for c in HISTORY_COLS})
+  df = fe.calculate_age(df)
+  df = df.sort_values(['event_date', 'fight_id', 'fighter_id'])
+
+  return fe.build_wide_table(df)
+
+def load_state():
+  meta_path = STATE_DIR / "meta.json"
+  if not meta_path.exists():
+    return None
+
+  meta = json.loads(meta_path.read_text())
+  if meta.get('version') != STATE_VERSION:
+    return None
+
+  state = {'meta': meta}
+  for name in STATE_FRAMES:
+    state[name] = pd.read_parquet(STATE_DIR / f"{name}.parquet")
+  state['rows'] = normalize_dtypes(state['rows'])
+
+  return state
+
+# Written to a temporary directory first, so a failed run leaves the old state
+def save_state(state):
+  tmp_dir = STATE_DIR.with_name(STATE_DIR.name + ".tmp")
+  shutil.rmtree(tmp_dir, ignore_errors=True)
+  tmp_dir.mkdir(parents=True)
+
+  for name in STATE_FRAMES:
+    state[name].to_parquet(tmp_dir / f"{name}.parquet", engine="pyarrow", compression="snappy")
+  (tmp_dir / "meta.json").write_text(json.dumps(state['meta'], indent=2))
+
+  old_dir = STATE_DIR.with_name(STATE_DIR.name + ".old")
+  shutil.rmtree(old_dir, ignore_errors=True)
+  if STATE_DIR.exists():
+    STATE_DIR.rename(old_dir)
+  tmp_dir.rename(STATE_DIR)
+  shutil.rmtree(old_dir, ignore_errors=True)
+
+def new_fighter_state(fighter_ids, ewm_cols):
+  fighters = pd.DataFrame(index=pd.Index(fighter_ids, name='fighter_id', dtype='str'))
+  fighters['last_event_date'] = pd.Series(None, index=fighters.index, dtype=object)
+  fighters['last_fight_id'] = pd.Series(None, index=fighters.index, dtype=object)
+  for col in COUNTER_COLS:
+    fighters[col] = 0
+  for col in ewm_cols:
+    fighters[f"ewm_{col}"] = np.nan
+  for col in ewm_cols:
+    fighters[f"ewm_wt_{col}"] = 1.0
+
+  return fighters
+
+# Advance the fighters in `seq` (their pending and changed rows) through the
+# moving averages. Committed rows move the stored accumulators; pending rows
+# are computed from a copy.
+def update_averages(fighters, seq, ewm_cols):
+  weighted_cols = [f"ewm_{c}" for c in ewm_cols]
+  old_wt_cols = [f"ewm_wt_{c}" for c in ewm_cols]
+  weighted = fighters[weighted_cols].to_numpy(dtype='float64', copy=True)
+  old_wt = fighters[old_wt_cols].to_numpy(dtype='float64', copy=True)
+
+  def advance(rows):
+    positions = fighters.index.get_indexer(rows['fighter_id'])
+    values = rows[[f"in_{c}" for c in ewm_cols]].to_numpy(dtype='float64', na_value=np.nan)
+    return advance_ewm(weighted, old_wt, positions, values, rows['fighter_id'])
+
+  averages = np.empty((len(seq), len(ewm_cols)))
+  committed = seq['committed'].to_numpy()
+  averages[committed] = advance(seq[committed])
+  fighters[weighted_cols] = weighted
+  fighters[old_wt_cols] = old_wt
+  averages[~committed] = advance(seq[~committed])
+
+  return averages
+
+def update_history(fighters, seq, encoded):
+  kept = seq[KEYS + ['committed']].merge(encoded, on=KEYS)
+  kept = fe.add_fighter_color(kept).sort_values(SEQUENCE_ORDER)
+
+  def advance(rows):
+    fighter_ids = rows['fighter_id'].to_numpy()
+    start = fighters.loc[pd.unique(fighter_ids), COUNTER_COLS].to_numpy(dtype=np.int64)
+    is_win = (rows['fighter_color'] == rows['winner_color']).to_numpy(dtype=bool)
+    wins_by = rows[fe.WIN_BY_COLS].to_numpy(dtype=np.int64)
+    return fe.fighter_history(fighter_ids, is_win, wins_by, start)
+
+  committed = kept['committed'].to_numpy()
+  features = np.zeros((len(kept), len(HISTORY_COLS)), dtype=np.int64)
+  features[committed], totals = advance(kept[committed])
+  fighters.loc[pd.unique(kept.loc[committed, 'fighter_id']), COUNTER_COLS] = totals
+  features[~committed], _ = advance(kept[~committed])
+
+  history = pd.DataFrame(features, columns=HISTORY_COLS, index=kept.index)
+  return kept[KEYS].join(history)
+
+def rebuild_features(engine):
+  watermark = read_watermark(engine)
+  fighters = fe.get_fighters_table(engine)
+
+  raw = fe.get_fight_rows(engine)
+  hashes = row_hashes(raw)
+  absorbed = fe.create_absorb_receive_columns(raw)
+  ewm_cols = fe.get_ewm_columns(absorbed)
+  averaged = fe.calculate_weighted_moving_averages(absorbed)
+  encoded = fe.build_fighter_rows(averaged.copy(), fighters)
+  df = fe.add_history_features(encoded.copy())
+  wide = fe.build_wide_table(df)
+
+  rows = build_rows(absorbed, ewm_cols)
+  rows = rows.join(averaged[[f"avg_{c}" for c in ewm_cols]])
+  rows['row_hash'] = hashes
+  rows = rows.merge(df[KEYS + HISTORY_COLS], on=KEYS, how='left')
+  rows = rows.astype({c: 'Int64' for c in HISTORY_COLS})
+  rows = normalize_dtypes(mark_committed(rows))
+
+  fighter_state = new_fighter_state(sorted(rows['fighter_id'].unique()), ewm_cols)
+  seq = rows[rows['committed']]
+  update_averages(fighter_state, seq, ewm_cols)
+  update_history(fighter_state, seq, encoded)
+  last = seq.groupby('fighter_id').tail(1).set_index('fighter_id')
+  fighter_state.loc[last.index, 'last_event_date'] = last['event_date']
+  fighter_state.loc[last.index, 'last_fight_id'] = last['fight_id']
+
+  save_state({
+    'meta': {'version': STATE_VERSION, 'watermark': watermark, 'ewm_columns': ewm_cols},
+    'rows': rows.reset_index(drop=True),
+    'fighters': fighter_state,
+    'attributes': fighters[['fighter_id'] + ATTRIBUTE_COLS].reset_index(drop=True),
+    'medians': get_medians(rows, fighters),
+    'wide': wide.reset_index(drop=True),
+  })
+
+  return wide
+
+def frames_differ(old, new):
+  old, new = old.align(new, join='outer')
+  return (old.ne(new) & ~(old.isna() & new.isna())).any(axis=1)
+
+# Fold the rows read since the last run into the stored state. Raises
+# StaleFeatureState when only a full rebuild gives the right answer.
+def apply_changes(state, raw, fighters):
+  ewm_cols = state['meta']['ewm_columns']
+  rows = state['rows']
+  fighter_state = state['fighters']
+
+  changed_fights = []
+  if not raw.empty:
+    hashes = row_hashes(raw)
+    absorbed = fe.create_absorb_receive_columns(raw)
+    if fe.get_ewm_columns(absorbed) != ewm_cols:
+      raise StaleFeatureState("moving average columns changed")
+    incoming = build_rows(absorbed, ewm_cols)
+    incoming['row_hash'] = hashes
+
+    stored = rows.loc[rows['fight_id'].isin(incoming['fight_id']), KEYS + ['row_hash', 'committed']]
+    compared = stored.merge(incoming[KEYS + ['row_hash']], on=KEYS, how='outer', suffixes=('_stored', ''), indicator=True)
+    if (compared['_merge'] == 'left_only').any():
+      raise StaleFeatureState("fighter rows were removed")
+    differs = compared['row_hash'] != compared['row_hash_stored']
+    changed_fights = compared.loc[differs, 'fight_id'].unique()
+
+    if rows.loc[rows['fight_id'].isin(changed_fights), 'committed'].any():
+      raise StaleFeatureState("a counted fight was changed")
+
+  touched = incoming[incoming['fight_id'].isin(changed_fights)] if len(changed_fights) else None
+  affected_fights = set()
+
+  if touched is not None:
+    touched_fighters = touched['fighter_id'].unique()
+    new_fighters = [f for f in touched_fighters if f not in fighter_state.index]
+    if new_fighters:
+      fighter_state = pd.concat([fighter_state, new_fighter_state(new_fighters, ewm_cols)])
+
+    pending = rows[
+      rows['fighter_id'].isin(touched_fighters) & ~rows['committed'] & ~rows['fight_id'].isin(changed_fights)
+    ]
+    seq = pd.concat([pending.drop(columns=['committed']), touched], ignore_index=True)
+    seq = normalize_dtypes(mark_committed(seq))
+
+    first = seq.groupby('fighter_id').head(1).set_index('fighter_id')
+    last = fighter_state.loc[first.index, ['last_event_date', 'last_fight_id']]
+    has_last = last['last_fight_id'].notna()
+    for fighter_id in first.index[has_last]:
+      if (first.at[fighter_id, 'event_date'], first.at[fighter_id, 'fight_id']) <= \
+          (last.at[fighter_id, 'last_event_date'], last.at[fighter_id, 'last_fight_id']):
+        raise StaleFeatureState(f"a fight was added before {fighter_id}'s latest counted fight")
+
+    averages = update_averages(fighter_state, seq, ewm_cols)
+    seq[[f"avg_{c}" for c in ewm_cols]] = averages
+
+    latest = seq[seq['committed']].groupby('fighter_id').tail(1).set_index('fighter_id')
+    fighter_state.loc[latest.index, 'last_event_date'] = latest['event_date']
+    fighter_state.loc[latest.index, 'last_fight_id'] = latest['fight_id']
+
+    replaced = rows['fighter_id'].isin(touched_fighters) & ~rows['committed']
+    replaced |= rows['fight_id'].isin(changed_fights)
+    rows = pd.concat([rows[~replaced], seq.reindex(columns=rows.columns)], ignore_index=True)
+    rows = normalize_dtypes(rows)
+    affected_fights = set(seq['fight_id'])
+
+  # Fighter attributes are read in full each run. Fighters new to the state
+  # only have rows computed from their current attributes.
+  attributes = state['attributes']
+  known = attributes['fighter_id'][attributes['fighter_id'].isin(state['rows']['fighter_id'])]
+  old_signature = filter_signature(attributes).reindex(known, fill_value=True)
+  new_signature = filter_signature(fighters).reindex(known, fill_value=True)
+  if frames_differ(old_signature, new_signature).any():
+    raise StaleFeatureState("a fighter moved in or out of the filters")
+
+  attribute_changes = frames_differ(
+    attributes.set_index('fighter_id')[ATTRIBUTE_COLS],
+    fighters.set_index('fighter_id')[ATTRIBUTE_COLS],
+  )
+  changed_fighters = attribute_changes.index[attribute_changes]
+  affected_fights |= set(rows.loc[rows['fighter_id'].isin(changed_fighters), 'fight_id'])
+
+  # Heights and reaches imputed from a weight class median that moved
+  medians = get_medians(rows, fighters)
+  median_changes = frames_differ(state['medians'], medians)
+  changed_classes = median_changes.index[median_changes]
+  imputed = fe.merge_fighters_to_main_df(rows[KEYS + ['weight_class']], fighters)
+  imputed = imputed[imputed['weight_class'].isin(changed_classes) & imputed[['height', 'reach']].isnull().any(axis=1)]
+  affected_fights |= set(imputed['fight_id'])
+
+  if touched is not None:
+    affected_rows = rows[rows['fight_id'].isin(seq['fight_id'])]
+    averaged_cols = fe.AVERAGED_ID_COLS + [f"avg_{c}" for c in ewm_cols]
+    encoded = fe.build_fighter_rows(affected_rows[averaged_cols].copy(), fighters, medians)
+    history = update_history(fighter_state, seq, encoded)
+
+    rows = rows.set_index(KEYS)
+    in_seq = rows.index.isin(pd.MultiIndex.from_frame(seq[KEYS]))
+    rows.loc[in_seq, HISTORY_COLS] = pd.NA
+    history = history.set_index(KEYS)
+    rows.loc[history.index, HISTORY_COLS] = history[HISTORY_COLS]
+    rows = rows.reset_index().astype({c: 'Int64' for c in HISTORY_COLS})
+
+  wide = state['wide']
+  if affected_fights:
+    new_wide = assemble_wide(rows[rows['fight_id'].isin(affected_fights)], fighters, medians, ewm_cols)
+    wide = wide[~wide['fight_id'].isin(affected_fights)]
+    if new_wide is not None:
+      if not wide.dtypes.equals(new_wide.dtypes):
+        raise StaleFeatureState("column dtypes changed")
+      wide = pd.concat([wide, new_wide], ignore_index=True)
+
+  state.update({
+    'rows': rows,
+    'fighters': fighter_state,
+    'attributes': fighters[['fighter_id'] + ATTRIBUTE_COLS].reset_index(drop=True),
+    'medians': medians,
+    'wide': wide,
+  })
+
+  return wide
+
+def update_features(engine):
+  state = load_state()
+  if state is None or state['meta']['watermark'] is None:
+    print("No feature state, rebuilding")
+    return rebuild_features(engine)
+
+  watermark = read_watermark(engine)
+  since = pd.Timestamp(state['meta']['watermark']) - WATERMARK_OVERLAP
+  raw = fe.get_fight_rows(engine, since)
+  fighters = fe.get_fighters_table(engine)
+
+  try:
+    wide = apply_changes(state, raw, fighters)
+  except StaleFeatureState as e:
+    print(f"Rebuilding features: {e}")
+    return rebuild_features(engine)
+
+  state['meta']['watermark'] = watermark
+  save_state(state)
+
+  return wide
@@ -0,0 +1,249 @@
+# feature_store.py
+#
+# Point-in-time store of every fighter's features, in feature_store/. States
+# are keyed by (fighter_id, as_of_date): the rates, history counters and
+# attributes a fight on or after as_of_date would get in the full rebuild,
+# until the fighter's next fight. There is one state per fight, from the day
+# after the fighter's previous fight (the 'rates' stage, every fight, as the
+# moving averages count them), and one more per fighter, from the day after
+# their last fight, with the state after it. Counters and attributes come from
+# the long per-fighter rows of the 'history' stage, which only keeps fights
+# that pass the filters, as the wide table does.
+#
+# Rows are sorted by fighter_id and as_of_date, with an index of each
+# fighter's first and last row. Lookups binary search one sorted int64 key per
+# row (fighter position, then days since the epoch), so a batch of (fighter,
+# date) pairs is a single np.searchsorted and only ever sees fights before the
+# date: a join without leakage for any matchup, hypothetical or not, without
+# rebuilding the wide table. Dates are whole days, so a fighter's fights on the
+# same day all count from the next day on.
+#
+# Built with `python feature_store.py`, through the stage cache like the full
+# rebuild.
+#
+# Usage: python feature_store.py [--no-cache]
+#        python feature_store.py --lookup FIGHTER_ID DATE
+
+import argparse
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import feature_engineering as fe
+from stage_cache import run_pipeline
+
+STORE_DIR = Path(__file__).resolve().parent / "feature_store"
+STORE_VERSION = 1
+
+KEYS = ['fight_id', 'fighter_id']
+SEQUENCE_ORDER = ['fighter_id', 'event_date', 'fight_id']
+
+RATE_COLS = [f"w_{c}" for c in fe.DELTA_RATES]
+STANCE_COLS = ['stance_Orthodox', 'stance_Southpaw', 'stance_Switch']
+ATTRIBUTE_COLS = ['height', 'reach'] + STANCE_COLS
+
+# Features of each state; age is worked out from dob at lookup
+STATE_COLS = RATE_COLS + fe.COUNTER_COLS + ['is_debut'] + ATTRIBUTE_COLS
+
+# Valid from for each fighter's first state, before any fight
+FIRST_AS_OF = pd.Timestamp("1900-01-01")
+
+
+class UnknownFighter(KeyError):
+  pass
+
+
+def history_stage_index():
+  return next(i for i, stage in enumerate(fe.PIPELINE) if stage['name'] == 'history')
+
+# Each fighter's state after their last fight: moving averages over all their
+# fights, as calculate_weighted_moving_averages takes them before the filters,
+# and counters over the fights left after them
+def final_states(absorbed, encoded):
+  cols = fe.get_ewm_columns(absorbed)
+  absorbed = absorbed.sort_values(SEQUENCE_ORDER)
+  averages = (
+    absorbed.groupby('fighter_id', observed=True)[cols]
+    .ewm(span=fe.EWM_SPAN)
+    .mean()
+    .groupby(level=0)
+    .tail(1)
+    .reset_index(level=1, drop=True)
+  )
+  averages.columns = [f"avg_{c}" for c in cols]
+  rates = fe.calculate_fighter_rates(averages)[RATE_COLS]
+
+  encoded = fe.add_fighter_color(encoded.sort_values(SEQUENCE_ORDER).copy())
+  is_win = (encoded['fighter_color'] == encoded['winner_color']).to_numpy(dtype=bool)
+  wins_by = encoded[fe.WIN_BY_COLS].to_numpy(dtype=np.int64)
+  _, after = fe.fighter_history(encoded['fighter_id'].to_numpy(), is_win, wins_by)
+
+  fighter_ids = encoded['fighter_id'].drop_duplicates()
+  states = pd.DataFrame(after, columns=fe.COUNTER_COLS, index=pd.Index(fighter_ids, name='fighter_id'))
+  states['is_debut'] = False
+  return states.join(rates)
+
+# The store's rows from the pipeline stages, sorted by fighter and as_of_date
+def build_store_rows(rates, absorbed, encoded, history, fighters):
+  history = history.sort_values(SEQUENCE_ORDER).reset_index(drop=True)
+  history['fights'] = history.groupby('fighter_id', observed=True).cumcount()
+
+  # Every fight of the fighters that have features
+  rows = rates[rates['fighter_id'].isin(history['fighter_id'])]
+  rows = rows[KEYS + ['event_date'] + RATE_COLS].sort_values(SEQUENCE_ORDER).reset_index(drop=True)
+  for df in (rows, history):
+    df['event_date'] = pd.to_datetime(df['event_date'].astype(str))
+
+  # Counters and attributes only change at the fights in `history`, so each
+  # fight has those of the next one of them, or the final state after the last
+  final = final_states(absorbed, encoded)
+  last = history.groupby('fighter_id', observed=True).tail(1).set_index('fighter_id')
+  for col in ATTRIBUTE_COLS:
+    final[col] = last[col]
+
+  next_kept = rows[KEYS].merge(history[KEYS].reset_index(names='kept'), on=KEYS, how='left')['kept']
+  next_kept = next_kept.groupby(rows['fighter_id'].to_numpy()).bfill()
+  counted = next_kept.notna().to_numpy()
+  kept_cols = fe.COUNTER_COLS + ['is_debut'] + ATTRIBUTE_COLS
+  values = pd.DataFrame(index=rows.index, columns=kept_cols)
+  values.loc[counted] = history[kept_cols].iloc[next_kept[counted].astype(int)].to_numpy()
+  values.loc[~counted] = final.loc[rows.loc[~counted, 'fighter_id'], kept_cols].to_numpy()
+  rows = rows.join(values)
+
+  previous = rows.groupby('fighter_id', observed=True)['event_date'].shift(1)
+  rows['as_of_date'] = (previous + pd.Timedelta(days=1)).fillna(FIRST_AS_OF)
+
+  final['as_of_date'] = rows.groupby('fighter_id', observed=True)['event_date'].max() + pd.Timedelta(days=1)
+  final['fight_id'] = None
+
+  rows = rows[['fighter_id', 'as_of_date', 'fight_id'] + STATE_COLS]
+  rows = pd.concat([rows, final.reset_index()[rows.columns]], ignore_index=True)
+  rows = rows.astype({col: 'int64' for col in fe.COUNTER_COLS} | {col: bool for col in ['is_debut'] + STANCE_COLS})
+  rows['height'] = rows['height'].astype('float64')
+  rows['reach'] = rows['reach'].astype('float64')
+
+  dob = fighters.set_index('fighter_id')['dob']
+  rows['dob'] = pd.to_datetime(rows['fighter_id'].map(dob))
+
+  # A fight's state is never current when the fighter fought again that day
+  rows = rows.sort_values(['fighter_id', 'as_of_date'], kind='stable')
+  rows = rows.drop_duplicates(['fighter_id', 'as_of_date'], keep='last')
+  return rows.reset_index(drop=True)
+
+# The full rebuild up to the history stage, then the store's rows
+PIPELINE = fe.PIPELINE[:history_stage_index() + 1] + [
+  {'name': 'feature_store', 'run': build_store_rows, 'inputs': ['rates', 'absorb_receive', 'encoded', 'history', 'fighters']},
+]
+
+def build_index(rows):
+  fighter_ids = rows['fighter_id'].to_numpy()
+  starts = np.flatnonzero(np.r_[True, fighter_ids[1:] != fighter_ids[:-1]])
+  stops = np.r_[starts[1:], len(rows)]
+  return pd.DataFrame({'fighter_id': fighter_ids[starts], 'start': starts, 'stop': stops})
+
+# Written to a temporary directory first, so a failed build leaves the old store
+def save_store(rows, store_dir=STORE_DIR):
+  tmp_dir = store_dir.with_name(store_dir.name + ".tmp")
+  shutil.rmtree(tmp_dir, ignore_errors=True)
+  tmp_dir.mkdir(parents=True)
+
+  rows.to_parquet(tmp_dir / "rows.parquet", engine="pyarrow", compression="snappy", index=False)
+  build_index(rows).to_parquet(tmp_dir / "index.parquet", engine="pyarrow", index=False)
+  (tmp_dir / "meta.json").write_text(json.dumps({'version': STORE_VERSION, 'rows': len(rows)}, indent=2))
+
+  shutil.rmtree(store_dir, ignore_errors=True)
+  tmp_dir.rename(store_dir)
+
+def build_store(engine, use_cache=True, store_dir=STORE_DIR):
+  rows = run_pipeline(engine, PIPELINE, use_cache=use_cache)
+  save_store(rows, store_dir)
+  return rows
+
+# Days since the epoch, for the lookup keys
+def epoch_days(dates):
+  return pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+# Fighter position in the index in the high 32 bits, days in the low ones, so
+# sorting by key is sorting by (fighter_id, as_of_date)
+def lookup_keys(positions, days):
+  return (positions.astype(np.int64) << 32) + (days + 2**31)
+
+def load_store(store_dir=STORE_DIR):
+  meta = json.loads((store_dir / "meta.json").read_text())
+  if meta.get('version') != STORE_VERSION:
+    raise RuntimeError(f"feature store in {store_dir} is from another version, rerun feature_store.py")
+
+  rows = pd.read_parquet(store_dir / "rows.parquet")
+  index = pd.read_parquet(store_dir / "index.parquet")
+  row_positions = np.repeat(np.arange(len(index)), (index['stop'] - index['start']).to_numpy())
+
+  return {
+    'rows': rows,
+    'columns': {col: rows[col].to_numpy() for col in STATE_COLS},
+    'dob': rows['dob'].to_numpy(),
+    'as_of_date': rows['as_of_date'].to_numpy(),
+    'positions': {fighter_id: i for i, fighter_id in enumerate(index['fighter_id'])},
+    'starts': index['start'].to_numpy(),
+    'keys': lookup_keys(row_positions, epoch_days(rows['as_of_date'])),
+  }
+
+# Row of each fighter's state as of each date: their last row with an
+# as_of_date on or before it. A date before the fighter's first state would
+# land on the previous fighter's rows, so it is refused.
+def state_rows(store, fighter_ids, dates):
+  try:
+    positions = np.array([store['positions'][fighter_id] for fighter_id in fighter_ids], dtype=np.int64)
+  except KeyError as e:
+    raise UnknownFighter(e.args[0])
+  days = epoch_days(dates)
+  rows = np.searchsorted(store['keys'], lookup_keys(positions, days), side='right') - 1
+
+  before_first = rows < store['starts'][positions]
+  if before_first.any():
+    i = np.flatnonzero(before_first)[0]
+    first = pd.Timestamp(store['as_of_date'][store['starts'][positions[i]]]).date()
+    raise ValueError(f"{list(fighter_ids)[i]} has no state before {first}, asked for {days[i].astype('datetime64[D]')}")
+  return rows
+
+# Features of each fighter as of each date, with their age on it. Only fights
+# before the date count.
+def lookup(store, fighter_ids, dates):
+  rows = state_rows(store, fighter_ids, dates)
+  dates = pd.to_datetime(pd.Series(dates)).to_numpy()
+  # Built column by column from the stored arrays, which keeps their dtypes
+  columns = {'fighter_id': list(fighter_ids), 'date': dates}
+  columns.update((col, values[rows]) for col, values in store['columns'].items())
+  columns['age'] = fe.years_between(store['dob'][rows], dates).astype('int64')
+  columns['as_of_date'] = store['as_of_date'][rows]
+  return pd.DataFrame(columns)
+
+# Both fighters' features for fights on the given dates, as R_ and B_ columns
+# with the attribute deltas of the wide table
+def matchups(store, red_ids, blue_ids, dates):
+  red = lookup(store, red_ids, dates).drop(columns=['date', 'as_of_date']).add_prefix('R_')
+  blue = lookup(store, blue_ids, dates).drop(columns=['date', 'as_of_date']).add_prefix('B_')
+  df = pd.concat([red, blue], axis=1)
+  df.insert(0, 'date', pd.to_datetime(pd.Series(dates)).to_numpy())
+  return fe.create_fighter_attribute_deltas(df)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--no-cache", action="store_true", help="run every stage and leave stage_cache/ untouched")
+  parser.add_argument("--lookup", nargs=2, metavar=("FIGHTER_ID", "DATE"), help="print one fighter's features as of a date")
+  args = parser.parse_args()
+
+  if args.lookup:
+    fighter_id, date = args.lookup
+    print(lookup(load_store(), [fighter_id], [date]).iloc[0].to_string())
+    return
+
+  rows = build_store(fe.connect_to_postgres(), use_cache=not args.no_cache)
+  print(f"Stored {len(rows)} states of {rows['fighter_id'].nunique()} fighters in {STORE_DIR}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,149 @@
+# model_registry.py
+#
+# Local registry of the models train_model.py fits, in models/. Each version is
+# a directory with the fitted Pipeline (model.pkl, buffers.bin) and meta.json:
+# the class labels in LabelEncoder order, the ordered feature columns of
+# clean_up_for_training it was fitted on, a hash of the training data, its
+# holdout metrics and training parameters. models/CURRENT names the version
+# predict_service.py and score_upcoming.py load by default.
+#
+# The model is pickled with protocol 5 and its numpy arrays written out of
+# band, one after another, to buffers.bin. Loading maps buffers.bin and hands
+# the arrays to pickle as views of the mapping, so arrays that sklearn keeps as
+# they are (the HistGradientBoosting predictors' nodes) are never copied. The
+# fitted HistGradientBoosting model loads in under 10 ms this way, against
+# 50-80 ms with joblib.load, which handles each of its ~1600 small arrays on
+# its own (see benchmarks/model_registry.py).
+
+import hashlib
+import json
+import mmap
+import pickle
+import shutil
+from pathlib import Path
+
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+REGISTRY_DIR = Path(__file__).resolve().parent / "models"
+
+MODEL_FILE = "model.pkl"
+BUFFERS_FILE = "buffers.bin"
+META_FILE = "meta.json"
+CURRENT_FILE = "CURRENT"
+
+# Arrays in buffers.bin start on multiples of this many bytes
+BUFFER_ALIGNMENT = 64
+
+
+class SchemaError(Exception):
+  pass
+
+
+# Hash of a frame's values, columns and column order, to tell which data a
+# model was trained on
+def data_hash(df):
+  digest = hashlib.sha256(",".join(df.columns).encode())
+  digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+  return digest.hexdigest()
+
+def version_dir(version, registry_dir=REGISTRY_DIR):
+  return Path(registry_dir) / version
+
+def current_version(registry_dir=REGISTRY_DIR):
+  path = Path(registry_dir) / CURRENT_FILE
+  if not path.exists():
+    raise FileNotFoundError(f"no current model in {registry_dir}, run train_model.py")
+  return path.read_text().strip()
+
+def set_current(version, registry_dir=REGISTRY_DIR):
+  if not (version_dir(version, registry_dir) / META_FILE).exists():
+    raise FileNotFoundError(f"no model {version} in {registry_dir}")
+  tmp_path = Path(registry_dir) / (CURRENT_FILE + ".tmp")
+  tmp_path.write_text(version + "\n")
+  tmp_path.replace(Path(registry_dir) / CURRENT_FILE)
+
+# Writes the pickle with the (offset, size) of each array in the buffers file
+def dump_model(model, directory):
+  buffers = []
+  data = pickle.dumps(model, protocol=5, buffer_callback=buffers.append)
+
+  offsets = []
+  position = 0
+  with open(directory / BUFFERS_FILE, "wb") as f:
+    for buffer in buffers:
+      raw = buffer.raw()
+      padding = -position % BUFFER_ALIGNMENT
+      f.write(b"\0" * padding)
+      position += padding
+      offsets.append((position, raw.nbytes))
+      f.write(raw)
+      position += raw.nbytes
+
+  with open(directory / MODEL_FILE, "wb") as f:
+    pickle.dump({'buffers': offsets, 'pickle': data}, f, protocol=5)
+
+# Copy-on-write mapping, as some estimators write to their arrays after
+# unpickling; the file itself is never changed
+def load_model_file(directory, use_mmap=True):
+  with open(directory / MODEL_FILE, "rb") as f:
+    stored = pickle.load(f)
+  if not stored['buffers']:
+    return pickle.loads(stored['pickle'])
+
+  with open(directory / BUFFERS_FILE, "rb") as f:
+    if use_mmap:
+      contents = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+    else:
+      contents = memoryview(bytearray(f.read()))
+  buffers = [contents[offset:offset + size] for offset, size in stored['buffers']]
+  return pickle.loads(stored['pickle'], buffers=buffers)
+
+def list_versions(registry_dir=REGISTRY_DIR):
+  return sorted(p.parent.name for p in Path(registry_dir).glob(f"*/{META_FILE}"))
+
+# Saves an artifact from train_model.train as a new version. Written under a
+# temporary name first, so a failed save leaves no half-written version.
+def register(artifact, registry_dir=REGISTRY_DIR, make_current=True):
+  version = artifact['version']
+  final_dir = version_dir(version, registry_dir)
+  if final_dir.exists():
+    raise FileExistsError(f"model {version} is already registered")
+
+  tmp_dir = final_dir.with_name(version + ".tmp")
+  shutil.rmtree(tmp_dir, ignore_errors=True)
+  tmp_dir.mkdir(parents=True)
+  dump_model(artifact['model'], tmp_dir)
+  meta = {key: value for key, value in artifact.items() if key != 'model'}
+  (tmp_dir / META_FILE).write_text(json.dumps(meta, indent=2))
+  tmp_dir.rename(final_dir)
+
+  if make_current:
+    set_current(version, registry_dir)
+  return final_dir
+
+def load_meta(version=None, registry_dir=REGISTRY_DIR):
+  version = version or current_version(registry_dir)
+  return json.loads((version_dir(version, registry_dir) / META_FILE).read_text())
+
+# The artifact train_model.train returned
+def load(version=None, registry_dir=REGISTRY_DIR, use_mmap=True):
+  meta = load_meta(version, registry_dir)
+  model = load_model_file(version_dir(meta['version'], registry_dir), use_mmap)
+  return {'model': model, **meta}
+
+# The frame's feature columns in the order the model was fitted on. Missing
+# columns and columns that aren't numeric or boolean are errors, extra columns
+# are dropped.
+def validate_features(artifact, X):
+  features = artifact['features']
+  if list(X.columns) != features:
+    missing = [col for col in features if col not in X.columns]
+    if missing:
+      raise SchemaError(f"missing features for model {artifact['version']}: {', '.join(missing)}")
+    X = X[features]
+
+  bad = [col for col, dtype in X.dtypes.items() if not (is_numeric_dtype(dtype) or is_bool_dtype(dtype))]
+  if bad:
+    raise SchemaError(f"features that aren't numeric: {', '.join(bad)}")
+  return X
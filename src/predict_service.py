@@ -0,0 +1,332 @@
+# predict_service.py
+#
+# A local HTTP service that predicts fights with a model from the registry
+# train_model.py saves to (model_registry.py). Every fighter's pre-fight
+# features for their next fight are held in memory, built from the state
+# `feature_engineering.py --incremental` keeps in feature_state/: the moving
+# averages and history counters after each fighter's latest counted fight, and
+# their attributes. A request only assembles the wide row the model expects
+# and scores it, so no feature rebuild or database is needed. Models
+# tree_inference.py can compile are scored with it rather than sklearn's
+# predict_proba, which takes ~10 ms a call for one fight.
+#
+#   GET  /health        model version and feature state in use
+#   POST /predict       {"red_fighter_id": ..., "blue_fighter_id": ...,
+#                        "weight_class": "Lightweight", "rounds": 3,
+#                        "date": "2026-11-07", "is_title_fight": false}
+#                       date defaults to today, is_title_fight to false
+#   POST /predict/card  {"fights": [<fight as above>, ...]}, scored at once
+#   POST /reload        reread the model and feature state, picking up a new
+#                       current model unless --version was given
+#
+# Usage: python predict_service.py [--host 127.0.0.1] [--port 8000] [--version VERSION] [--registry models]
+
+import argparse
+import json
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import feature_engineering as fe
+import feature_state as fs
+import model_registry
+import tree_inference
+
+STANCES = ['Orthodox', 'Southpaw', 'Switch']
+
+WEIGHT_CLASS_DUMMIES = [col for col in fe.EXPECTED_DUMMIES if col.startswith('weight_class_')]
+
+RATE_COLS = [f"w_{c}" for c in fe.DELTA_RATES]
+
+# Per-fighter values kept as one float matrix, in this column order
+FIGHTER_COLS = RATE_COLS + fs.COUNTER_COLS + ['height', 'reach'] + [f'stance_{s}' for s in STANCES]
+
+
+class MatchupError(Exception):
+  pass
+
+
+# Weight class names as encode_categorical_columns spells them in dummies
+def clean_weight_class(name):
+  return name.replace("'", "").replace(" ", "_")
+
+# Column names after clean_up_for_training
+def training_name(col):
+  return fe.TRAINING_RENAMES.get(col, col).lower()
+
+# Every fighter's features going into their next fight, as arrays indexed by
+# the fighter's position. Fighters without a counted fight are debuts.
+def build_fighter_index(state_dir=fs.STATE_DIR):
+  meta = json.loads((state_dir / "meta.json").read_text())
+  if meta.get('version') != fs.STATE_VERSION:
+    raise RuntimeError(f"feature state in {state_dir} is from another version, rerun feature_engineering.py --incremental")
+
+  fighter_state = pd.read_parquet(state_dir / "fighters.parquet")
+  attributes = pd.read_parquet(state_dir / "attributes.parquet").set_index('fighter_id')
+  medians = pd.read_parquet(state_dir / "medians.parquet")
+
+  ewm_cols = meta['ewm_columns']
+  averages = fighter_state[[f"ewm_{c}" for c in ewm_cols]]
+  averages.columns = [f"avg_{c}" for c in ewm_cols]
+  rates = fe.calculate_fighter_rates(averages.copy())[RATE_COLS]
+
+  fighters = attributes.join(rates).join(fighter_state[fs.COUNTER_COLS + ['last_event_date']])
+  fighters[fs.COUNTER_COLS] = fighters[fs.COUNTER_COLS].fillna(0)
+  stance = fighters['stance'].fillna('Orthodox')
+  for s in STANCES:
+    fighters[f'stance_{s}'] = stance == s
+
+  # handle_NaNs and encode_categorical_columns drop these fighters' fights
+  excluded = np.full(len(fighters), None, dtype=object)
+  excluded[stance.isin(fs.FILTERED_STANCES).to_numpy()] = "has a stance left out of the training data"
+  excluded[fighters['dob'].isnull().to_numpy()] = "has no date of birth"
+
+  return {
+    'positions': {fighter_id: i for i, fighter_id in enumerate(fighters.index)},
+    'values': fighters[FIGHTER_COLS].to_numpy(dtype='float64'),
+    'dob': pd.to_datetime(fighters['dob']).to_numpy(),
+    'last_event_date': pd.to_datetime(fighters['last_event_date']).to_numpy(),
+    'excluded': excluded,
+    'medians': {name: (row.height, row.reach) for name, row in medians.iterrows()},
+    'weight_classes': {clean_weight_class(name): name for name in medians.index},
+    'watermark': meta['watermark'],
+  }
+
+# Requests as arrays of fighter positions, weight class (as stored), rounds,
+# event date and title fight flags
+def parse_fights(index, fights):
+  parsed = {key: [] for key in ['red', 'blue', 'red_fighter_id', 'blue_fighter_id', 'weight_class', 'rounds', 'event_date', 'is_title_fight']}
+  if not isinstance(fights, list):
+    raise MatchupError("fights must be a list")
+  for i, fight in enumerate(fights):
+    if not isinstance(fight, dict):
+      raise MatchupError(f"fight {i} must be a JSON object")
+    try:
+      red, blue = str(fight['red_fighter_id']), str(fight['blue_fighter_id'])
+      weight_class = str(fight['weight_class'])
+    except KeyError as e:
+      raise MatchupError(f"missing {e.args[0]}")
+    if red == blue:
+      raise MatchupError(f"{red} can't fight themselves")
+
+    stored = index['weight_classes'].get(clean_weight_class(weight_class))
+    if stored is None:
+      raise MatchupError(f"unknown weight class {weight_class!r}")
+
+    # Numbers would be read as nanoseconds since the epoch
+    if not isinstance(fight.get('date'), (str, type(None))):
+      raise MatchupError(f"bad date {fight.get('date')!r}, expected YYYY-MM-DD")
+    try:
+      event_date = np.datetime64(fight.get('date') or date.today(), 'ns')
+    except ValueError:
+      raise MatchupError(f"bad date {fight.get('date')!r}")
+
+    # "false" would otherwise count as a title fight
+    is_title_fight = fight.get('is_title_fight', False)
+    if not isinstance(is_title_fight, bool):
+      raise MatchupError(f"bad is_title_fight {is_title_fight!r}, expected true or false")
+
+    for corner, fighter_id in (('red', red), ('blue', blue)):
+      position = index['positions'].get(fighter_id)
+      if position is None:
+        raise MatchupError(f"unknown fighter {fighter_id}")
+      if index['excluded'][position] is not None:
+        raise MatchupError(f"{fighter_id} {index['excluded'][position]}")
+      if index['last_event_date'][position] >= event_date:
+        raise MatchupError(f"{fighter_id} has a counted fight on or after {fight.get('date')}")
+      parsed[corner].append(position)
+      parsed[f'{corner}_fighter_id'].append(fighter_id)
+
+    parsed['weight_class'].append(stored)
+    parsed['rounds'].append(float(fight.get('rounds', 3)))
+    parsed['event_date'].append(event_date)
+    parsed['is_title_fight'].append(is_title_fight)
+
+  parsed = {key: np.array(values) for key, values in parsed.items()}
+  parsed['event_date'] = parsed['event_date'].astype('datetime64[ns]')
+  return parsed
+
+# The rows clean_up_for_training would give these fights, in the model's
+# column order
+def matchup_features(index, fights, features):
+  n = len(fights['red'])
+  columns = {
+    training_name('is_title_fight'): fights['is_title_fight'],
+    training_name('rounds_scheduled'): fights['rounds'],
+  }
+  for col in WEIGHT_CLASS_DUMMIES:
+    columns[training_name(col)] = fights['weight_class'] == index['weight_classes'].get(col[len('weight_class_'):])
+
+  # Both corners at once, red rows then blue rows
+  positions = np.concatenate([fights['red'], fights['blue']])
+  values = index['values'][positions]
+  corners = dict(zip(FIGHTER_COLS, values.T))
+
+  medians = np.array([index['medians'][weight_class] for weight_class in fights['weight_class']]).reshape(n, 2)
+  for i, col in enumerate(['height', 'reach']):
+    corners[col] = np.where(np.isnan(corners[col]), np.tile(medians[:, i], 2), corners[col])
+
+  event_dates = np.tile(fights['event_date'], 2)
+  corners['age'] = fe.years_between(index['dob'][positions], event_dates).astype('float64')
+  corners['is_debut'] = (corners['fights'] == 0).astype('float64')
+
+  red = {col: corner[:n] for col, corner in corners.items()}
+  blue = {col: corner[n:] for col, corner in corners.items()}
+
+  # The wide table takes these from the fight's first row, the fighter with
+  # the lower fighter_id, whichever corner they are in
+  red_first = fights['red_fighter_id'] < fights['blue_fighter_id']
+  first = lambda col: np.where(red_first, red[col], blue[col])
+  other = lambda col: np.where(red_first, blue[col], red[col])
+  for c in fe.DELTA_RATES:
+    columns[training_name(f'delta_{c}')] = first(f'w_{c}') - other(f'w_{c}')
+  columns[training_name('net_str_eff')] = (first('w_SLpM') - first('w_SApM')) - (other('w_SLpM') - other('w_SApM'))
+
+  for prefix, corner in (('R', red), ('B', blue)):
+    for col in fe.WIDE_FIGHTER_COLS:
+      if col in corner:
+        columns[training_name(f'{prefix}_{col}')] = corner[col]
+  for col in ['age', 'height', 'reach']:
+    columns[training_name(f'delta_{col}')] = red[col] - blue[col]
+
+  missing = [col for col in features if col not in columns]
+  if missing:
+    raise RuntimeError(f"model expects features the service doesn't build: {', '.join(missing)}")
+
+  X = np.empty((n, len(features)))
+  for i, col in enumerate(features):
+    X[:, i] = columns[col]
+  return pd.DataFrame(X, columns=features)
+
+# The given model version, or the current one
+def load_service(version=None, registry_dir=model_registry.REGISTRY_DIR, state_dir=fs.STATE_DIR):
+  artifact = model_registry.load(version, registry_dir)
+  try:
+    compiled = tree_inference.compile_model(artifact['model'])
+  except tree_inference.UnsupportedModel:
+    compiled = None
+  return {
+    'artifact': artifact,
+    'compiled': compiled,
+    'red_column': artifact['classes'].index('Red'),
+    'index': build_fighter_index(state_dir),
+    'version': version,
+    'registry_dir': registry_dir,
+    'state_dir': state_dir,
+  }
+
+def predict(service, fights):
+  fights = parse_fights(service['index'], fights)
+  if not len(fights['red']):
+    return []
+
+  artifact = service['artifact']
+  X = model_registry.validate_features(artifact, matchup_features(service['index'], fights, artifact['features']))
+  if service['compiled'] is not None:
+    proba = tree_inference.predict_proba(service['compiled'], X)
+  else:
+    proba = artifact['model'].predict_proba(X)
+  red = proba[:, service['red_column']]
+
+  return [
+    {
+      'red_fighter_id': red_id,
+      'blue_fighter_id': blue_id,
+      'red_win_probability': float(p),
+      'blue_win_probability': float(1 - p),
+    }
+    for red_id, blue_id, p in zip(fights['red_fighter_id'], fights['blue_fighter_id'], red)
+  ]
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+  # Set by serve()
+  service = None
+  lock = threading.Lock()
+
+  def send_json(self, status, body):
+    payload = json.dumps(body).encode()
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def read_json(self):
+    length = int(self.headers.get("Content-Length", 0))
+    body = json.loads(self.rfile.read(length) or b"{}")
+    if not isinstance(body, dict):
+      raise MatchupError("request body must be a JSON object")
+    return body
+
+  def do_GET(self):
+    if self.path != "/health":
+      return self.send_json(404, {'error': f"no route {self.path}"})
+
+    service = PredictionHandler.service
+    self.send_json(200, {
+      'status': 'ok',
+      'model_version': service['artifact']['version'],
+      'model_trained_at': service['artifact']['trained_at'],
+      'features_as_of': service['index']['watermark'],
+      'fighters': len(service['index']['positions']),
+    })
+
+  def do_POST(self):
+    start = time.perf_counter()
+    try:
+      body = self.read_json()
+      if self.path == "/predict":
+        result = predict(PredictionHandler.service, [body])[0]
+      elif self.path == "/predict/card":
+        result = {'predictions': predict(PredictionHandler.service, body.get('fights', []))}
+      elif self.path == "/reload":
+        with PredictionHandler.lock:
+          old = PredictionHandler.service
+          PredictionHandler.service = load_service(old['version'], old['registry_dir'], old['state_dir'])
+        result = {
+          'model_version': PredictionHandler.service['artifact']['version'],
+          'features_as_of': PredictionHandler.service['index']['watermark'],
+        }
+      else:
+        return self.send_json(404, {'error': f"no route {self.path}"})
+    except (MatchupError, ValueError, TypeError) as e:
+      return self.send_json(400, {'error': str(e)})
+
+    if isinstance(result, dict):
+      result['elapsed_ms'] = (time.perf_counter() - start) * 1e3
+    self.send_json(200, result)
+
+
+def serve(host, port, version=None, registry_dir=model_registry.REGISTRY_DIR):
+  PredictionHandler.service = load_service(version, registry_dir)
+  server = ThreadingHTTPServer((host, port), PredictionHandler)
+  service = PredictionHandler.service
+  index = service['index']
+  print(f"Serving model {service['artifact']['version']} for {len(index['positions'])} fighters, "
+        f"features as of {index['watermark']}, on http://{host}:{port}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--version", help="model version, default the current one")
+  parser.add_argument("--registry", default=str(model_registry.REGISTRY_DIR))
+  args = parser.parse_args()
+
+  serve(args.host, args.port, args.version, args.registry)
+
+
+if __name__ == "__main__":
+  main()
@@ -3,12 +3,21 @@ from pathlib import Path
 import sys
 from prefect import flow, task
 
+import score_upcoming
+
 BASE_DIR = Path(__file__).resolve().parent
 
 @task(retries=2, retry_delay_seconds=60)
-def run_scrapy_spider(spider_name: str):
+def run_scrapy_spider(spider_name: str, incremental: bool = True, profile: str | None = None):
+  command = ["scrapy", "crawl", spider_name]
+  # Named settings bundle from scrapy/crawler/profiles.py, e.g. "fast-backfill"
+  if profile:
+    command += ["--crawl-profile", profile]
+  if incremental:
+    command += ["-s", "INCREMENTAL_CRAWL=True"]
+
   result = subprocess.run(
-    ["scrapy", "crawl", spider_name],
+    command,
     cwd=str(BASE_DIR / "scrapy"),
     capture_output=True,
     text=True,
@@ -17,9 +26,26 @@ def run_scrapy_spider(spider_name: str):
   return result.stdout
 
 @task(retries=2, retry_delay_seconds=60)
-def run_feature_engineering():
+def run_feature_engineering(incremental: bool = False):
+  command = [sys.executable, str(BASE_DIR / "feature_engineering.py")]
+  # Recompute only fighters in new or changed fights, see feature_state.py
+  if incremental:
+    command.append("--incremental")
+
+  result = subprocess.run(
+    command,
+    cwd=str(BASE_DIR),
+    capture_output=True,
+    text=True,
+    check=True
+  )
+  return result.stdout
+
+# Rebuilds the point-in-time store of fighter states, see feature_store.py
+@task(retries=2, retry_delay_seconds=60)
+def build_feature_store():
   result = subprocess.run(
-    [sys.executable, str(BASE_DIR / "feature_engineering.py")],
+    [sys.executable, str(BASE_DIR / "feature_store.py")],
     cwd=str(BASE_DIR),
     capture_output=True,
     text=True,
@@ -27,11 +53,19 @@ def run_feature_engineering():
   )
   return result.stdout
 
+# In process rather than a subprocess, so the model stays loaded between runs
+# of the served flow, see score_upcoming.py
+@task(retries=2, retry_delay_seconds=60)
+def score_upcoming_fights():
+  return score_upcoming.score_upcoming()
+
 
 @flow(log_prints=True)
 def scraping_pipeline():
   print("Starting Webscraper")
   run_scrapy_spider('ufc')
-  run_feature_engineering()
+  run_feature_engineering(incremental=True)
+  build_feature_store()
+  score_upcoming_fights()
 
 scraping_pipeline.serve('weekly-scrape', cron="0 0 * * * 6")
@@ -0,0 +1,309 @@
+# schema.py
+#
+# Table definitions for the ufc database. create_tables.py builds the DDL from
+# these, and the Scrapy PostgresPipeline derives its upsert column lists and
+# conflict keys from them, so the two can't drift apart.
+#
+# Each table also lists the secondary indexes its reads need, as (columns,
+# covered columns). create_tables.py adds them, and any columns missing from
+# a database created by an older version of this file, with IF NOT EXISTS.
+
+EVENTS = {
+    "name": "events",
+    "columns": [
+        ("event_id", "VARCHAR(50) NOT NULL"),
+        ("name", "TEXT NOT NULL"),
+        ("date", "DATE NOT NULL"),
+        ("event_status", "TEXT"),           # completed/upcoming
+        ("location", "TEXT"),
+        ("updated_at", "TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP"),
+    ],
+    "primary_key": ["event_id"],
+    "foreign_keys": [],
+    "indexes": [
+        (["date"], []),
+        # The incremental crawl's event listing, answered from the index alone
+        (["event_status", "date"], ["event_id", "updated_at"]),
+    ],
+}
+
+FIGHTERS = {
+    "name": "fighters",
+    "columns": [
+        ("fighter_id", "VARCHAR(50) NOT NULL"),
+        ("name", "TEXT NOT NULL"),
+        ("height", "INTEGER"),              # inches
+        ("weight", "INTEGER"),              # lbs
+        ("reach", "INTEGER"),               # inches
+        ("stance", "TEXT"),
+        ("dob", "DATE"),
+        ("updated_at", "TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP"),
+    ],
+    "primary_key": ["fighter_id"],
+    "foreign_keys": [],
+    "indexes": [
+        (["updated_at"], []),
+    ],
+}
+
+FIGHTS = {
+    "name": "fights",
+    "columns": [
+        # Unique Identity
+        ("fight_id", "VARCHAR(50) NOT NULL"),
+        ("event_id", "VARCHAR(50) NOT NULL"),
+        ("event_date", "DATE NOT NULL"),
+        ("weight_class", "TEXT"),
+        ("gender", "VARCHAR(10)"),          # Men/Women
+        ("is_title_fight", "BOOLEAN DEFAULT FALSE"),
+        ("event_status", "TEXT"),           # completed/upcoming
+
+        # Fighter Links (Foreign Keys to the fighters table)
+        ("red_fighter_id", "VARCHAR(50) NOT NULL"),
+        ("blue_fighter_id", "VARCHAR(50) NOT NULL"),
+        ("red_fighter_name", "TEXT"),
+        ("blue_fighter_name", "TEXT"),
+
+        # Outcome Data
+        ("red_status", "VARCHAR(20)"),      # Win, Loss, Draw, NC
+        ("blue_status", "VARCHAR(20)"),
+        ("result_type", "VARCHAR(20)"),     # KO/TKO, SUB, U-DEC, etc.
+        ("winner_id", "VARCHAR(50)"),
+        ("loser_id", "VARCHAR(50)"),
+        ("winner_color", "VARCHAR(10)"),    # Red or Blue
+
+        # Timing and Rounds
+        ("end_round", "INTEGER"),
+        ("end_round_time", "INTEGER"),      # Seconds
+        ("total_duration", "INTEGER"),      # Seconds
+        ("rounds_scheduled", "INTEGER"),
+        ("time_scheduled", "INTEGER"),      # Seconds
+
+        # Result Specifics
+        ("method_raw", "TEXT"),
+        ("finish_type", "VARCHAR(50)"),     # KO/TKO | SUB | DEC
+        ("decision_type", "VARCHAR(50)"),   # U-DEC | M-DEC | S-DEC
+        ("referee", "TEXT"),
+
+        # Metadata
+        ("updated_at", "TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP"),
+    ],
+    "primary_key": ["fight_id"],
+    # (column, referenced table, referenced column, on delete)
+    "foreign_keys": [
+        ("event_id", "events", "event_id", "CASCADE"),
+        ("red_fighter_id", "fighters", "fighter_id", None),
+        ("blue_fighter_id", "fighters", "fighter_id", None),
+    ],
+    "indexes": [
+        (["event_date", "fight_id"], []),
+        (["event_id"], []),
+        # A fighter's fights in date order, from either corner
+        (["red_fighter_id", "event_date"], ["fight_id"]),
+        (["blue_fighter_id", "event_date"], ["fight_id"]),
+        # Fights changed since the incremental feature watermark
+        (["updated_at"], []),
+    ],
+}
+
+FIGHTER_FIGHTS = {
+    "name": "fighter_fights",
+    "columns": [
+        ("fight_id", "VARCHAR(50) NOT NULL"),
+        ("fighter_id", "VARCHAR(50) NOT NULL"),
+
+        # Context
+        ("opponent_id", "VARCHAR(50)"),
+        ("event_status", "TEXT"),           # completed/upcoming
+
+        # General Performance
+        ("knockdowns", "INTEGER DEFAULT 0"),
+        ("sub_attempts", "INTEGER DEFAULT 0"),
+        ("reversals", "INTEGER DEFAULT 0"),
+        ("ctrl_time", "INTEGER"),           # Store as total seconds (e.g., 145)
+
+        # Total Strikes
+        ("tot_str_landed", "INTEGER DEFAULT 0"),
+        ("tot_str_attempted", "INTEGER DEFAULT 0"),
+        ("tot_str_raw", "TEXT"),            # Original string like "45 of 100"
+
+        # Takedowns
+        ("td_landed", "INTEGER DEFAULT 0"),
+        ("td_attempted", "INTEGER DEFAULT 0"),
+        ("td_raw", "TEXT"),
+
+        # Significant Strikes
+        ("sig_str_landed", "INTEGER DEFAULT 0"),
+        ("sig_str_attempted", "INTEGER DEFAULT 0"),
+        ("sig_str_raw", "TEXT"),
+
+        # Significant Strikes by Target
+        ("head_str_landed", "INTEGER DEFAULT 0"),
+        ("head_str_attempted", "INTEGER DEFAULT 0"),
+        ("head_str_raw", "TEXT"),
+        ("body_str_landed", "INTEGER DEFAULT 0"),
+        ("body_str_attempted", "INTEGER DEFAULT 0"),
+        ("body_str_raw", "TEXT"),
+        ("leg_str_landed", "INTEGER DEFAULT 0"),
+        ("leg_str_attempted", "INTEGER DEFAULT 0"),
+        ("leg_str_raw", "TEXT"),
+
+        # Significant Strikes by Position
+        ("distance_str_landed", "INTEGER DEFAULT 0"),
+        ("distance_str_attempted", "INTEGER DEFAULT 0"),
+        ("distance_str_raw", "TEXT"),
+        ("clinch_str_landed", "INTEGER DEFAULT 0"),
+        ("clinch_str_attempted", "INTEGER DEFAULT 0"),
+        ("clinch_str_raw", "TEXT"),
+        ("ground_str_landed", "INTEGER DEFAULT 0"),
+        ("ground_str_attempted", "INTEGER DEFAULT 0"),
+        ("ground_str_raw", "TEXT"),
+
+        # Metadata
+        ("updated_at", "TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP"),
+    ],
+    # A fighter can only have one set of stats per fight
+    "primary_key": ["fight_id", "fighter_id"],
+    "foreign_keys": [
+        ("fight_id", "fights", "fight_id", "CASCADE"),
+        ("fighter_id", "fighters", "fighter_id", "CASCADE"),
+        ("opponent_id", "fighters", "fighter_id", None),
+    ],
+    "indexes": [
+        # The primary key leads with fight_id, this one finds a fighter's rows
+        (["fighter_id", "fight_id"], []),
+        (["opponent_id"], []),
+        (["updated_at"], []),
+    ],
+}
+
+# Written by score_upcoming.py, not the scraper
+PREDICTIONS = {
+    "name": "predictions",
+    "columns": [
+        ("fight_id", "VARCHAR(50) NOT NULL"),
+        ("model_version", "VARCHAR(50) NOT NULL"),
+        ("red_fighter_id", "VARCHAR(50)"),
+        ("blue_fighter_id", "VARCHAR(50)"),
+        ("red_win_probability", "DOUBLE PRECISION"),
+        ("blue_win_probability", "DOUBLE PRECISION"),
+        ("feature_hash", "VARCHAR(20)"),    # Features the probabilities came from
+
+        # Metadata
+        ("updated_at", "TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP"),
+    ],
+    "primary_key": ["fight_id", "model_version"],
+    "foreign_keys": [
+        ("fight_id", "fights", "fight_id", "CASCADE"),
+    ],
+    "indexes": [
+        (["model_version", "fight_id"], ["feature_hash"]),
+    ],
+}
+
+# In foreign-key order: parents come before the tables referencing them
+TABLES = {t["name"]: t for t in [EVENTS, FIGHTERS, FIGHTS, FIGHTER_FIGHTS, PREDICTIONS]}
+
+# Maintained by the database, never written by the scraper
+MANAGED_COLUMNS = ["updated_at"]
+
+# Columns renamed since the tables were first created, old name -> new name
+RENAMED_COLUMNS = {
+    "events": {"status": "event_status"},
+}
+
+
+def create_table_sql(table):
+    spec = TABLES[table]
+    references = {col: (ref, ref_col, on_delete) for col, ref, ref_col, on_delete in spec["foreign_keys"]}
+
+    lines = []
+    for col, col_type in spec["columns"]:
+        line = f"{col} {col_type}"
+        if col in references:
+            ref, ref_col, on_delete = references[col]
+            line += f" REFERENCES {ref}({ref_col})"
+            if on_delete:
+                line += f" ON DELETE {on_delete}"
+        lines.append(line)
+    lines.append(f"PRIMARY KEY ({', '.join(spec['primary_key'])})")
+
+    body = ",\n        ".join(lines)
+    return f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        {body}
+    );
+    """
+
+
+def index_name(table, columns):
+    return f"{table}_{'_'.join(columns)}_idx"
+
+
+def create_index_sql(table):
+    statements = []
+    for columns, covered in TABLES[table]["indexes"]:
+        include = f" INCLUDE ({', '.join(covered)})" if covered else ""
+        statements.append(
+            f"CREATE INDEX IF NOT EXISTS {index_name(table, columns)} "
+            f"ON {table} ({', '.join(columns)}){include};"
+        )
+    return statements
+
+
+# Brings a table created by an older schema up to date: renames columns and
+# adds the ones it is missing. Added columns are NULL (or their default) in
+# existing rows, so NOT NULL columns without a default can't be added this way.
+def migrate_table_sql(table):
+    statements = []
+    for old, new in RENAMED_COLUMNS.get(table, {}).items():
+        statements.append(f"""
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = '{table}' AND column_name = '{old}')
+           AND NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = '{table}' AND column_name = '{new}') THEN
+            ALTER TABLE {table} RENAME COLUMN {old} TO {new};
+        END IF;
+    END $$;
+    """)
+    for col, col_type in TABLES[table]["columns"]:
+        statements.append(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {col} {col_type};")
+    return statements
+
+
+def upsert_columns(table):
+    return [col for col, _ in TABLES[table]["columns"] if col not in MANAGED_COLUMNS]
+
+
+def conflict_keys(table):
+    return TABLES[table]["primary_key"]
+
+
+def conflict_clause(table):
+    keys = conflict_keys(table)
+    updates = [f"{col} = EXCLUDED.{col}" for col in upsert_columns(table) if col not in keys]
+    updates.append("updated_at = CURRENT_TIMESTAMP")
+
+    return f"""ON CONFLICT ({', '.join(keys)}) DO UPDATE SET
+            {', '.join(updates)}"""
+
+
+# INSERT ... SELECT from a staging table holding the upsert columns plus a
+# sequence column. The last staged row per key wins, and rows whose foreign
+# keys don't resolve are skipped instead of failing the whole statement.
+def merge_sql(table, source, seq_column):
+    columns = upsert_columns(table)
+    keys = conflict_keys(table)
+    filters = [
+        f"(s.{col} IS NULL OR EXISTS (SELECT 1 FROM {ref} r WHERE r.{ref_col} = s.{col}))"
+        for col, ref, ref_col, _ in TABLES[table]["foreign_keys"]
+    ]
+
+    return f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT DISTINCT ON ({', '.join(f's.{k}' for k in keys)}) {', '.join(f's.{c}' for c in columns)}
+        FROM {source} s
+        WHERE {' AND '.join(filters) if filters else 'TRUE'}
+        ORDER BY {', '.join(f's.{k}' for k in keys)}, s.{seq_column} DESC
+        {conflict_clause(table)};
+    """
@@ -0,0 +1,120 @@
+# score_upcoming.py
+#
+# Scores upcoming fights with the current registered model (see
+# model_registry.py) and writes the
+# probabilities to the predictions table, keyed by fight and model version.
+# The features come from the wide table `feature_engineering.py --incremental`
+# keeps in feature_state/, so no rebuild is needed. Each prediction stores a
+# hash of the features it was made from, and a run only scores the upcoming
+# fights with no prediction from the current model or with changed features.
+#
+# The model is loaded once per process and again only when another version
+# becomes current, so the scheduled flow, which calls score_upcoming() in
+# process, doesn't reload it every week.
+#
+# Usage: python score_upcoming.py [--version VERSION] [--registry models] [--all]
+
+import argparse
+import time
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+import db
+import feature_engineering as fe
+import feature_state as fs
+import model_registry
+from schema import create_table_sql, create_index_sql, conflict_clause
+
+TABLE = 'predictions'
+
+PREDICTION_COLUMNS = ['fight_id', 'model_version', 'red_fighter_id', 'blue_fighter_id',
+                      'red_win_probability', 'blue_win_probability', 'feature_hash']
+
+# {'registry', 'version', 'artifact'} of the model loaded last
+_loaded = {}
+
+
+# The given version, or the current one
+def load_model_once(version=None, registry_dir=model_registry.REGISTRY_DIR):
+  version = version or model_registry.current_version(registry_dir)
+  if _loaded.get('registry') != str(registry_dir) or _loaded.get('version') != version:
+    artifact = model_registry.load(version, registry_dir)
+    _loaded.update(registry=str(registry_dir), version=version, artifact=artifact)
+  return _loaded['artifact']
+
+# Upcoming fights in the stored wide table, as ids and the model's features
+def upcoming_features(artifact, state_dir=fs.STATE_DIR):
+  path = state_dir / "wide.parquet"
+  if not path.exists():
+    raise RuntimeError(f"no feature state in {state_dir}, run feature_engineering.py --incremental")
+
+  wide = pd.read_parquet(path)
+  wide = wide[wide['event_status'] == 'upcoming']
+  X = fe.clean_up_for_training(wide)
+  X = model_registry.validate_features(artifact, X)
+  ids = wide.loc[X.index, ['fight_id', 'R_fighter_id', 'B_fighter_id']]
+  return ids.reset_index(drop=True), X.reset_index(drop=True)
+
+# One hash per fight of its feature values, as hex so it fits a VARCHAR
+def feature_hashes(X):
+  return pd.util.hash_pandas_object(X, index=False).map('{:016x}'.format).to_numpy()
+
+# {fight_id: feature_hash} of the stored predictions from this model version
+def stored_hashes(cur, model_version, fight_ids):
+  cur.execute(
+    f"SELECT fight_id, feature_hash FROM {TABLE} WHERE model_version = %s AND fight_id = ANY(%s)",
+    (model_version, list(fight_ids)),
+  )
+  return dict(cur.fetchall())
+
+def write_predictions(cur, rows):
+  query = f"INSERT INTO {TABLE} ({', '.join(PREDICTION_COLUMNS)}) VALUES %s {conflict_clause(TABLE)}"
+  execute_values(cur, query, rows, page_size=1000)
+
+def score_upcoming(version=None, registry_dir=model_registry.REGISTRY_DIR, state_dir=fs.STATE_DIR, rescore_all=False):
+  start = time.perf_counter()
+  artifact = load_model_once(version, registry_dir)
+  version = artifact['version']
+  red_column = artifact['classes'].index('Red')
+
+  ids, X = upcoming_features(artifact, state_dir)
+  hashes = feature_hashes(X)
+
+  with db.connection() as conn, conn.cursor() as cur:
+    # Created here too, so scoring works before create_tables.py is rerun
+    cur.execute(create_table_sql(TABLE))
+    for statement in create_index_sql(TABLE):
+      cur.execute(statement)
+    if not rescore_all:
+      stored = stored_hashes(cur, version, ids['fight_id'])
+      changed = ids['fight_id'].map(stored).to_numpy() != hashes
+      ids, X, hashes = ids[changed], X[changed], hashes[changed]
+
+    if len(X):
+      red = artifact['model'].predict_proba(X)[:, red_column]
+      rows = [
+        (fight_id, version, red_id, blue_id, float(p), float(1 - p), feature_hash)
+        for fight_id, red_id, blue_id, p, feature_hash
+        in zip(ids['fight_id'], ids['R_fighter_id'], ids['B_fighter_id'], red, hashes)
+      ]
+      write_predictions(cur, rows)
+    conn.commit()
+
+  elapsed = time.perf_counter() - start
+  print(f"Scored {len(X)} new or changed upcoming fights with model {version} in {elapsed * 1e3:.0f} ms")
+  return len(X)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", help="model version, default the current one")
+  parser.add_argument("--registry", default=str(model_registry.REGISTRY_DIR))
+  parser.add_argument("--all", action="store_true", help="rescore every upcoming fight")
+  args = parser.parse_args()
+
+  score_upcoming(args.version, args.registry, rescore_all=args.all)
+
+
+if __name__ == "__main__":
+  main()
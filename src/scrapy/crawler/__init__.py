@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# Make project modules shared with the rest of src/ (e.g. schema.py) importable
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.append(str(SRC_DIR))
@@ -0,0 +1 @@
+# Project-specific scrapy commands, registered through COMMANDS_MODULE
@@ -0,0 +1,42 @@
+from scrapy.commands.crawl import Command as BaseCrawlCommand
+
+from crawler.profiles import PROFILES
+
+
+# "scrapy crawl" with extra --replay and --crawl-profile options
+class Command(BaseCrawlCommand):
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument(
+            "--replay",
+            action="store_true",
+            help="re-parse pages from the response store without any network I/O",
+        )
+        parser.add_argument(
+            "--crawl-profile",
+            choices=sorted(PROFILES),
+            help="apply a named crawl profile from crawler/profiles.py",
+        )
+
+    # Applied before the base options so -s settings still take precedence
+    def process_options(self, args, opts):
+        if opts.crawl_profile:
+            self.settings.setdict(PROFILES[opts.crawl_profile], priority="cmdline")
+        if opts.replay:
+            self.settings.setdict(REPLAY_SETTINGS, priority="cmdline")
+        super().process_options(args, opts)
+
+
+# Serve every request from the store and re-parse every stored event and
+# fighter, instead of skipping the ones already in Postgres
+REPLAY_SETTINGS = {
+    "RESPONSE_STORE_REPLAY": True,
+    "ROBOTSTXT_OBEY": False,
+    "INCREMENTAL_CRAWL": False,
+    "FIGHTER_CACHE_TTL_DAYS": 0,
+    "DOWNLOAD_DELAY": 0,
+    "AUTOTHROTTLE_ENABLED": False,
+    "ADAPTIVE_CONCURRENCY_ENABLED": False,
+    "CONCURRENT_REQUESTS": 64,
+    "CONCURRENT_REQUESTS_PER_DOMAIN": 64,
+}
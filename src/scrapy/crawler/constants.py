@@ -55,4 +55,4 @@ FIGHT_SELECTORS = {
     'method_raw': "//i[contains(text(),'Method')]/following-sibling::i/text()",
     'finish_type': None,
     'decision_type': None
-}
\ No newline at end of file
+}
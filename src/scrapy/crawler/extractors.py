@@ -0,0 +1,70 @@
+# extractors.py
+#
+# Fast paths for the parts of a page that the spider would otherwise read cell
+# by cell through XPath and ItemLoaders. They work on the lxml tree behind the
+# response and give the same values the loaders would.
+
+import re
+
+from .constants import TOTAL_FIELDS, SIG_FIELDS
+from .loaders import clean_na, convert_seconds
+
+STAT_CELL_CLASS = "b-fight-details__table-col"
+
+# Stat fields in the order extract_fight_stats returns them
+STAT_FIELDS = tuple(f for f in TOTAL_FIELDS + SIG_FIELDS if f is not None)
+
+# XPath's normalize-space only collapses these four characters
+XPATH_SPACE = re.compile(r"[ \t\r\n]+")
+
+# Value conversions the FighterFightLoader applies after clean_na
+CONVERTERS = {
+    "ctrl_time": convert_seconds,
+}
+
+
+# Same as normalize-space(./p[n]/text()): the first text node of the n-th <p>
+def cell_text(td, n):
+    ps = [child for child in td if child.tag == "p"]
+    if len(ps) < n:
+        return ""
+    p = ps[n - 1]
+
+    text = p.text
+    if text is None:
+        text = next((child.tail for child in p if child.tail is not None), "")
+    return XPATH_SPACE.sub(" ", text).strip(" \t\r\n")
+
+
+def clean_value(field, text):
+    value = clean_na(text)
+    converter = CONVERTERS.get(field)
+    if value is not None and converter is not None:
+        value = converter(value)
+    return value
+
+
+# Read the totals table (the first table) and the significant strikes table
+# (the third) in one walk over the page. Returns (red, blue) tuples of cleaned
+# values lined up with STAT_FIELDS, with None where a cell is missing or empty.
+def extract_fight_stats(response):
+    tables = list(response.selector.root.iter("table"))
+    red, blue = [], []
+
+    for index, fields in ((0, TOTAL_FIELDS), (2, SIG_FIELDS)):
+        cells = []
+        if index < len(tables):
+            cells = [td for td in tables[index].iter("td") if td.get("class") == STAT_CELL_CLASS]
+
+        for position, field in enumerate(fields):
+            if field is None:
+                continue
+            if position < len(cells):
+                td = cells[position]
+                red.append(clean_value(field, cell_text(td, 1)))
+                blue.append(clean_value(field, cell_text(td, 2)))
+            else:
+                red.append(None)
+                blue.append(None)
+
+    return tuple(red), tuple(blue)
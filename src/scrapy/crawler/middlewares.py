@@ -4,10 +4,14 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from .response_store import ResponseStore
+
 
 class CrawlerSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +105,132 @@ class CrawlerDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+# Save every successful page to the on-disk ResponseStore, or in replay mode
+# serve pages from the store without touching the network
+class ResponseStoreMiddleware:
+    def __init__(self, store, replay, stats):
+        self.store = store
+        self.replay = replay
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("RESPONSE_STORE_ENABLED") and not settings.getbool("RESPONSE_STORE_REPLAY"):
+            raise NotConfigured
+        return cls(
+            ResponseStore(settings.get("RESPONSE_STORE_DIR")),
+            settings.getbool("RESPONSE_STORE_REPLAY"),
+            crawler.stats,
+        )
+
+    def process_request(self, request, spider):
+        if not self.replay:
+            return None
+
+        entry = self.store.get_entry(request.url)
+        if entry is None:
+            self.stats.inc_value("response_store/replay_miss")
+            raise IgnoreRequest(f"Not in response store: {request.url}")
+
+        self.stats.inc_value("response_store/replay_hit")
+        return HtmlResponse(
+            url=entry["response_url"],
+            status=entry["status"],
+            headers={"Content-Type": entry["content_type"]} if entry["content_type"] else None,
+            body=self.store.get_body(entry["digest"]),
+            request=request,
+            flags=["replay"],
+        )
+
+    def process_response(self, request, response, spider):
+        if self.replay or response.status != 200:
+            return response
+
+        # Also index the URLs that redirected here, so replay finds them
+        self.store.put(
+            request.url,
+            response.url,
+            response.status,
+            response.headers.get("Content-Type", b"").decode("latin-1"),
+            response.body,
+            aliases=request.meta.get("redirect_urls", []),
+        )
+        self.stats.inc_value("response_store/stored")
+        return response
+
+
+# Adapt each download slot's concurrency to how the site is coping. After every
+# ADAPTIVE_CONCURRENCY_WINDOW downloads the slot's concurrency is halved if the
+# error rate (429/5xx or download errors) was above
+# ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE, lowered by one if the average latency was
+# above ADAPTIVE_CONCURRENCY_TARGET_LATENCY, and raised by one otherwise.
+# AutoThrottle keeps adjusting the delay between requests alongside this.
+class AdaptiveConcurrencyMiddleware:
+    ERROR_STATUSES = {429, 500, 502, 503, 504, 520, 522, 524}
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.window = settings.getint("ADAPTIVE_CONCURRENCY_WINDOW")
+        self.max_error_rate = settings.getfloat("ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE")
+        self.target_latency = settings.getfloat("ADAPTIVE_CONCURRENCY_TARGET_LATENCY")
+        self.min_concurrency = settings.getint("ADAPTIVE_CONCURRENCY_MIN")
+        self.max_concurrency = settings.getint("ADAPTIVE_CONCURRENCY_MAX")
+        self.start_delay = settings.getfloat("AUTOTHROTTLE_START_DELAY")
+        self.max_delay = settings.getfloat("AUTOTHROTTLE_MAX_DELAY")
+        # {slot key: [(is_error, latency), ...]} for the current window
+        self.samples = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):
+        # Responses that never hit the network (e.g. replayed) have no latency
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            self.record(request, response.status in self.ERROR_STATUSES, latency, spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, IgnoreRequest):
+            self.record(request, True, None, spider)
+        return None
+
+    def record(self, request, is_error, latency, spider):
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+
+        samples = self.samples.setdefault(key, [])
+        samples.append((is_error, latency))
+        if len(samples) < self.window:
+            return
+        self.samples[key] = []
+
+        error_rate = sum(1 for e, _ in samples if e) / len(samples)
+        latencies = [l for _, l in samples if l is not None]
+        avg_latency = sum(latencies) / len(latencies) if latencies else 0
+
+        if error_rate > self.max_error_rate:
+            slot.concurrency = max(self.min_concurrency, slot.concurrency // 2)
+            slot.delay = min(self.max_delay, max(slot.delay * 2, self.start_delay))
+            self.stats.inc_value("adaptive_concurrency/backoffs")
+        elif avg_latency > self.target_latency:
+            slot.concurrency = max(self.min_concurrency, slot.concurrency - 1)
+        else:
+            slot.concurrency = min(self.max_concurrency, slot.concurrency + 1)
+
+        self.stats.min_value("adaptive_concurrency/min", slot.concurrency)
+        self.stats.max_value("adaptive_concurrency/max", slot.concurrency)
+        spider.logger.debug(
+            f"Slot {key}: error rate {error_rate:.1%}, latency {avg_latency:.2f}s, "
+            f"concurrency {slot.concurrency}, delay {slot.delay:.2f}s"
+        )
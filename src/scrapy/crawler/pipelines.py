@@ -5,86 +5,107 @@
 
 
 from .constants import RAW_DATA_MAP
-import json
+from schema import upsert_columns, conflict_keys, conflict_clause, merge_sql
+import db
+import time
+import tempfile
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
-import os
 import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
 from datetime import datetime
 import re
 from crawler.items import FighterItem, FightItem, EventItem, FighterFightItem
 import logging
 from datetime import date
 
-# Log scraped events
-class EventLoggingPipeline:
-    def __init__(self):
-        self.logger = logging.getLogger('EventLogger')
+HEIGHT_RE = re.compile(r"(\d+)'[\s]*([\d\"]+)")
+DIGITS_RE = re.compile(r"(\d+)")
+
+# Log scraped items. Items are only formatted when the logger's level is enabled
+class ItemLoggingPipeline:
+    item_class = None
+    logger_name = None
+
+    def __init__(self, level=logging.INFO):
+        self.logger = logging.getLogger(self.logger_name)
+        self.level = level
+
     def process_item(self, item, spider):
-        if item.__class__.__name__ == 'EventItem':
-            self.logger.info(dict(item))
+        if isinstance(item, self.item_class):
+            self.log(item, spider)
         return item
 
-# Log scraped fighter items
-class FighterLoggingPipeline:
-    def __init__(self):
-        self.logger = logging.getLogger('FighterLogger')
-    def process_item(self, item, spider):
-        if item.__class__.__name__ == 'FighterItem':
-            self.logger.info(dict(item))
+    def log(self, item, spider):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s", ItemAdapter(item).asdict())
         return item
-    
+
+# Log scraped events
+class EventLoggingPipeline(ItemLoggingPipeline):
+    item_class = EventItem
+    logger_name = 'EventLogger'
+
+# Log scraped fighter items
+class FighterLoggingPipeline(ItemLoggingPipeline):
+    item_class = FighterItem
+    logger_name = 'FighterLogger'
+
 # Log scraped fight items
-class FightLoggingPipeline:
-    def __init__(self):
-        self.logger = logging.getLogger('FightLogger')
-    def process_item(self, item, spider):
-        if item.__class__.__name__ == 'FightItem':
-            self.logger.info(dict(item))
-        return item
+class FightLoggingPipeline(ItemLoggingPipeline):
+    item_class = FightItem
+    logger_name = 'FightLogger'
 
 # Log scraped fighter fights
-class FighterFightLoggingPipeline:
-    def __init__(self):
-        self.logger = logging.getLogger('FFLogger')
-    def process_item(self, item, spider):
-        if item.__class__.__name__ == 'FighterFightItem':
-            readable_item = json.dumps(dict(item), indent=4)
-            self.logger.info(readable_item)
-        return item
+class FighterFightLoggingPipeline(ItemLoggingPipeline):
+    item_class = FighterFightItem
+    logger_name = 'FFLogger'
+
+def parse_height(h):
+    if not h:
+        return None
+    m = HEIGHT_RE.match(h)
+    if not m:
+        return None
+    feet = int(m.group(1))
+    inches = int(m.group(2).replace('"', '').strip())
+    return feet * 12 + inches
+
+def parse_first_int(value):
+    if not value:
+        return None
+    m = DIGITS_RE.search(value)
+    return int(m.group(1)) if m else None
+
+def format_date(date_str):
+    if not date_str or "--" in date_str:
+        return None
+
+    # Try the long format (Events)
+    try:
+        return datetime.strptime(date_str, '%B %d, %Y').strftime('%Y-%m-%d')
+    except ValueError:
+        pass
+
+    # Try the short format (Fighters)
+    try:
+        return datetime.strptime(date_str, '%b %d, %Y').strftime('%Y-%m-%d')
+    except ValueError:
+        return None
 
 # Clean fighter attributes
 class FighterProcessorPipeline:
     def process_item(self, item, spider):
         if not isinstance(item,  FighterItem):
             return item
-    
-        def parse_height(h):
-            if not h:
-                return None
-            m = re.match(r"(\d+)'[\s]*([\d\"]+)", h)
-            if not m:
-                return None
-            feet = int(m.group(1))
-            inches = int(m.group(2).replace('"', '').strip())
-            return feet * 12 + inches
-
-        def parse_weight(w):
-            if not w:
-                return None
-            m = re.search(r"(\d+)", w)
-            return int(m.group(1)) if m else None
-
-        def parse_reach(r):
-            if not r:
-                return None
-            m = re.search(r"(\d+)", r)
-            return int(m.group(1)) if m else None
-            
+        return self.process(item, spider)
+
+    def process(self, item, spider):
         item['height'] = parse_height(item.get('height'))
-        item['weight'] = parse_weight(item.get('weight'))
-        item['reach'] = parse_reach(item.get('reach'))
+        item['weight'] = parse_first_int(item.get('weight'))
+        item['reach'] = parse_first_int(item.get('reach'))
         item['stance'] = item.get('stance')
         item['dob'] = item.get('dob')
 
@@ -96,22 +117,9 @@ class DateFormattingPipeline:
     def process_item(self, item, spider):
         if not isinstance(item, (EventItem, FightItem, FighterItem)):
             return item
-        def format_date(date_str):
-            if not date_str or "--" in date_str:
-                return None
-            
-            # Try the long format (Events)
-            try:
-                return datetime.strptime(date_str, '%B %d, %Y').strftime('%Y-%m-%d')
-            except ValueError:
-                pass
-            
-            # Try the short format (Fighters)
-            try:
-                return datetime.strptime(date_str, '%b %d, %Y').strftime('%Y-%m-%d')
-            except ValueError:
-                return None
-        
+        return self.process(item, spider)
+
+    def process(self, item, spider):
         if 'event_date' in item:
             item['event_date'] = format_date(item['event_date'])
         elif 'date' in item:
@@ -119,7 +127,6 @@ class DateFormattingPipeline:
         elif 'dob' in item:
             item['dob'] = format_date(item['dob'])
 
-        print(dict(item))
         return item
 
 # Determine fight winners and losers
@@ -127,9 +134,12 @@ class FightProcessorPipeline:
     def process_item(self, item, spider):
         if not isinstance(item,  FightItem):
             return item
+        return self.process(item, spider)
+
+    def process(self, item, spider):
         if item.get('event_status') == 'upcoming':
-            return item   
-        
+            return item
+
         item = self.handle_winners_and_losers(item)
         item = self.handle_results(item)
         item = self.handle_time(item)
@@ -212,6 +222,9 @@ class FightUpcomingProcessorPipeline:
     def process_item(self, item, spider):
         if not isinstance(item, FightItem):
             return item
+        return self.process(item, spider)
+
+    def process(self, item, spider):
         if item.get('event_status') == 'completed':
             return item
         item['red_status'] = None
@@ -234,12 +247,18 @@ class FightUpcomingProcessorPipeline:
     
 # Clean fighter fight stats
 class FighterFightProcessorPipeline:
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
     def process_item(self, item, spider):
         if not isinstance(item, FighterFightItem):
             return item
+        return self.process(item, spider)
+
+    def process(self, item, spider):
         if item.get('event_status') == 'upcoming':
             return item
-        
+
         item = self.handle_raw_values(item)
         item = self.convert_to_numerics(item)
 
@@ -301,6 +320,9 @@ class FighterFightUpcomingPipeline:
     def process_item(self, item, spider):
         if not isinstance(item, FighterFightItem):
             return item
+        return self.process(item, spider)
+
+    def process(self, item, spider):
         if item.get('event_status') == 'completed':
             return item
         item['knockdowns'] = None 
@@ -345,20 +367,18 @@ class ValidationPipeline:
         self.logger = logging.getLogger(__name__)
     
     def process_item(self, item, spider):
-        item_type = item.__class__.__name__
-        
         if isinstance(item, FighterItem):
-            self._validate_fighter(item)
+            self.validate_fighter(item, spider)
         elif isinstance(item, FightItem):
-            self._validate_fight(item)
+            self.validate_fight(item, spider)
         elif isinstance(item, EventItem):
-            self._validate_event(item)
+            self.validate_event(item, spider)
         elif isinstance(item, FighterFightItem):
-            self._validate_fighter_fight(item)
+            self.validate_fighter_fight(item, spider)
         
         return item
     
-    def _validate_fighter(self, item):
+    def validate_fighter(self, item, spider=None):
         """Validate FighterItem fields."""
         required = ['fighter_id', 'name']
         self._check_required_fields(item, required, 'FighterItem')
@@ -378,8 +398,10 @@ class ValidationPipeline:
         if item.get('dob') is not None:
             if not self._is_valid_date(item['dob']):
                 raise ValueError(f"FighterItem: dob '{item['dob']}' is not in YYYY-MM-DD format")
+
+        return item
     
-    def _validate_fight(self, item):
+    def validate_fight(self, item, spider=None):
         """Validate FightItem fields."""
         required = ['fight_id', 'event_id', 'red_fighter_id', 'blue_fighter_id']
         self._check_required_fields(item, required, 'FightItem')
@@ -422,8 +444,10 @@ class ValidationPipeline:
         if item.get('event_date') is not None:
             if not self._is_valid_date(item['event_date']):
                 raise ValueError(f"FightItem: event_date '{item['event_date']}' is not in YYYY-MM-DD format")
+
+        return item
     
-    def _validate_event(self, item):
+    def validate_event(self, item, spider=None):
         """Validate EventItem fields."""
         required = ['event_id', 'name']
         self._check_required_fields(item, required, 'EventItem')
@@ -442,8 +466,10 @@ class ValidationPipeline:
         if item.get('date') is not None:
             if not self._is_valid_date(item['date']):
                 raise ValueError(f"EventItem: date '{item['date']}' is not in YYYY-MM-DD format")
+
+        return item
     
-    def _validate_fighter_fight(self, item):
+    def validate_fighter_fight(self, item, spider=None):
         """Validate FighterFightItem fields."""
         required = ['fight_id', 'fighter_id', 'opponent_id']
         self._check_required_fields(item, required, 'FighterFightItem')
@@ -465,6 +491,8 @@ class ValidationPipeline:
             if item.get(field) is not None:
                 if not isinstance(item[field], (int, float)):
                     raise ValueError(f"FighterFightItem: {field} must be numeric, got {type(item[field])}")
+
+        return item
     
     def _check_required_fields(self, item, required_fields, item_type):
         """Check that all required fields are present and non-empty."""
@@ -483,184 +511,307 @@ class ValidationPipeline:
             return False
 
 
-# Store to postgres
+# Build a multi-row upsert for execute_values
+def build_upsert_query(table):
+    return f"""
+        INSERT INTO {table} ({', '.join(upsert_columns(table))})
+        VALUES %s
+        {conflict_clause(table)};
+    """
+
+# One row's upsert with $1.. placeholders, prepared once per connection for
+# the row-by-row fallback
+def build_row_upsert_query(table):
+    columns = upsert_columns(table)
+    placeholders = ', '.join(f"${i}" for i in range(1, len(columns) + 1))
+    return f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        VALUES ({placeholders})
+        {conflict_clause(table)}
+    """
+
+# Format a row as a line for COPY ... WITH (FORMAT csv). Every value is quoted,
+# so only the unquoted empty field is read back as NULL
+def csv_line(values):
+    fields = ['' if v is None else '"' + str(v).replace('"', '""') + '"' for v in values]
+    return ','.join(fields) + '\n'
+
+# Store to postgres in buffered batches, or with COPY in backfill mode
 class PostgresPipeline:
-    def open_spider(self, spider):
-        hostname = 'localhost'
-        username = 'erickim'
-        password = os.getenv("POSTGRES_PASSWORD")
-        database = 'ufc'
-
-        self.connection = psycopg2.connect(
-            host=hostname,
-            user=username,
-            password=password,
-            dbname=database
+    # Tables in foreign-key order: parents are always flushed before children
+    TABLES = {
+        EventItem: 'events',
+        FighterItem: 'fighters',
+        FightItem: 'fights',
+        FighterFightItem: 'fighter_fights',
+    }
+
+    STAGE_MEMORY = 16 * 1024 * 1024
+
+    # Flushes a row missing its parent is retried in before it is dropped
+    MAX_DEFERRED_ATTEMPTS = 3
+
+    def __init__(self, batch_size=500, flush_interval=30, backfill=False, stats=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backfill = backfill
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            batch_size=crawler.settings.getint('POSTGRES_BATCH_SIZE', 500),
+            flush_interval=crawler.settings.getfloat('POSTGRES_FLUSH_INTERVAL', 30),
+            backfill=crawler.settings.getbool('POSTGRES_BACKFILL'),
+            stats=crawler.stats,
         )
+
+    def open_spider(self, spider):
+        self.connection = db.connect()
         self.cur = self.connection.cursor()
+
+        self.queries = {table: build_upsert_query(table) for table in self.TABLES.values()}
+        self.buffers = {table: {} for table in self.TABLES.values()}
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        # Rows whose parent wasn't stored yet, with their attempts so far. Kept
+        # out of the batches and of the flush count, see retry_deferred
+        self.deferred = {table: {} for table in self.TABLES.values()}
+
+        # Backfill mode streams rows to disk-spilling CSV buffers, one per table
+        if self.backfill:
+            self.staging = {
+                table: tempfile.SpooledTemporaryFile(max_size=self.STAGE_MEMORY, mode='w+', newline='')
+                for table in self.TABLES.values()
+            }
+            self.staged = {table: 0 for table in self.TABLES.values()}
     
     def close_spider(self, spider):
+        if self.backfill:
+            self.load_staged(spider)
+        else:
+            self.flush(spider, final=True)
         self.cur.close()
         self.connection.close()
 
+        for key, value in db.pool_stats().items():
+            self.set_stat(f"postgres/pool/{key}", value)
+
     def process_item(self, item, spider):
+        table = self.TABLES.get(type(item))
+        if table is None:
+            return item
+
+        if self.backfill:
+            self.stage_row(table, ItemAdapter(item).asdict())
+            return item
+
+        # Key rows by conflict key so a batch never upserts the same row twice
         item_dict = ItemAdapter(item).asdict()
+        key = tuple(item_dict.get(col) for col in conflict_keys(table))
+        self.buffers[table][key] = item_dict
+        self.deferred[table].pop(key, None)
+        self.buffered += 1
 
-        try:
-            if isinstance(item, EventItem):
-                self.insert_event(item_dict)
-            elif isinstance(item, FighterItem):
-                self.insert_fighter(item_dict)
-            elif isinstance(item, FightItem):
-                self.insert_fight(item_dict)
-            elif isinstance(item, FighterFightItem):
-                self.insert_fighter_stats(item_dict)
-            self.connection.commit()
-        except Exception as e:
-            self.connection.rollback()
-            spider.logger.error("---------------- SQL ERROR ----------------")
-            spider.logger.error(f"Type: {type(item).__name__}")
-            spider.logger.error(f"Error: {e}")
-            spider.logger.error(f"Data: {item_dict}")
-            spider.logger.error("-------------------------------------------")
+        if self.buffered >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush(spider)
 
         return item
-    
-    def insert_event(self, data):
-        query = """
-            INSERT INTO events (event_id, name, date, event_status, location)
-            VALUES (%(event_id)s, %(name)s, %(date)s, %(event_status)s, %(location)s)
-            ON CONFLICT (event_id) DO UPDATE SET
-                name = EXCLUDED.name,
-                date = EXCLUDED.date,
-                event_status = EXCLUDED.event_status,
-                location = EXCLUDED.location,
-                updated_at = CURRENT_TIMESTAMP;
-        """
-        self.cur.execute(query, data)
-
-    def insert_fighter(self, data):
-        query = """
-            INSERT INTO fighters (fighter_id, name, stance, dob, height, weight, reach)
-            VALUES (%(fighter_id)s, %(name)s, %(stance)s, %(dob)s, %(height)s, %(weight)s, %(reach)s)
-            ON CONFLICT (fighter_id) DO UPDATE SET
-                name = EXCLUDED.name,
-                stance = EXCLUDED.stance,
-                dob = EXCLUDED.dob,
-                height = EXCLUDED.height,
-                weight = EXCLUDED.weight,
-                reach  = EXCLUDED.reach,
-                updated_at = CURRENT_TIMESTAMP;
-        """
-        self.cur.execute(query, data)
-    
-    def insert_fight(self, data):
-        query = """
-            INSERT INTO fights (
-                fight_id, event_id, event_date, weight_class, gender, is_title_fight,
-                red_fighter_id, blue_fighter_id, red_fighter_name, blue_fighter_name,
-                red_status, blue_status, result_type, winner_id, loser_id, winner_color,
-                end_round, end_round_time, total_duration, rounds_scheduled, time_scheduled,
-                method_raw, finish_type, decision_type, referee, event_status
-            ) VALUES (
-                %(fight_id)s, %(event_id)s, %(event_date)s, %(weight_class)s, %(gender)s, %(is_title_fight)s,
-                %(red_fighter_id)s, %(blue_fighter_id)s, %(red_fighter_name)s, %(blue_fighter_name)s,
-                %(red_status)s, %(blue_status)s, %(result_type)s, %(winner_id)s, %(loser_id)s, %(winner_color)s,
-                %(end_round)s, %(end_round_time)s, %(total_duration)s, %(rounds_scheduled)s, %(time_scheduled)s,
-                %(method_raw)s, %(finish_type)s, %(decision_type)s, %(referee)s, %(event_status)s
-            )
-            ON CONFLICT (fight_id) DO UPDATE SET
-                event_id = EXCLUDED.event_id,
-                event_date = EXCLUDED.event_date,
-                weight_class = EXCLUDED.weight_class,
-                gender = EXCLUDED.gender,
-                is_title_fight = EXCLUDED.is_title_fight,
-                red_fighter_id = EXCLUDED.red_fighter_id,
-                blue_fighter_id = EXCLUDED.blue_fighter_id,
-                red_fighter_name = EXCLUDED.red_fighter_name,
-                blue_fighter_name = EXCLUDED.blue_fighter_name,
-                red_status = EXCLUDED.red_status,
-                blue_status = EXCLUDED.blue_status,
-                result_type = EXCLUDED.result_type,
-                winner_id = EXCLUDED.winner_id,
-                loser_id = EXCLUDED.loser_id,
-                winner_color = EXCLUDED.winner_color,
-                end_round = EXCLUDED.end_round,
-                end_round_time = EXCLUDED.end_round_time,
-                total_duration = EXCLUDED.total_duration,
-                rounds_scheduled = EXCLUDED.rounds_scheduled,
-                time_scheduled = EXCLUDED.time_scheduled,
-                method_raw = EXCLUDED.method_raw,
-                finish_type = EXCLUDED.finish_type,
-                decision_type = EXCLUDED.decision_type,
-                referee = EXCLUDED.referee,
-                event_status = EXCLUDED.event_status,
-                updated_at = CURRENT_TIMESTAMP;
-
-        """
-        self.cur.execute(query, data)
-
-    def insert_fighter_stats(self, data):
-        query = """
-            INSERT INTO fighter_fights (
-                fight_id, fighter_id, opponent_id,
-                knockdowns, sub_attempts, reversals, ctrl_time,
-                tot_str_landed, tot_str_attempted, tot_str_raw,
-                td_landed, td_attempted, td_raw,
-                sig_str_landed, sig_str_attempted, sig_str_raw,
-                head_str_landed, head_str_attempted, head_str_raw,
-                body_str_landed, body_str_attempted, body_str_raw,
-                leg_str_landed, leg_str_attempted, leg_str_raw,
-                distance_str_landed, distance_str_attempted, distance_str_raw,
-                clinch_str_landed, clinch_str_attempted, clinch_str_raw,
-                ground_str_landed, ground_str_attempted, ground_str_raw, event_status
-            ) VALUES (
-                %(fight_id)s, %(fighter_id)s, %(opponent_id)s,
-                %(knockdowns)s, %(sub_attempts)s, %(reversals)s, %(ctrl_time)s,
-                %(tot_str_landed)s, %(tot_str_attempted)s, %(tot_str_raw)s,
-                %(td_landed)s, %(td_attempted)s, %(td_raw)s,
-                %(sig_str_landed)s, %(sig_str_attempted)s, %(sig_str_raw)s,
-                %(head_str_landed)s, %(head_str_attempted)s, %(head_str_raw)s,
-                %(body_str_landed)s, %(body_str_attempted)s, %(body_str_raw)s,
-                %(leg_str_landed)s, %(leg_str_attempted)s, %(leg_str_raw)s,
-                %(distance_str_landed)s, %(distance_str_attempted)s, %(distance_str_raw)s,
-                %(clinch_str_landed)s, %(clinch_str_attempted)s, %(clinch_str_raw)s,
-                %(ground_str_landed)s, %(ground_str_attempted)s, %(ground_str_raw)s, %(event_status)s
-            )
-            ON CONFLICT (fight_id, fighter_id) DO UPDATE SET
-                opponent_id = EXCLUDED.opponent_id,
-                knockdowns = EXCLUDED.knockdowns,
-                sub_attempts = EXCLUDED.sub_attempts,
-                reversals = EXCLUDED.reversals,
-                ctrl_time = EXCLUDED.ctrl_time,
-                tot_str_landed = EXCLUDED.tot_str_landed,
-                tot_str_attempted = EXCLUDED.tot_str_attempted,
-                tot_str_raw = EXCLUDED.tot_str_raw,
-                td_landed = EXCLUDED.td_landed,
-                td_attempted = EXCLUDED.td_attempted,
-                td_raw = EXCLUDED.td_raw,
-                sig_str_landed = EXCLUDED.sig_str_landed,
-                sig_str_attempted = EXCLUDED.sig_str_attempted,
-                sig_str_raw = EXCLUDED.sig_str_raw,
-                head_str_landed = EXCLUDED.head_str_landed,
-                head_str_attempted = EXCLUDED.head_str_attempted,
-                head_str_raw = EXCLUDED.head_str_raw,
-                body_str_landed = EXCLUDED.body_str_landed,
-                body_str_attempted = EXCLUDED.body_str_attempted,
-                body_str_raw = EXCLUDED.body_str_raw,
-                leg_str_landed = EXCLUDED.leg_str_landed,
-                leg_str_attempted = EXCLUDED.leg_str_attempted,
-                leg_str_raw = EXCLUDED.leg_str_raw,
-                distance_str_landed = EXCLUDED.distance_str_landed,
-                distance_str_attempted = EXCLUDED.distance_str_attempted,
-                distance_str_raw = EXCLUDED.distance_str_raw,
-                clinch_str_landed = EXCLUDED.clinch_str_landed,
-                clinch_str_attempted = EXCLUDED.clinch_str_attempted,
-                clinch_str_raw = EXCLUDED.clinch_str_raw,
-                ground_str_landed = EXCLUDED.ground_str_landed,
-                ground_str_attempted = EXCLUDED.ground_str_attempted,
-                ground_str_raw = EXCLUDED.ground_str_raw,
-                event_status = EXCLUDED.event_status,
-                updated_at = CURRENT_TIMESTAMP;
-        """
-        self.cur.execute(query, data)
+
+    def flush(self, spider, final=False):
+        buffers = self.buffers
+        self.buffers = {table: {} for table in self.TABLES.values()}
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+        for table, rows in buffers.items():
+            # Rows deferred by earlier flushes; their parent tables have just
+            # been flushed above
+            deferred = self.deferred[table]
+            self.deferred[table] = {}
+
+            if rows:
+                rows = list(rows.values())
+                try:
+                    self.write_batch(table, rows)
+                    self.connection.commit()
+                    self.inc_stat(f"postgres/{table}/rows_written", len(rows))
+                except Exception as e:
+                    self.connection.rollback()
+                    spider.logger.warning(f"Batch upsert of {len(rows)} rows into {table} failed, retrying row by row: {e}")
+                    self.inc_stat(f"postgres/{table}/batch_fallbacks")
+                    self.write_rows(table, rows, spider, final)
+
+            self.retry_deferred(table, deferred, spider, final)
+
+    def write_batch(self, table, rows):
+        columns = upsert_columns(table)
+        values = [tuple(row.get(col) for col in columns) for row in rows]
+        execute_values(self.cur, self.queries[table], values, page_size=len(values))
+
+    def write_row(self, table, row):
+        name = f"{table}_row_upsert"
+        db.prepare(self.connection, self.cur, name, build_row_upsert_query(table))
+        columns = upsert_columns(table)
+        placeholders = ', '.join(['%s'] * len(columns))
+        self.cur.execute(f"EXECUTE {name} ({placeholders})", [row.get(col) for col in columns])
+
+    # Fallback for a failed batch: isolate the bad rows and keep the rest
+    def write_rows(self, table, rows, spider, final, attempts=0):
+        for row in rows:
+            try:
+                self.write_row(table, row)
+                self.connection.commit()
+                self.inc_stat(f"postgres/{table}/rows_written")
+            except psycopg2.errors.ForeignKeyViolation as e:
+                self.connection.rollback()
+                self.defer(table, row, attempts + 1, e, spider, final)
+            except Exception as e:
+                self.connection.rollback()
+                self.log_sql_error(spider, table, e, row)
+
+    # Parent row may still be in flight (e.g. fighter page not yet parsed), so
+    # set the row aside for the next flush, unless it has run out of attempts
+    def defer(self, table, row, attempts, e, spider, final):
+        if final or attempts >= self.MAX_DEFERRED_ATTEMPTS:
+            self.log_sql_error(spider, table, e, row)
+            return
+        key = tuple(row.get(col) for col in conflict_keys(table))
+        self.deferred[table].setdefault(key, (row, attempts))
+        self.inc_stat(f"postgres/{table}/rows_deferred")
+
+    # Deferred rows are written one by one, away from the batches, so a row
+    # whose parent never arrives can't push every later batch of its table
+    # into the row-by-row fallback
+    def retry_deferred(self, table, deferred, spider, final):
+        for row, attempts in deferred.values():
+            self.write_rows(table, [row], spider, final, attempts)
+
+    def stage_row(self, table, row):
+        # The running sequence number lets the merge keep the last row per key
+        self.staged[table] += 1
+        values = [row.get(col) for col in upsert_columns(table)]
+        values.append(self.staged[table])
+        self.staging[table].write(csv_line(values))
+
+    # COPY each staged table into a temp table, then merge it into the real
+    # table with one INSERT ... SELECT ... ON CONFLICT, in foreign-key order
+    def load_staged(self, spider):
+        for table in self.TABLES.values():
+            staging = self.staging[table]
+            if not self.staged[table]:
+                staging.close()
+                continue
+
+            columns = ', '.join(upsert_columns(table))
+            keys = ', '.join(conflict_keys(table))
+            stage = f"{table}_stage"
+            staging.seek(0)
+
+            try:
+                self.cur.execute(f"""
+                    CREATE TEMP TABLE {stage} ON COMMIT DROP AS
+                    SELECT {columns} FROM {table} WITH NO DATA;
+                    ALTER TABLE {stage} ADD COLUMN stage_seq BIGINT;
+                """)
+                self.cur.copy_expert(f"COPY {stage} ({columns}, stage_seq) FROM STDIN WITH (FORMAT csv)", staging)
+                self.cur.execute(f"SELECT count(*) FROM (SELECT DISTINCT {keys} FROM {stage}) AS staged")
+                distinct_rows = self.cur.fetchone()[0]
+
+                self.cur.execute(merge_sql(table, stage, seq_column='stage_seq'))
+                written = self.cur.rowcount
+                self.connection.commit()
+            except Exception as e:
+                self.connection.rollback()
+                spider.logger.error(f"Backfill of {table} failed: {e}")
+                self.inc_stat(f"postgres/{table}/rows_failed", self.staged[table])
+                continue
+            finally:
+                staging.close()
+
+            self.inc_stat(f"postgres/{table}/rows_written", written)
+            if written < distinct_rows:
+                spider.logger.warning(f"Backfill of {table} skipped {distinct_rows - written} rows with unresolved foreign keys")
+                self.inc_stat(f"postgres/{table}/rows_failed", distinct_rows - written)
+            spider.logger.info(f"Backfilled {written} rows into {table} from {self.staged[table]} staged items")
+
+    def log_sql_error(self, spider, table, e, data):
+        self.inc_stat(f"postgres/{table}/rows_failed")
+        spider.logger.error("---------------- SQL ERROR ----------------")
+        spider.logger.error(f"Table: {table}")
+        spider.logger.error(f"Error: {e}")
+        spider.logger.error(f"Data: {data}")
+        spider.logger.error("-------------------------------------------")
+
+    def inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+    def set_stat(self, key, value):
+        if self.stats is not None:
+            self.stats.set_value(key, value)
+
+# Run each item through its type's steps in a single pipeline. The handler
+# table is built once, so an item is routed with one dict lookup instead of
+# passing through every stage's type check
+class ItemDispatchPipeline:
+    def __init__(self, storage, log_level=logging.INFO):
+        self.storage = storage
+
+        fights = FightProcessorPipeline()
+        fight_upcoming = FightUpcomingProcessorPipeline()
+        fighters = FighterProcessorPipeline()
+        dates = DateFormattingPipeline()
+        fighter_fights = FighterFightProcessorPipeline()
+        fighter_fight_upcoming = FighterFightUpcomingPipeline()
+        validation = ValidationPipeline()
+
+        # Same order the items used to go through ITEM_PIPELINES
+        self.handlers = {
+            EventItem: [
+                dates.process,
+                validation.validate_event,
+                EventLoggingPipeline(log_level).log,
+                storage.process_item,
+            ],
+            FighterItem: [
+                dates.process,
+                fighters.process,
+                validation.validate_fighter,
+                FighterLoggingPipeline(log_level).log,
+                storage.process_item,
+            ],
+            FightItem: [
+                fights.process,
+                dates.process,
+                fight_upcoming.process,
+                validation.validate_fight,
+                FightLoggingPipeline(log_level).log,
+                storage.process_item,
+            ],
+            FighterFightItem: [
+                fighter_fights.process,
+                fighter_fight_upcoming.process,
+                validation.validate_fighter_fight,
+                FighterFightLoggingPipeline(log_level).log,
+                storage.process_item,
+            ],
+        }
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            storage=PostgresPipeline.from_crawler(crawler),
+            log_level=logging.getLevelName(crawler.settings.get('ITEM_LOG_LEVEL', 'INFO')),
+        )
+
+    def open_spider(self, spider):
+        self.storage.open_spider(spider)
+
+    def close_spider(self, spider):
+        self.storage.close_spider(spider)
+
+    def process_item(self, item, spider):
+        for step in self.handlers.get(type(item), ()):
+            item = step(item, spider)
+        return item
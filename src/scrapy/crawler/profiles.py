@@ -0,0 +1,27 @@
+# profiles.py
+#
+# Named bundles of settings for different kinds of crawl, applied with:
+# scrapy crawl ufc --crawl-profile <name>
+# Settings passed with -s still override the profile.
+
+PROFILES = {
+    # Full historical crawl as fast as ufcstats.com will tolerate. Concurrency
+    # adapts to latency and error rate, and each event's fighters and fights
+    # are fetched before the next event, so few events are in flight at once
+    # and the Postgres writer can flush as it goes.
+    "fast-backfill": {
+        "INCREMENTAL_CRAWL": False,
+        "CONCURRENT_REQUESTS": 32,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 8,
+        "DOWNLOAD_DELAY": 0,
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 0.25,
+        "AUTOTHROTTLE_MAX_DELAY": 20,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 8.0,
+        "ADAPTIVE_CONCURRENCY_ENABLED": True,
+        "ADAPTIVE_CONCURRENCY_MAX": 24,
+        "EVENT_DEPTH_FIRST": True,
+        "RETRY_TIMES": 4,
+        "POSTGRES_FLUSH_INTERVAL": 10,
+    },
+}
@@ -0,0 +1,71 @@
+# response_store.py
+#
+# On-disk store of downloaded pages, used to re-run the spider's parse methods
+# offline (scrapy crawl ufc --replay). Bodies are gzipped and stored once per
+# content hash under objects/, and a small JSON index entry per URL under
+# urls/ points at the body.
+
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+class ResponseStore:
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def url_key(self, url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def index_path(self, url):
+        key = self.url_key(url)
+        return self.root / "urls" / key[:2] / f"{key}.json"
+
+    def blob_path(self, digest):
+        return self.root / "objects" / digest[:2] / f"{digest}.gz"
+
+    def put(self, url, response_url, status, content_type, body, aliases=()):
+        digest = hashlib.sha256(body).hexdigest()
+        blob = self.blob_path(digest)
+        if not blob.exists():
+            self._write(blob, gzip.compress(body))
+
+        entry = {
+            "url": url,
+            "response_url": response_url,
+            "status": status,
+            "content_type": content_type,
+            "digest": digest,
+            "stored_at": datetime.now(timezone.utc).isoformat(),
+        }
+        data = json.dumps(entry).encode("utf-8")
+        for key_url in (url, *aliases):
+            self._write(self.index_path(key_url), data)
+
+        return digest
+
+    def get_entry(self, url):
+        path = self.index_path(url)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+    def get_body(self, digest):
+        return gzip.decompress(self.blob_path(digest).read_bytes())
+
+    # Iterate over stored index entries, optionally only URLs containing `pattern`
+    def entries(self, pattern=None):
+        for path in sorted((self.root / "urls").glob("*/*.json")):
+            entry = json.loads(path.read_text())
+            if pattern is None or pattern in entry["url"]:
+                yield entry
+
+    # Write via a temp file so an interrupted crawl never leaves partial files
+    def _write(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
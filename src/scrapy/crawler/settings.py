@@ -50,9 +50,35 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "crawler.middlewares.CrawlerDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    # Between redirects and decompression, so stored bodies are decompressed
+    # and indexed under the URL that was originally requested
+    "crawler.middlewares.ResponseStoreMiddleware": 585,
+    # Closest to the downloader, so every retry attempt is counted
+    "crawler.middlewares.AdaptiveConcurrencyMiddleware": 900,
+}
+
+# Adaptive per-domain concurrency (see AdaptiveConcurrencyMiddleware). Enabled
+# by the fast-backfill profile: scrapy crawl ufc --crawl-profile fast-backfill
+ADAPTIVE_CONCURRENCY_ENABLED = False
+ADAPTIVE_CONCURRENCY_WINDOW = 50
+ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE = 0.05
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 2.0
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX = 16
+
+# Prioritise each event's fighter and fight pages over every later event, so
+# events are finished one at a time instead of breadth-first
+EVENT_DEPTH_FIRST = False
+
+# Keep every downloaded page on disk so parsers can be re-run offline with:
+# scrapy crawl ufc --replay
+RESPONSE_STORE_ENABLED = True
+RESPONSE_STORE_DIR = "responsestore"
+RESPONSE_STORE_REPLAY = False
+
+# Project commands (overrides "scrapy crawl" to add --replay and --crawl-profile)
+COMMANDS_MODULE = "crawler.commands"
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -60,23 +86,39 @@ ROBOTSTXT_OBEY = True
 #    "scrapy.extensions.telnet.TelnetConsole": None,
 #}
 
+# Incremental crawling: skip events already stored as completed and only follow
+# new events, upcoming events and events whose status changed.
+# Enable per run with: scrapy crawl ufc -s INCREMENTAL_CRAWL=True
+INCREMENTAL_CRAWL = False
+# Completed events scraped within this many days of the event date are
+# re-crawled, since results and stats can still be posted after fight night
+INCREMENTAL_SETTLE_DAYS = 2
+
+# Skip fighter pages scraped within this many days (height, reach, stance and
+# DOB rarely change). Set to 0 to refetch every fighter on every card.
+FIGHTER_CACHE_TTL_DAYS = 30
+
+# PostgresPipeline buffers items and flushes them as multi-row upserts once
+# this many items are buffered or this many seconds have passed
+POSTGRES_BATCH_SIZE = 500
+POSTGRES_FLUSH_INTERVAL = 30
+# Full historical re-scrapes: stage every item on disk and load each table
+# with COPY plus one set-based merge when the spider closes.
+# Enable per run with: scrapy crawl ufc -s POSTGRES_BACKFILL=True
+POSTGRES_BACKFILL = False
+
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+# Every item type is routed through its processing, validation, logging and
+# storage steps by a single dispatching pipeline
 ITEM_PIPELINES = {
-  "crawler.pipelines.FightProcessorPipeline": 200,
-  "crawler.pipelines.DateFormattingPipeline": 210,
-  "crawler.pipelines.FighterProcessorPipeline": 220,
-  "crawler.pipelines.FightUpcomingProcessorPipeline": 230,
-  "crawler.pipelines.FighterFightProcessorPipeline": 240,
-  "crawler.pipelines.FighterFightUpcomingPipeline": 250,
-  "crawler.pipelines.ValidationPipeline": 260,
-  "crawler.pipelines.EventLoggingPipeline": 290,
-  "crawler.pipelines.FighterLoggingPipeline": 291,
-  "crawler.pipelines.FightLoggingPipeline": 292,
-  "crawler.pipelines.FighterFightLoggingPipeline": 293,
-   "crawler.pipelines.PostgresPipeline": 300,
+  "crawler.pipelines.ItemDispatchPipeline": 300,
 }
 
+# Level scraped items are logged at. Below LOG_LEVEL they are never formatted;
+# run with -s ITEM_LOG_LEVEL=INFO to write every item to the log file
+ITEM_LOG_LEVEL = "DEBUG"
+
 
 from datetime import datetime
 _now = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
@@ -5,11 +5,11 @@ from scrapy.linkextractors import LinkExtractor
 from ..items import FighterItem, FightItem, EventItem, FighterFightItem
 from itemloaders.processors import MapCompose, TakeFirst
 from scrapy.loader import ItemLoader
-from ..loaders import BaseLoader, EventLoader, FightLoader, FighterLoader, FighterFightLoader
-from datetime import datetime
-from ..constants import TOTAL_FIELDS, SIG_FIELDS, CUTOFF_TIME, FIGHT_SELECTORS
-import psycopg2
-import os
+from ..loaders import BaseLoader, EventLoader, FightLoader, FighterLoader
+from ..extractors import extract_fight_stats, STAT_FIELDS
+from datetime import datetime, timedelta, timezone
+from ..constants import CUTOFF_TIME, FIGHT_SELECTORS
+import db
 
 
 class UfcSpider(scrapy.Spider):
@@ -18,39 +18,86 @@ class UfcSpider(scrapy.Spider):
 
     def __init__(self, *args, **kwargs):
         super(UfcSpider, self).__init__(*args, **kwargs)
-        
-        self.connection = psycopg2.connect(
-            host='localhost',
-            user='erickim',
-            password=os.getenv("POSTGRES_PASSWORD"),
-            dbname='ufc'
-        )
-        self.cur = self.connection.cursor()
 
         # Guard against already scraped data
-        # self.cur.execute("SELECT event_id FROM events")
-        # self.seen_events = {row[0] for row in self.cur.fetchall()}
-
-        # self.cur.execute("SELECT fight_id FROM fights")
-        # self.seen_fights = {row[0] for row in self.cur.fetchall()}
-
-        # self.cur.execute("SELECT fighter_id, updated_at FROM fighters")
-        # self.fighter_updates = {row[0]: row[1] for row in self.cur.fetchall()}
-
-        # self.cur.execute("SELECT fight_id, fighter_id FROM fighter_fights")
-        # self.seen_stats = {(row[0], row[1]) for row in self.cur.fetchall()}
-
-        # self.cur.close()
-        # self.connection.close()
+        self.known_events = {}
+        self.fighter_updates = {}
+        self.requested_fighters = set()
 
     # Get requests for each event in events page
     def start_requests(self):
+        if self.settings.getbool("INCREMENTAL_CRAWL"):
+            self.known_events = self.load_known_events()
+            self.logger.info(f"Incremental crawl: {len(self.known_events)} events already stored")
+
+        if self.settings.getfloat("FIGHTER_CACHE_TTL_DAYS") > 0:
+            self.fighter_updates = self.load_fighter_updates()
+
         url = "http://www.ufcstats.com/statistics/events/completed?page=all"
         yield scrapy.Request(url=url, callback = self.parse)
 
+    # Load stored events as {event_id: (event_status, date, updated_at)}
+    def load_known_events(self):
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT event_id, event_status, date, updated_at FROM events")
+            return {row[0]: (row[1], row[2], row[3]) for row in cur.fetchall()}
+
+    # Load when each stored fighter was last scraped as {fighter_id: updated_at}
+    def load_fighter_updates(self):
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT fighter_id, updated_at FROM fighters")
+            return {row[0]: row[1] for row in cur.fetchall()}
+
+    # Fighter pages are fetched once per run, and not at all if the stored
+    # fighter was scraped within FIGHTER_CACHE_TTL_DAYS
+    def should_fetch_fighter(self, fighter_id):
+        stats = self.crawler.stats
+
+        if fighter_id in self.requested_fighters:
+            stats.inc_value("fighter_cache/duplicate")
+            return False
+
+        updated_at = self.fighter_updates.get(fighter_id)
+        if updated_at is not None:
+            ttl = timedelta(days=self.settings.getfloat("FIGHTER_CACHE_TTL_DAYS"))
+            if datetime.now(timezone.utc) - updated_at < ttl:
+                stats.inc_value("fighter_cache/hit")
+                return False
+
+        stats.inc_value("fighter_cache/miss")
+        self.requested_fighters.add(fighter_id)
+        return True
+
+    # An event needs crawling unless it is stored as completed and was last
+    # scraped long enough after the event date for its results to be final
+    def needs_crawl(self, event_id, event_status):
+        if event_id not in self.known_events:
+            return True
+        if event_status != "completed":
+            return True
+
+        stored_status, stored_date, updated_at = self.known_events[event_id]
+        if stored_status != event_status:
+            return True
+
+        settle_days = self.settings.getint("INCREMENTAL_SETTLE_DAYS")
+        if updated_at is None or updated_at.date() < stored_date + timedelta(days=settle_days):
+            return True
+
+        return False
+
+    # Request priorities as (event, fighter, fight). With EVENT_DEPTH_FIRST every
+    # request for an event outranks the next event's page, and fighters are
+    # fetched before their fights so the fights' foreign keys resolve
+    def request_priorities(self, event_index):
+        if not self.settings.getbool("EVENT_DEPTH_FIRST"):
+            return 15, 10, 5
+        base = -3 * event_index
+        return base, base + 2, base + 1
+
     def parse(self, response):
         rows = response.xpath('//tr[contains(@class, "b-statistics__table-row")]')[1:]        
-        for row in rows:
+        for event_index, row in enumerate(rows):
             link = row.xpath('.//a/@href').get()
             date_str = row.xpath("normalize-space(.//span[@class='b-statistics__date']/text())").get()
 
@@ -64,8 +111,6 @@ class UfcSpider(scrapy.Spider):
 
                 if event_date < CUTOFF_TIME:
                     continue
-                # if event_id in self.seen_events:
-                #     continue
 
                 event_name = row.xpath("normalize-space(.//a/text())").get()
 
@@ -73,17 +118,22 @@ class UfcSpider(scrapy.Spider):
                     event_status = "completed"
                 else:
                     event_status = "upcoming"
+
+                if self.known_events and not self.needs_crawl(event_id, event_status):
+                    self.crawler.stats.inc_value("incremental/events_skipped")
+                    continue
                 callback = self.parse_event
 
                 yield response.follow(
                     link,
                     callback=callback,
-                    priority=15,
+                    priority=self.request_priorities(event_index)[0],
                     meta={
                         "event_id": event_id, 
                         "event_date": date_str, 
                         "event_name": event_name,
-                        "event_status": event_status
+                        "event_status": event_status,
+                        "event_index": event_index
                     }
                 )
             except Exception as e:
@@ -100,6 +150,8 @@ class UfcSpider(scrapy.Spider):
 
         yield eventLoader.load_item()
 
+        _, fighter_priority, fight_priority = self.request_priorities(response.meta.get("event_index", 0))
+
         # Iterate through each fight in each event page
         rows = response.xpath('//tr[contains(@class, "js-fight-details-click")]')
         for row in rows:
@@ -108,16 +160,18 @@ class UfcSpider(scrapy.Spider):
             weight_class = row.xpath("normalize-space(./td[7]//p/text())").get()
 
             for link in fighter_links:
+                if not self.should_fetch_fighter(link.rstrip("/").split("/")[-1]):
+                    continue
                 yield response.follow(
                     link,
                     callback=self.parse_fighter,
-                    priority=10,
+                    priority=fighter_priority,
                 )
 
             yield response.follow(
                 fight_link,
                 callback=self.parse_fight,
-                priority=5,
+                priority=fight_priority,
                 meta={
                     "event_id": eventLoader.get_output_value('event_id'),
                     "event_date": eventLoader.get_output_value('date'),
@@ -160,74 +214,43 @@ class UfcSpider(scrapy.Spider):
             for field in FIGHT_SELECTORS.keys():
                 fightLoader.add_value(field, None)
         
-        ffLoaderRed = FighterFightLoader(item=FighterFightItem(), response = response)
-        ffLoaderBlue = FighterFightLoader(item=FighterFightItem(), response = response)
-        self.parse_fighter_fights(response, ffLoaderRed, ffLoaderBlue, fightLoader)
-        
+        red_fighter_fight, blue_fighter_fight = self.parse_fighter_fights(response, fightLoader)
+
         yield fightLoader.load_item()
-        yield ffLoaderRed.load_item()
-        yield ffLoaderBlue.load_item()
+        yield red_fighter_fight
+        yield blue_fighter_fight
 
-    def parse_fighter_fights(self, response, ffLoaderRed, ffLoaderBlue, fightLoader):
+    # Build both fighters' FighterFightItems from one pass over the stats tables
+    def parse_fighter_fights(self, response, fightLoader):
         fight_id = fightLoader.get_output_value('fight_id')
         red_fighter_id = fightLoader.get_output_value('red_fighter_id')
         blue_fighter_id = fightLoader.get_output_value('blue_fighter_id')
         event_status = fightLoader.get_output_value('event_status')
 
-        # if (fight_id, red_fighter_id) in self.seen_stats:
-        #     return
-        # if (fight_id, blue_fighter_id) in self.seen_stats:
-        #     return
-
-        ffLoaderRed.add_value('fight_id', fight_id)
-        ffLoaderRed.add_value('fighter_id', red_fighter_id)
-        ffLoaderRed.add_value('opponent_id', blue_fighter_id)
-        ffLoaderRed.add_value('event_status', event_status)
-        
-        ffLoaderBlue.add_value('fight_id', fight_id)
-        ffLoaderBlue.add_value('fighter_id', fightLoader.get_output_value('blue_fighter_id'))
-        ffLoaderBlue.add_value('opponent_id', fightLoader.get_output_value('red_fighter_id'))
-        ffLoaderBlue.add_value('event_status', event_status)
-        
-        # Total Table
-        total_tds = response.xpath("(//table)//td[@class='b-fight-details__table-col']")
-        for field, td in zip(TOTAL_FIELDS, total_tds):
-            if field is None:
-                continue
-
-            if event_status == 'completed':
-                red_val = td.xpath("normalize-space(./p[1]/text())").get()
-                blue_val = td.xpath("normalize-space(./p[2]/text())").get()
-
-                ffLoaderRed.add_value(field, red_val)
-                ffLoaderBlue.add_value(field, blue_val)
-            else:
-                ffLoaderRed.add_value(field, None)
-                ffLoaderBlue.add_value(field, None)
-
-        # Significant Strikes Table
-        sig_tds = response.xpath("(//table)[3]//td[@class='b-fight-details__table-col']")
-        for field, td in zip(SIG_FIELDS, sig_tds):
-            if field is None:
-                continue
-            if event_status == 'completed':
-                red_val = td.xpath("normalize-space(./p[1]/text())").get()
-                blue_val = td.xpath("normalize-space(./p[2]/text())").get()
-
-                ffLoaderRed.add_value(field, red_val)
-                ffLoaderBlue.add_value(field, blue_val)
-            else:
-                ffLoaderRed.add_value(field, None)
-                ffLoaderBlue.add_value(field, None)
+        if event_status == 'completed':
+            red_values, blue_values = extract_fight_stats(response)
+        else:
+            red_values = blue_values = ()
+
+        red = self.fighter_fight_item(fight_id, red_fighter_id, blue_fighter_id, event_status, red_values)
+        blue = self.fighter_fight_item(fight_id, blue_fighter_id, red_fighter_id, event_status, blue_values)
+        return red, blue
+
+    # Like ItemLoader.load_item, fields without a value are left unset
+    def fighter_fight_item(self, fight_id, fighter_id, opponent_id, event_status, values):
+        fields = {
+            'fight_id': fight_id,
+            'fighter_id': fighter_id,
+            'opponent_id': opponent_id,
+            'event_status': event_status,
+        }
+        fields.update(zip(STAT_FIELDS, values))
+        return FighterFightItem({k: v for k, v in fields.items() if v is not None})
 
     # Get attributes of each fighter (FighterItem)
     def parse_fighter(self, response):
         loader = FighterLoader(item=FighterItem(), response = response)
 
-        fighter_id = response.url.split("/")[-1]
-        # if fighter_id in self.fighter_updates:
-        #     return
-
         loader.add_value('fighter_id', response.url.split("/")[-1])
         loader.add_xpath('name', "//span[contains(@class,'b-content__title-highlight')]/text()")
         loader.add_xpath('height', "//li[contains(., 'Height:')]/text()[last()]")
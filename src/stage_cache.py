@@ -0,0 +1,183 @@
+# stage_cache.py
+#
+# Runs a pipeline of stages, keeping each stage's output in stage_cache/ as an
+# Arrow file. A stage's key hashes its source code, the source of the project
+# functions it calls, by bare name or through a module (fe.calculate_rates),
+# the module constants they read (EWM_SPAN, the column lists, ...) and the keys
+# of its inputs. Stages that read from Postgres are
+# keyed by the row count and latest updated_at of their tables instead.
+#
+# A rerun asks for the last stage and works backwards, so it loads the deepest
+# stage whose key is still cached and only runs the stages after it. Once the
+# cache grows past its size limit the least recently used files are evicted.
+
+import ast
+import hashlib
+import inspect
+import json
+import os
+import textwrap
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+PROJECT_DIR = Path(__file__).resolve().parent
+CACHE_DIR = PROJECT_DIR / "stage_cache"
+CACHE_MAX_BYTES = 512 * 2**20
+
+# Library versions are part of every key, an upgrade can change the output
+CACHE_SALT = f"pandas {pd.__version__}, numpy {np.__version__}, pyarrow {pa.__version__}"
+
+
+def referenced_names(code):
+  names = set(code.co_names)
+  for const in code.co_consts:
+    if inspect.iscode(const):
+      names |= referenced_names(const)
+  return names
+
+def is_project_module(module):
+  path = getattr(module, '__file__', None)
+  return path is not None and Path(path).resolve().parent == PROJECT_DIR
+
+# (module, attribute) for every `module.attr` in the function's source, where
+# module is one of its globals
+def module_attributes(f, source):
+  found = set()
+  for node in ast.walk(ast.parse(source)):
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+      module = f.__globals__.get(node.value.id)
+      if inspect.ismodule(module) and hasattr(module, node.attr):
+        found.add((module, node.attr))
+  return found
+
+# Source of `func` and of every project function it reaches, plus the module
+# constants those functions read, keyed by module-qualified name
+def code_fingerprint(func):
+  sources = {}
+  constants = {}
+  pending = [func]
+  while pending:
+    f = pending.pop()
+    qualified = f"{f.__module__}.{f.__qualname__}"
+    if qualified in sources:
+      continue
+    source = inspect.getsource(f)
+    sources[qualified] = source
+
+    references = [
+      (f.__module__, name, f.__globals__[name])
+      for name in referenced_names(f.__code__)
+      if name in f.__globals__
+    ]
+    references += [
+      (module.__name__, attr, getattr(module, attr))
+      for module, attr in module_attributes(f, textwrap.dedent(source))
+      if is_project_module(module)
+    ]
+
+    for module_name, name, value in references:
+      if inspect.isfunction(value):
+        if is_project_module(inspect.getmodule(value)):
+          pending.append(value)
+      elif not (inspect.ismodule(value) or inspect.isclass(value) or callable(value)):
+        constants[f"{module_name}.{name}"] = repr(sorted(value) if isinstance(value, (set, frozenset)) else value)
+
+  return {'sources': sources, 'constants': constants}
+
+def table_fingerprint(engine, tables):
+  fingerprint = {}
+  for table in tables:
+    row = pd.read_sql(f"SELECT count(*) AS n, max(updated_at) AS updated_at FROM {table};", con=engine).iloc[0]
+    fingerprint[table] = [int(row['n']), None if pd.isna(row['updated_at']) else pd.Timestamp(row['updated_at']).isoformat()]
+  return fingerprint
+
+def stage_keys(engine, stages):
+  keys = {}
+  for stage in stages:
+    inputs = stage.get('inputs', [])
+    payload = {
+      'salt': CACHE_SALT,
+      'stage': stage['name'],
+      'code': code_fingerprint(stage['run']),
+      'inputs': [keys[name] for name in inputs],
+      'tables': table_fingerprint(engine, stage.get('tables', [])),
+    }
+    keys[stage['name']] = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+  return keys
+
+def cache_path(cache_dir, name, key):
+  return cache_dir / f"{name}-{key[:24]}.arrow"
+
+def read_entry(path):
+  # Bump the mtime, eviction goes by last use
+  os.utime(path)
+  return feather.read_table(path).to_pandas()
+
+# Written under a temporary name first, so a failed run never leaves a
+# truncated entry behind
+def write_entry(path, df):
+  tmp_path = path.with_suffix(".tmp")
+  feather.write_feather(pa.Table.from_pandas(df), tmp_path, compression="lz4")
+  os.replace(tmp_path, path)
+
+# Drops the least recently used entries until the cache fits in `max_bytes`.
+# Entries used by this run are kept even if they alone exceed it.
+def evict(cache_dir, max_bytes, keep):
+  entries = sorted(cache_dir.glob("*.arrow"), key=lambda path: path.stat().st_mtime)
+  total = sum(path.stat().st_size for path in entries)
+  for path in entries:
+    if total <= max_bytes:
+      break
+    if path in keep:
+      continue
+    total -= path.stat().st_size
+    path.unlink()
+
+# Returns the output of the last stage. Each stage is a dict with a unique
+# 'name' and a 'run' function called with the outputs of its 'inputs' stages,
+# or with the engine if it reads 'tables'. With use_cache=False every stage
+# runs and nothing is read or written.
+def run_pipeline(engine, stages, use_cache=True, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+  by_name = {stage['name']: stage for stage in stages}
+  keys = stage_keys(engine, stages) if use_cache else {}
+  if use_cache:
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+  outputs = {}
+  used = set()
+
+  def get(name):
+    if name in outputs:
+      return outputs[name]
+
+    stage = by_name[name]
+    path = cache_path(cache_dir, name, keys[name]) if use_cache else None
+    if path is not None and path.exists():
+      print(f"{name}: loaded from cache")
+      df = read_entry(path)
+    else:
+      if 'tables' in stage:
+        args = [engine]
+      else:
+        args = [get(input_name) for input_name in stage['inputs']]
+      start = time.perf_counter()
+      df = stage['run'](*args)
+      print(f"{name}: {time.perf_counter() - start:.2f}s")
+      if path is not None:
+        write_entry(path, df)
+
+    if path is not None:
+      used.add(path)
+    outputs[name] = df
+    return df
+
+  df = get(stages[-1]['name'])
+  if use_cache:
+    evict(cache_dir, max_bytes, used)
+
+  return df
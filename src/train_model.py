@@ -0,0 +1,113 @@
+# train_model.py
+#
+# Fits the model from notebooks/model.ipynb on every completed fight in
+# data.parquet and registers it in models/ (see model_registry.py) with the
+# class labels and the ordered feature columns it was fitted on, a hash of the
+# data and its metrics on the latest fights, for predict_service.py and
+# score_upcoming.py. The metrics come from a second fit on all but the last
+# HOLDOUT share of fights, the chronological split of the notebook.
+#
+# Usage: python train_model.py [--data data.parquet] [--registry models] [--no-current]
+
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder
+
+import model_registry
+
+BASE_DIR = Path(__file__).resolve().parent
+DATA_PATH = BASE_DIR / "data.parquet"
+
+TARGET = 'winner'
+
+# Columns of data.parquet that aren't features
+NON_FEATURES = [TARGET, 'event_status']
+
+MODEL_PARAMS = {
+  'learning_rate': 0.05,
+  'max_depth': 6,
+  'max_iter': 500,
+  'min_samples_leaf': 20,
+  'l2_regularization': 1.0,
+  'random_state': 42,
+}
+
+# Share of the latest completed fights held out for the metrics
+HOLDOUT = 0.15
+
+
+def build_model():
+  return Pipeline(steps=[
+    ("model", HistGradientBoostingClassifier(**MODEL_PARAMS)),
+  ])
+
+# Completed fights with a winner, as features and labels
+def training_frame(df):
+  completed = df[(df['event_status'] == 'completed') & df[TARGET].notna()]
+  return completed.drop(columns=NON_FEATURES), completed[TARGET]
+
+# Scores of a model fitted on the earlier fights on the later ones. Rows are in
+# event order, as clean_up_for_training sorts them.
+def holdout_metrics(X, y):
+  split = int(len(X) * (1 - HOLDOUT))
+  clf = build_model().fit(X.iloc[:split], y[:split])
+  proba = clf.predict_proba(X.iloc[split:])[:, 1]
+  return {
+    'holdout_rows': len(X) - split,
+    'auc': roc_auc_score(y[split:], proba),
+    'log_loss': log_loss(y[split:], proba, labels=[0, 1]),
+    'accuracy': accuracy_score(y[split:], proba >= 0.5),
+  }
+
+def train(df):
+  X, y = training_frame(df)
+  le = LabelEncoder()
+  labels = le.fit_transform(y)
+  clf = build_model()
+  clf.fit(X, labels)
+  trained_at = datetime.now(timezone.utc)
+  data_hash = model_registry.data_hash(pd.concat([X, y], axis=1))
+
+  return {
+    'model': clf,
+    'classes': list(le.classes_),
+    'features': list(X.columns),
+    'rows': len(X),
+    'trained_at': trained_at.isoformat(),
+    # Stored with every prediction the model makes
+    'version': f"{trained_at.strftime('%Y%m%dT%H%M%SZ')}-{data_hash[:8]}",
+    'data_hash': data_hash,
+    'params': MODEL_PARAMS,
+    'metrics': holdout_metrics(X, labels),
+  }
+
+def save_model(artifact, registry_dir=model_registry.REGISTRY_DIR, make_current=True):
+  return model_registry.register(artifact, registry_dir, make_current)
+
+# The current model unless a version is given
+def load_model(version=None, registry_dir=model_registry.REGISTRY_DIR):
+  return model_registry.load(version, registry_dir)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--data", default=str(DATA_PATH))
+  parser.add_argument("--registry", default=str(model_registry.REGISTRY_DIR))
+  parser.add_argument("--no-current", action="store_true", help="register without making it the current model")
+  args = parser.parse_args()
+
+  artifact = train(pd.read_parquet(args.data))
+  path = save_model(artifact, args.registry, make_current=not args.no_current)
+  metrics = artifact['metrics']
+  print(f"Trained on {artifact['rows']} fights, {len(artifact['features'])} features -> {path}")
+  print(f"Holdout of {metrics['holdout_rows']}: AUC {metrics['auc']:.4f}, log loss {metrics['log_loss']:.4f}, accuracy {metrics['accuracy']:.4f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,154 @@
+# tree_inference.py
+#
+# Fast predict_proba for the fitted HistGradientBoostingClassifier and
+# RandomForestClassifier of train_model.py and the notebooks. sklearn's
+# predict_proba spends about 10 ms per call on validation and thread pool set
+# up before walking any tree, which is most of the time when scoring one fight
+# or one card. compile_model flattens every tree into shared node arrays (split
+# feature, threshold, NaN direction, children, leaf value) and predict_proba
+# walks all trees for all rows at once, one depth level per step, with NumPy
+# gathers.
+#
+# Splits follow sklearn: a row goes left when its value is <= the threshold,
+# and NaNs go the way the node learned for missing values. Random forest trees
+# compare float32 values, as sklearn casts X to float32 for them. Probabilities
+# match sklearn's to floating-point tolerance; only the order of the sums over
+# trees differs.
+#
+# This is for the small batches the prediction service scores: one fight in
+# well under a millisecond, a card in a few. Every step gathers (rows, trees)
+# values, so for thousands of rows sklearn's compiled loops win again, see
+# benchmarks/tree_inference.py.
+
+import numpy as np
+from scipy.special import expit
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.pipeline import Pipeline
+
+# Rows walked together; keeps the per-step (rows, trees) arrays in cache
+CHUNK_ROWS = 512
+
+
+class UnsupportedModel(Exception):
+  pass
+
+
+# Node arrays of several trees as one set, children shifted to the combined
+# positions. Leaves point to themselves, so extra steps leave them in place.
+def flatten_trees(trees):
+  offsets = np.cumsum([0] + [len(tree['left']) for tree in trees])
+  nodes = {key: np.concatenate([tree[key] for tree in trees]) for key in ['feature', 'threshold', 'missing_left', 'value']}
+
+  for side in ['left', 'right']:
+    nodes[side] = np.concatenate([
+      np.where(tree['is_leaf'], np.arange(len(tree['left'])), tree[side]) + offset
+      for tree, offset in zip(trees, offsets)
+    ]).astype(np.int64)
+
+  nodes['feature'] = nodes['feature'].astype(np.int64)
+  nodes['roots'] = offsets[:-1].astype(np.int64)
+  nodes['depth'] = max(tree['depth'] for tree in trees)
+  return nodes
+
+def hgb_trees(model):
+  if model.n_trees_per_iteration_ != 1:
+    raise UnsupportedModel("only binary HistGradientBoostingClassifier models are supported")
+  if model.is_categorical_ is not None and np.any(model.is_categorical_):
+    raise UnsupportedModel("categorical features aren't supported")
+
+  trees = []
+  for (predictor,) in model._predictors:
+    nodes = predictor.nodes
+    is_leaf = nodes['is_leaf'].astype(bool)
+    trees.append({
+      'feature': np.where(is_leaf, 0, nodes['feature_idx']),
+      'threshold': nodes['num_threshold'],
+      'missing_left': nodes['missing_go_to_left'].astype(bool),
+      'left': nodes['left'].astype(np.int64),
+      'right': nodes['right'].astype(np.int64),
+      'is_leaf': is_leaf,
+      'value': np.where(is_leaf, nodes['value'], 0.0),
+      'depth': int(nodes['depth'].max()),
+    })
+  return trees
+
+def forest_trees(model):
+  if model.n_outputs_ != 1 or len(model.classes_) != 2:
+    raise UnsupportedModel("only binary single-output RandomForestClassifier models are supported")
+
+  trees = []
+  for estimator in model.estimators_:
+    tree = estimator.tree_
+    is_leaf = tree.children_left == -1
+    # Each tree's probability of the second class, as Tree.predict_proba
+    # normalises its leaf values
+    value = tree.value[:, 0, :]
+    total = value.sum(axis=1)
+    proba = value[:, 1] / np.where(total == 0, 1, total)
+    trees.append({
+      'feature': np.where(is_leaf, 0, tree.feature),
+      'threshold': tree.threshold,
+      'missing_left': tree.missing_go_to_left.astype(bool),
+      'left': tree.children_left.astype(np.int64),
+      'right': tree.children_right.astype(np.int64),
+      'is_leaf': is_leaf,
+      'value': np.where(is_leaf, proba, 0.0),
+      'depth': int(tree.max_depth),
+    })
+  return trees
+
+# The model of a Pipeline whose only step is the model, as train_model.py
+# builds it, or the model itself
+def final_estimator(model):
+  if isinstance(model, Pipeline):
+    steps = [step for _, step in model.steps if step not in (None, 'passthrough')]
+    if len(steps) != 1:
+      raise UnsupportedModel("only pipelines with no steps before the model are supported")
+    model = steps[0]
+  return model
+
+def compile_model(model):
+  model = final_estimator(model)
+  if isinstance(model, HistGradientBoostingClassifier):
+    compiled = flatten_trees(hgb_trees(model))
+    compiled.update(kind='hgb', baseline=float(model._baseline_prediction.ravel()[0]))
+  elif isinstance(model, RandomForestClassifier):
+    compiled = flatten_trees(forest_trees(model))
+    compiled.update(kind='rf', baseline=0.0)
+  else:
+    raise UnsupportedModel(f"can't compile {type(model).__name__}")
+
+  compiled['n_features'] = model.n_features_in_
+  return compiled
+
+# Leaf values of every tree for each row, as (rows, trees)
+def leaf_values(compiled, X):
+  n_rows, n_features = X.shape
+  flat = X.ravel()
+  row_starts = (np.arange(n_rows) * n_features)[:, None]
+
+  node = np.broadcast_to(compiled['roots'], (n_rows, len(compiled['roots'])))
+  for _ in range(compiled['depth']):
+    x = flat[row_starts + compiled['feature'][node]]
+    go_left = np.where(np.isnan(x), compiled['missing_left'][node], x <= compiled['threshold'][node])
+    node = np.where(go_left, compiled['left'][node], compiled['right'][node])
+  return compiled['value'][node]
+
+# Same as the sklearn model's predict_proba, for a frame or array of rows with
+# the model's features in order
+def predict_proba(compiled, X):
+  X = np.asarray(X, dtype=np.float64)
+  if X.ndim != 2 or X.shape[1] != compiled['n_features']:
+    raise ValueError(f"expected rows of {compiled['n_features']} features, got shape {X.shape}")
+  if compiled['kind'] == 'rf':
+    X = X.astype(np.float32).astype(np.float64)
+
+  positive = np.empty(len(X))
+  for start in range(0, len(X), CHUNK_ROWS):
+    values = leaf_values(compiled, np.ascontiguousarray(X[start:start + CHUNK_ROWS]))
+    if compiled['kind'] == 'hgb':
+      positive[start:start + CHUNK_ROWS] = expit(compiled['baseline'] + values.sum(axis=1))
+    else:
+      positive[start:start + CHUNK_ROWS] = values.mean(axis=1)
+
+  return np.column_stack([1 - positive, positive])
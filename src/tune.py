@@ -0,0 +1,248 @@
+# tune.py
+#
+# Hyperparameter search for the notebook models (hgb, rf) by successive
+# halving over the walk-forward folds of backtest.py. --trials parameter sets
+# are drawn from SEARCH_SPACES; every trial is scored on the newest fold, the
+# best 1/--eta by mean log loss go on to eta times as many folds, and so on
+# until the survivors have been scored on every fold. Weak trials are pruned
+# after a fold or two instead of fitting them on all of them.
+#
+# Each rung's (trial, fold) fits run in backtest.py's process pool over the
+# memory-mapped features. Every trial and every fold score is saved to a
+# SQLite store as it finishes, keyed by a search id made from the model, the
+# search settings and a hash of the data. Rerunning the same search resumes it:
+# trials are drawn from the same seed and scored folds are read back, not refit.
+#
+# Usage: python tune.py [--model hgb|rf] [--trials 27] [--eta 3] [--folds 9] [--min-train 0.5]
+#                       [--seed 0] [--workers N] [--store tuning.sqlite]
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import feature_state as fs
+
+STORE_PATH = Path(__file__).resolve().parent / "tuning.sqlite"
+
+# (kind, values): 'choice' picks one of the values, 'log' draws log-uniformly
+# between the two bounds
+SEARCH_SPACES = {
+  'hgb': {
+    'learning_rate': ('log', (0.01, 0.3)),
+    'max_depth': ('choice', [3, 4, 6, 8, None]),
+    'max_iter': ('choice', [100, 200, 500, 1000]),
+    'min_samples_leaf': ('choice', [10, 20, 40, 80]),
+    'l2_regularization': ('log', (1e-3, 10.0)),
+  },
+  'rf': {
+    'n_estimators': ('choice', [100, 300, 600]),
+    'max_depth': ('choice', [6, 10, 16, None]),
+    'min_samples_leaf': ('choice', [1, 2, 5, 10]),
+    'max_features': ('choice', ['sqrt', 0.3, 0.5]),
+  },
+}
+
+STORE_TABLES = [
+  """
+  CREATE TABLE IF NOT EXISTS searches (
+    search_id TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    created_at TEXT NOT NULL
+  )
+  """,
+  """
+  CREATE TABLE IF NOT EXISTS trials (
+    search_id TEXT NOT NULL REFERENCES searches(search_id),
+    trial INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (search_id, trial)
+  )
+  """,
+  """
+  CREATE TABLE IF NOT EXISTS fold_scores (
+    search_id TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    fold INTEGER NOT NULL,
+    cutoff TEXT NOT NULL,
+    auc REAL,
+    log_loss REAL NOT NULL,
+    accuracy REAL NOT NULL,
+    fit_seconds REAL NOT NULL,
+    PRIMARY KEY (search_id, trial, fold),
+    FOREIGN KEY (search_id, trial) REFERENCES trials(search_id, trial)
+  )
+  """,
+]
+
+
+def sample_params(space, rng):
+  params = {}
+  for name, (kind, values) in space.items():
+    if kind == 'log':
+      low, high = np.log(values[0]), np.log(values[1])
+      params[name] = float(f"{np.exp(rng.uniform(low, high)):.4g}")
+    else:
+      params[name] = values[rng.integers(len(values))]
+  return params
+
+# The same seed gives the same trials, so a resumed search lines up with the
+# stored one
+def sample_trials(model_name, trials, seed):
+  rng = np.random.default_rng(seed)
+  return [sample_params(SEARCH_SPACES[model_name], rng) for _ in range(trials)]
+
+# Number of folds each rung scores its trials on, ending with all of them
+def rung_folds(folds, eta):
+  budgets = [1]
+  while budgets[-1] * eta < folds:
+    budgets.append(budgets[-1] * eta)
+  return budgets + [folds] if budgets[-1] < folds else budgets
+
+def open_store(path=STORE_PATH):
+  store = sqlite3.connect(path)
+  for statement in STORE_TABLES:
+    store.execute(statement)
+  store.commit()
+  return store
+
+def search_id(model_name, settings, X, y):
+  data_hash = hashlib.sha1(X.tobytes() + y.tobytes()).hexdigest()
+  key = json.dumps({'model': model_name, 'data': data_hash, **settings}, sort_keys=True)
+  return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def start_search(store, sid, model_name, settings, trials):
+  store.execute(
+    "INSERT OR IGNORE INTO searches VALUES (?, ?, ?, ?)",
+    (sid, model_name, json.dumps(settings), datetime.now(timezone.utc).isoformat()),
+  )
+  store.executemany(
+    "INSERT OR IGNORE INTO trials VALUES (?, ?, ?, 'running')",
+    [(sid, trial, json.dumps(params)) for trial, params in enumerate(trials)],
+  )
+  store.commit()
+
+# {(trial, fold): log_loss} of the folds already scored
+def stored_scores(store, sid):
+  rows = store.execute("SELECT trial, fold, log_loss FROM fold_scores WHERE search_id = ?", (sid,))
+  return {(trial, fold): loss for trial, fold, loss in rows}
+
+def save_score(store, sid, trial, fold, result):
+  store.execute(
+    "INSERT OR REPLACE INTO fold_scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    (sid, trial, fold, str(result['cutoff']), None if np.isnan(result['auc']) else float(result['auc']),
+     float(result['log_loss']), float(result['accuracy']), result['seconds']),
+  )
+  store.commit()
+
+def set_status(store, sid, trials, status):
+  store.executemany(
+    "UPDATE trials SET status = ? WHERE search_id = ? AND trial = ?",
+    [(status, sid, trial) for trial in trials],
+  )
+  store.commit()
+
+# Every trial with its mean scores over the folds it was scored on
+def leaderboard(store, sid):
+  return pd.read_sql_query(
+    """
+    SELECT t.trial, t.status, COUNT(s.fold) AS folds, AVG(s.log_loss) AS log_loss,
+           AVG(s.auc) AS auc, AVG(s.accuracy) AS accuracy, SUM(s.fit_seconds) AS fit_seconds, t.params
+    FROM trials t LEFT JOIN fold_scores s ON s.search_id = t.search_id AND s.trial = t.trial
+    WHERE t.search_id = ?
+    GROUP BY t.trial
+    ORDER BY t.status = 'complete' DESC, folds DESC, log_loss
+    """,
+    store, params=(sid,),
+  )
+
+def tune(model_name='hgb', trials=27, eta=3, folds=9, min_train=0.5, seed=0, workers=None,
+         store_path=STORE_PATH, state_dir=fs.STATE_DIR):
+  X, y, event_dates = backtest.load_dataset(state_dir)
+  # Newest fold first, so the first rungs score on the most recent fights
+  splits = backtest.walk_forward_folds(event_dates, folds, min_train)[::-1]
+  workers = workers or os.cpu_count() or 1
+
+  settings = {'trials': trials, 'eta': eta, 'folds': folds, 'min_train': min_train, 'seed': seed}
+  sid = search_id(model_name, settings, X, y)
+  candidates = sample_trials(model_name, trials, seed)
+
+  store = open_store(store_path)
+  start_search(store, sid, model_name, settings, candidates)
+  scores = stored_scores(store, sid)
+  if scores:
+    print(f"Resuming search {sid}: {len(scores)} fold scores stored")
+
+  alive = list(range(trials))
+  with tempfile.TemporaryDirectory() as tmp:
+    paths = backtest.write_arrays(tmp, X, y)
+    threads = 1 if workers > 1 else None
+    with ProcessPoolExecutor(workers, initializer=backtest.init_worker, initargs=(paths, threads)) as pool:
+      for rung, budget in enumerate(rung_folds(len(splits), eta)):
+        start = time.perf_counter()
+        jobs = [(trial, fold) for trial in alive for fold in range(budget) if (trial, fold) not in scores]
+        futures = {
+          pool.submit(backtest.run_fold, model_name, *splits[fold], candidates[trial]): (trial, fold)
+          for trial, fold in jobs
+        }
+        for future in as_completed(futures):
+          trial, fold = futures[future]
+          result = future.result()
+          save_score(store, sid, trial, fold, result)
+          scores[(trial, fold)] = result['log_loss']
+
+        mean_loss = {trial: np.mean([scores[(trial, fold)] for fold in range(budget)]) for trial in alive}
+        ranked = sorted(alive, key=mean_loss.get)
+        if budget == len(splits):
+          set_status(store, sid, ranked, 'complete')
+          alive = ranked
+        else:
+          keep = max(1, len(alive) // eta)
+          set_status(store, sid, ranked[keep:], 'pruned')
+          alive = ranked[:keep]
+
+        print(f"Rung {rung}: {len(jobs)} fits on {budget} of {len(splits)} folds in {time.perf_counter() - start:.1f} s, "
+              f"{len(alive)} trials left, best log loss {mean_loss[ranked[0]]:.4f}")
+
+  board = leaderboard(store, sid)
+  store.close()
+  return sid, candidates[alive[0]], board
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--model", choices=list(SEARCH_SPACES), default='hgb')
+  parser.add_argument("--trials", type=int, default=27)
+  parser.add_argument("--eta", type=int, default=3, help="keep the best 1/eta trials at each rung")
+  parser.add_argument("--folds", type=int, default=9)
+  parser.add_argument("--min-train", type=float, default=0.5, help="share of event dates only ever trained on")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--workers", type=int, help="processes, default one per core")
+  parser.add_argument("--store", default=str(STORE_PATH))
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  sid, best, board = tune(args.model, args.trials, args.eta, args.folds, args.min_train,
+                          args.seed, args.workers, args.store)
+
+  with pd.option_context('display.float_format', '{:.4f}'.format, 'display.width', 160,
+                         'display.max_colwidth', 120):
+    print(board.head(10).to_string(index=False))
+  print(f"Search {sid} finished in {time.perf_counter() - start:.1f} s, best parameters:")
+  print(json.dumps(best, indent=2))
+
+
+if __name__ == "__main__":
+  main()